@@ -1,17 +1,20 @@
 import os
 import yt_dlp
 import json
-from flask import Flask, request, send_file, render_template, redirect, url_for, jsonify, session
+from flask import Flask, request, send_file, send_from_directory, render_template, redirect, url_for, jsonify, session
 from werkzeug.utils import secure_filename
 
 from karaoke_generator import create, create_with_manual_lyrics, generate_instrumental
 from gpu_utils import print_system_summary
+from config import PERFIL_RENDER_DEFECTO, PERFILES_RENDER_PUBLICOS
 from database import init_database
 from security_config import setup_security, validate_file_size, sanitize_filename
 
 #meter celery no proyecto
 from celery_app import celery
-from celery_tasks import process_automatic_karaoke, process_manual_lyrics_karaoke, process_instrumental_only
+from celery_tasks import process_automatic_karaoke, process_manual_lyrics_karaoke, process_instrumental_only, burn_karaoke_video
+from lyrics_timeline import timeline_filename
+from utils import karaoke_base_name
 
 app = Flask(__name__)
 
@@ -20,6 +23,7 @@ init_database()
 
 DIRECTORIO_ENTRADA = "input"
 DIRECTORIO_SAIDA = "output"
+DIRECTORIO_FONTES = "fonts"
 os.makedirs(DIRECTORIO_ENTRADA, exist_ok=True)
 os.makedirs(DIRECTORIO_SAIDA, exist_ok=True)
 
@@ -38,6 +42,12 @@ def archivo_instrumental_permitido(nome_arquivo: str) -> bool:
     return "." in nome_arquivo and nome_arquivo.rsplit(".", 1)[1].lower() in EXTENSIONES_INSTRUMENTAL_PERMITIDAS
 
 
+# perfil de render do formulario. Solo os publicos: o "preview" é interno e calquera outro valor vai ao de por defecto
+def perfil_render_formulario() -> str:
+    perfil = request.form.get("render_profile", PERFIL_RENDER_DEFECTO).strip()
+    return perfil if perfil in PERFILES_RENDER_PUBLICOS else PERFIL_RENDER_DEFECTO
+
+
 def descargar_video_youtube(url: str, directorio_saida: str = DIRECTORIO_ENTRADA) -> str:
     """ Funcion para descargar un video de YT e devolve a ruta do mp4 descargado """
 
@@ -89,12 +99,15 @@ def xerar_karaoke():
     enable_diarization = request.form.get("enable_diarization") == "true"
     hf_token = request.form.get("hf_token", "").strip() if enable_diarization else None
     whisper_model = request.form.get("whisper_model", "small").strip()  #para poder elixir modelo de whisper na interface
+    render_profile = perfil_render_formulario()  #calidade/velocidade do render final
+    burn_subtitles = request.form.get("no_burn") != "true"   #sen queimar: as letras debuxaas o reprodutor
     
     source_type = "upload" if arquivo_subido else "youtube"
     source_url = url_youtube if not arquivo_subido else None
     
     task = process_automatic_karaoke.delay(
-        ruta_video, enable_diarization, hf_token, whisper_model, source_type, source_url, True
+        ruta_video, enable_diarization, hf_token, whisper_model, source_type, source_url, True, render_profile,
+        burn_subtitles
     )
     
     session['current_task_id'] = task.id
@@ -132,13 +145,15 @@ def procesar_letras_manuales():
     enable_diarization = request.form.get("enable_diarization") == "true"
     hf_token = request.form.get("hf_token", "").strip() if enable_diarization else None
     whisper_model = request.form.get("whisper_model", "small").strip() #o mesmo, para elegir modelo de whisper
+    render_profile = perfil_render_formulario()
+    burn_subtitles = request.form.get("no_burn") != "true"
     
     source_type = "upload" if arquivo_subido else "youtube"
     source_url = url_youtube if not arquivo_subido else None
     
     task = process_manual_lyrics_karaoke.delay(
         ruta_video, letra_manual, None, enable_diarization, hf_token, whisper_model,
-        source_type, source_url, True
+        source_type, source_url, True, render_profile, burn_subtitles
     )
     
     session['current_task_id'] = task.id
@@ -196,7 +211,8 @@ def estado_tarea(task_id):
                 'state': task_result.state,
                 'status': task_result.info.get('status', 'Procesando...'),
                 'current': task_result.info.get('current', 0),
-                'total': task_result.info.get('total', 100)
+                'total': task_result.info.get('total', 100),
+                'preview': task_result.info.get('preview')    #previsualizacion xa lista mentres segue o render final
             }
         elif task_result.state == 'SUCCESS':
             response = {
@@ -211,6 +227,11 @@ def estado_tarea(task_id):
                 'status': task_result.info.get('status', 'Erro en procesameento'),
                 'error': str(task_result.info.get('error', 'Erro descoñecido'))
             }
+        elif task_result.state == 'RETRY':
+            response = {
+                'state': task_result.state,
+                'status': 'Fallou un paso, retomando dende o último completado...'
+            }
         elif task_result.state == 'REVOKED':
             response = {
                 'state': task_result.state,
@@ -268,7 +289,7 @@ def descargar_resultado_tarea(task_id):
         task_type = session.get('task_type', 'unknown')
         if task_type in ['automatic', 'manual_lyrics']:
             return redirect(url_for('reproductor_karaoke', filename=resultado))
-        elif task_type == 'instrumental':
+        elif task_type in ['instrumental', 'burn']:
             ruta_saida = os.path.join(DIRECTORIO_SAIDA, resultado)
             if os.path.exists(ruta_saida):
                 return send_file(ruta_saida, as_attachment=True, download_name=resultado)
@@ -300,19 +321,58 @@ def descargar_resultado_tarea(task_id):
 def reproductor_karaoke(filename):
 
     ruta_video = os.path.join(DIRECTORIO_SAIDA, filename)
-    if not os.path.exists(ruta_video):
-        return "Arquivo non encontrado", 404
+    nome_base = karaoke_base_name(filename)
     
-    if filename.startswith("karaoke_manual_"):
-        nome_base = filename.replace("karaoke_manual_", "").replace(".mp4", "")
-    elif filename.startswith("karaoke_"):
-        nome_base = filename.replace("karaoke_", "").replace(".mp4", "")
-    else:
-        nome_base = filename.replace(".mp4", "")
+    #modo sen queimar: non hai mp4 coas letras, reproducese o video sen audio e as letras debuxanse no navegador
+    sen_queimar = False
+    if not os.path.exists(ruta_video):
+        video_solo = filename.replace(".mp4", "_video_only.mp4")
+        if not (os.path.exists(os.path.join(DIRECTORIO_SAIDA, video_solo)) and
+                os.path.exists(os.path.join(DIRECTORIO_SAIDA, timeline_filename(filename)))):
+            return "Arquivo non encontrado", 404
+        sen_queimar = True
     
     return render_template("player.html", 
                          video_filename=filename,
-                         base_name=nome_base)
+                         base_name=nome_base,
+                         no_burn=sen_queimar)
+
+
+# Timeline das letras para o canvas do reprodutor. Co ETag o navegador revalida e se non cambiou recibe un 304
+@app.route("/api/lyrics/<song>")
+def letras_timeline(song):
+
+    ruta_timeline = os.path.join(DIRECTORIO_SAIDA, f"lyrics_{secure_filename(song)}.json")
+    if not os.path.exists(ruta_timeline):
+        return jsonify({'error': 'Non hai letras para esta canción'}), 404
+    
+    response = send_file(ruta_timeline, mimetype='application/json', etag=True, conditional=True)
+    response.cache_control.no_cache = True
+    return response
+
+
+# Queimar as letras dun karaoke sen queimar para descargalo. Se xa existe descargase directamente
+@app.route("/burn/<filename>", methods=["POST"])
+def queimar_karaoke(filename):
+
+    if os.path.exists(os.path.join(DIRECTORIO_SAIDA, filename)):
+        return redirect(url_for('descargar_archivo', filename=filename))
+    if not os.path.exists(os.path.join(DIRECTORIO_SAIDA, timeline_filename(filename))):
+        return "Arquivo non encontrado", 404
+    
+    render_profile = perfil_render_formulario()
+    task = burn_karaoke_video.delay(filename, render_profile)
+    
+    session['current_task_id'] = task.id
+    session['task_type'] = 'burn'
+    
+    return redirect(url_for('mostrar_progreso', task_id=task.id))
+
+
+# fontes para que o canvas do reprodutor use a mesma que o render
+@app.route("/fonts/<path:filename>")
+def servir_fonte(filename):
+    return send_from_directory(DIRECTORIO_FONTES, filename)
 
 
 @app.route("/serve_video/<filename>")
@@ -431,6 +491,7 @@ def borrar_cancion_biblioteca(song_id):
         
         if song['karaoke_filename']:
             arquivos_para_borrar.append(os.path.join(DIRECTORIO_SAIDA, song['karaoke_filename']))        
+            arquivos_para_borrar.append(os.path.join(DIRECTORIO_SAIDA, timeline_filename(song['karaoke_filename'])))
         if song['video_only_filename']:
             arquivos_para_borrar.append(os.path.join(DIRECTORIO_SAIDA, song['video_only_filename']))        
         if song['vocal_filename']:
@@ -0,0 +1,197 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from config import CACHE_ARTEFACTOS, DIRECTORIO_CACHE, TAMAÑO_MAXIMO_CACHE
+from utils import link_or_copy
+
+# Cache de artefactos por contido: cada etapa cara (normalizacion, extraccion do audio, demucs, transcripcion,
+# aliñacion) garda o seu resultado en DIRECTORIO_CACHE/<etapa>/<clave>/, onde a clave é o hash do contido da
+# entrada mais os parametros da etapa. Volver procesar a mesma cancion (outro whisper_model, pasar de automatico
+# a letra manual...) reutiliza todo o que non cambia, sobre todo o demucs.
+# Cada entrada é un directorio que se crea enteiro nun temporal e se renomea, asi varios workers poden
+# compartir a cache sen indice. O LRU vai polo mtime do directorio, que se actualiza en cada acerto
+
+NOME_JSON = "datos.json"
+TAMAÑO_BLOQUE_HASH = 1024 * 1024
+
+# acertos/fallos por etapa neste proceso
+ESTATISTICAS_CACHE_ARTEFACTOS = {}
+
+# hash xa calculado de cada archivo, por (ruta, mtime, tamaño), para non ler o mismo video dúas veces nun traballo
+_HASHES_MEDIA = {}
+
+
+def media_hash(ruta: str) -> str:
+    estado = os.stat(ruta)
+    clave = (os.path.abspath(ruta), estado.st_mtime_ns, estado.st_size)
+    if clave not in _HASHES_MEDIA:
+        resumo = hashlib.sha256()
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(TAMAÑO_BLOQUE_HASH), b""):
+                resumo.update(bloque)
+        _HASHES_MEDIA[clave] = resumo.hexdigest()
+    return _HASHES_MEDIA[clave]
+
+
+# clave dunha etapa: hash da entrada + parametros (calquera cousa serializable en JSON)
+def artifact_key(ruta_entrada: str, **parametros) -> str:
+    datos = {"media": media_hash(ruta_entrada), **parametros}
+    return hashlib.sha256(json.dumps(datos, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _directorio_entrada(etapa: str, clave: str) -> str:
+    return os.path.join(DIRECTORIO_CACHE, etapa, clave)
+
+
+def _rexistrar(etapa: str, acerto: bool):
+    contadores = ESTATISTICAS_CACHE_ARTEFACTOS.setdefault(etapa, {"hits": 0, "misses": 0})
+    contadores["hits" if acerto else "misses"] += 1
+
+
+# Copia (hardlink se se pode) os archivos dunha entrada nas rutas de destino. destinos: {nome na cache: ruta}.
+# Devolve False se non está (ou a cache está desactivada) e hai que facer a etapa
+def fetch_artifact_files(etapa: str, clave: str, destinos: dict) -> bool:
+    if not CACHE_ARTEFACTOS:
+        return False
+    directorio = _directorio_entrada(etapa, clave)
+    if not all(os.path.exists(os.path.join(directorio, nome)) for nome in destinos):
+        _rexistrar(etapa, False)
+        return False
+    try:
+        for nome, destino in destinos.items():
+            link_or_copy(os.path.join(directorio, nome), destino)
+        os.utime(directorio)
+    except OSError as e:
+        print(f"Non se puido recuperar {etapa} da cache: {e}")
+        _rexistrar(etapa, False)
+        return False
+    _rexistrar(etapa, True)
+    print(f"Cache de artefactos: {etapa} recuperado da cache")
+    return True
+
+
+# Garda os archivos dunha etapa. orixes: {nome na cache: ruta}. Os errores non paran o traballo, solo se avisa
+def store_artifact_files(etapa: str, clave: str, orixes: dict) -> bool:
+    if not CACHE_ARTEFACTOS:
+        return False
+    directorio = _directorio_entrada(etapa, clave)
+    if os.path.exists(directorio):
+        return True
+    temporal = None
+    try:
+        os.makedirs(os.path.dirname(directorio), exist_ok=True)
+        temporal = tempfile.mkdtemp(prefix=".tmp_", dir=os.path.dirname(directorio))
+        for nome, orixe in orixes.items():
+            link_or_copy(orixe, os.path.join(temporal, nome))
+        os.rename(temporal, directorio)
+        temporal = None
+    except OSError as e:
+        if not os.path.exists(directorio):     #se outro worker a gardou antes xa vale
+            print(f"Non se puido gardar {etapa} na cache: {e}")
+            return False
+    finally:
+        if temporal:
+            shutil.rmtree(temporal, ignore_errors=True)
+    evict_artifacts()
+    return True
+
+
+def fetch_artifact_json(etapa: str, clave: str):
+    if not CACHE_ARTEFACTOS:
+        return None
+    directorio = _directorio_entrada(etapa, clave)
+    try:
+        with open(os.path.join(directorio, NOME_JSON), "r", encoding="utf-8") as f:
+            datos = json.load(f)
+        os.utime(directorio)
+    except (OSError, ValueError):
+        _rexistrar(etapa, False)
+        return None
+    _rexistrar(etapa, True)
+    print(f"Cache de artefactos: {etapa} recuperado da cache")
+    return datos
+
+
+def store_artifact_json(etapa: str, clave: str, datos) -> bool:
+    if not CACHE_ARTEFACTOS:
+        return False
+    directorio_etapa = os.path.join(DIRECTORIO_CACHE, etapa)
+    ruta_temporal = None
+    try:
+        os.makedirs(directorio_etapa, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directorio_etapa, prefix=".tmp_",
+                                         suffix=".json", delete=False) as f:
+            ruta_temporal = f.name
+            json.dump(datos, f, ensure_ascii=False)
+        return store_artifact_files(etapa, clave, {NOME_JSON: ruta_temporal})
+    except Exception as e:
+        print(f"Non se puido gardar {etapa} na cache: {e}")
+        return False
+    finally:
+        if ruta_temporal and os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+
+
+def _tamaño_directorio(directorio: str) -> int:
+    total = 0
+    for raiz, _, archivos in os.walk(directorio):
+        for nome in archivos:
+            try:
+                total += os.path.getsize(os.path.join(raiz, nome))
+            except OSError:
+                pass
+    return total
+
+
+def _entradas_cache() -> list:
+    entradas = []
+    if not os.path.isdir(DIRECTORIO_CACHE):
+        return entradas
+    for etapa in os.listdir(DIRECTORIO_CACHE):
+        directorio_etapa = os.path.join(DIRECTORIO_CACHE, etapa)
+        if not os.path.isdir(directorio_etapa):
+            continue
+        for clave in os.listdir(directorio_etapa):
+            if clave.startswith(".tmp_"):
+                continue
+            directorio = os.path.join(directorio_etapa, clave)
+            try:
+                entradas.append((os.path.getmtime(directorio), _tamaño_directorio(directorio), directorio))
+            except OSError:
+                continue
+    return entradas
+
+
+# Borra as entradas menos usadas ata que a cache ocupe menos de tamaño_maximo bytes
+def evict_artifacts(tamaño_maximo: int = TAMAÑO_MAXIMO_CACHE) -> int:
+    entradas = sorted(_entradas_cache())
+    ocupado = sum(tamaño for _, tamaño, _ in entradas)
+    borradas = 0
+    for _, tamaño, directorio in entradas:
+        if ocupado <= tamaño_maximo:
+            break
+        shutil.rmtree(directorio, ignore_errors=True)
+        ocupado -= tamaño
+        borradas += 1
+    if borradas:
+        print(f"Cache de artefactos: borradas {borradas} entradas antigas ({ocupado / 1024 ** 3:.1f} GB ocupados)")
+    return borradas
+
+
+def get_artifact_cache_stats() -> dict:
+    estatisticas = {}
+    for etapa, contadores in ESTATISTICAS_CACHE_ARTEFACTOS.items():
+        total = contadores["hits"] + contadores["misses"]
+        estatisticas[etapa] = {
+            "hits": contadores["hits"],
+            "misses": contadores["misses"],
+            "hit_ratio": (contadores["hits"] / total) if total else 0.0
+        }
+    return estatisticas
+
+
+def reset_artifact_cache_stats():
+    ESTATISTICAS_CACHE_ARTEFACTOS.clear()
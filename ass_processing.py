@@ -0,0 +1,217 @@
+import numpy as np
+
+from config import (ANCHO_VIDEO, ALTO_VIDEO, FPS_VIDEO, COR_TEXTO, COR_RESALTADO, COR_CONTORNO_TEXTO,
+                    GROSOR_CONTORNO_TEXTO, TAMAÑO_FONTE, FACTOR_FONTE_LIÑA_SEGUINTE, FONTE, TEXT_CLIP_WIDTH,
+                    COR_FONDO_TEXTO, PADDING_FONDO_TEXTO, COR_LIÑA_SEGUINTE, ALPHA_LIÑA_SEGUINTE,
+                    ESPACIADO_LIÑAS, MOSTRAR_LIÑA_SEGUINTE, TAMAÑO_FONTE_MIN)
+from karaoke_rendering import (build_line_layout, build_highlight_schedule, OverlayKaraoke, _cargar_fonte,
+                               _axustar_liñas, _ancho_texto)
+
+# Exportar os grupos de frases a Advanced SubStation Alpha (.ass) para queimalos co filtro subtitles= do ffmpeg (libass).
+# O layout (wrap, posicions das silabas) e os tempos de resaltado sacanse do mismo codigo que o render con PIL,
+# asi que o resultado ten que verse practicamente igual. Cada liña visual é un Dialogue con \pos e tags \k por silaba.
+# Os colores dos speakers xa ven en cada palabra (asignados con assign_colors_to_speakers no servicio de whisperx)
+
+
+# ASS garda os colores como &HAABBGGRR, e a alpha ao reves (00 opaco, FF transparente)
+def _cor_ass(cor_hex: str, alpha: int = 255) -> str:
+    cor = cor_hex.lstrip("#")
+    r, g, b = cor[0:2], cor[2:4], cor[4:6]
+    return f"&H{255 - alpha:02X}{b}{g}{r}".upper()
+
+
+def _tempo_ass(centesimas: int) -> str:
+    centesimas = max(int(centesimas), 0)
+    horas, resto = divmod(centesimas, 360000)
+    minutos, resto = divmod(resto, 6000)
+    segundos, cs = divmod(resto, 100)
+    return f"{horas}:{minutos:02d}:{segundos:02d}.{cs:02d}"
+
+
+# as chaves e barras rompen os tags de override, non hai escape oficial asi que se cambian
+def _escapar_texto(texto: str) -> str:
+    return texto.replace("\\", "/").replace("{", "(").replace("}", ")")
+
+
+# libass toma o tamaño da fonte como alto da celda (ascent + descent), PIL como tamaño do em.
+# Para que as silabas ocupen o mismo ancho que no render de PIL convertese o tamaño
+def _tamaño_fonte_ass(tamaño_pil: int) -> int:
+    ascent, descent = _cargar_fonte(FONTE, tamaño_pil).getmetrics()
+    return ascent + descent
+
+
+def _nome_fonte() -> str:
+    try:
+        return _cargar_fonte(FONTE, TAMAÑO_FONTE).getname()[0]
+    except Exception:
+        return "Arial"
+
+
+# rectangulo con esquinas redondeadas en modo debuxo (\p1), igual que o rounded_rectangle do render
+def _rectangulo_ass(ancho: float, alto: float, radio: float = 0) -> str:
+    ancho, alto = round(ancho), round(alto)
+    if radio <= 0:
+        return f"m 0 0 l {ancho} 0 {ancho} {alto} 0 {alto}"
+    r = round(radio)
+    k = round(radio * 0.45)   #aproximacion de cuarto de circulo con bezier
+    return (f"m {r} 0 l {ancho - r} 0 b {ancho - k} 0 {ancho} {k} {ancho} {r} "
+            f"l {ancho} {alto - r} b {ancho} {alto - k} {ancho - k} {alto} {ancho - r} {alto} "
+            f"l {r} {alto} b {k} {alto} 0 {alto - k} 0 {alto - r} "
+            f"l 0 {r} b 0 {k} {k} 0 {r} 0")
+
+
+def _dialogue(capa: int, inicio_cs: int, fin_cs: int, estilo: str, texto: str) -> str:
+    return f"Dialogue: {capa},{_tempo_ass(inicio_cs)},{_tempo_ass(fin_cs)},{estilo},,0,0,0,,{texto}"
+
+
+# Instante (en centesimas, global) no que se resalta cada unidade, sacado do programa de resaltado por frames.
+# A unidade j resaltase no primeiro frame no que o contador pasa de j. Se nunca chega queda en None
+def _instantes_resaltado(grupo: dict, layout, inicio: float, duracion: float, advance: float, fps: float) -> list:
+    primeiro_frame, programa = build_highlight_schedule(grupo, layout, fps, duracion, advance, inicio)
+    instantes = []
+    for j in range(len(layout.unidades)):
+        frames = np.flatnonzero(programa > j)
+        if len(frames):
+            instantes.append(int(round((primeiro_frame + frames[0]) / fps * 100)))
+        else:
+            instantes.append(None)
+    return instantes
+
+
+# Texto con \k dunha liña visual. Os \k van relativos ao inicio do Dialogue, o primeiro tag baleiro
+# leva o retraso ata a primeira silaba da liña
+def _texto_karaoke(unidades: list, instantes: list, inicio_cs: int, fin_cs: int) -> str:
+    nunca = fin_cs - inicio_cs + 100
+    relativos = [nunca if instante is None else max(instante - inicio_cs, 0) for instante in instantes]
+
+    partes = [f"{{\\k{relativos[0]}}}"] if relativos[0] > 0 else []
+    cor_actual = _cor_ass(COR_RESALTADO)
+    for i, unidade in enumerate(unidades):
+        cor = _cor_ass(unidade.cor_resaltado)
+        duracion = relativos[i + 1] - relativos[i] if i + 1 < len(unidades) else max(nunca - relativos[i], 0)
+        tag = f"\\k{max(duracion, 0)}"
+        if cor != cor_actual:
+            tag = f"\\1c{cor[:2]}{cor[4:]}&" + tag     #\1c non leva alpha
+            cor_actual = cor
+        texto = _escapar_texto(unidade.texto)
+        # espacio despois da ultima silaba de cada palabra
+        if i + 1 < len(unidades) and unidades[i + 1].indice_palabra != unidade.indice_palabra:
+            texto += " "
+        partes.append(f"{{{tag}}}{texto}")
+    return "".join(partes)
+
+
+# Dialogues dunha liña (fondo + texto con \k, e a liña seguinte) para un tramo [inicio_cs, fin_cs) no que é a activa
+def _eventos_liña(grupo: dict, seguinte: dict, layout, instantes: list, inicio_cs: int, fin_cs: int,
+                  capa_base: int, posicion_y: int) -> list:
+    eventos = []
+    x_canvas = (ANCHO_VIDEO - TEXT_CLIP_WIDTH) / 2
+
+    fondo = _rectangulo_ass(layout.ancho_fondo, layout.altura, 10)
+    eventos.append(_dialogue(capa_base, inicio_cs, fin_cs, "Fondo",
+                             f"{{\\an7\\pos({x_canvas + layout.x_fondo:.2f},{posicion_y})\\p1}}{fondo}{{\\p0}}"))
+
+    for liña_visual in range(len(layout.liñas)):
+        indices = [i for i, u in enumerate(layout.unidades) if u.liña_visual == liña_visual]
+        if not indices:
+            continue
+        unidades = [layout.unidades[i] for i in indices]
+        x = x_canvas + unidades[0].x
+        y = posicion_y + unidades[0].y
+        texto = _texto_karaoke(unidades, [instantes[i] for i in indices], inicio_cs, fin_cs)
+        eventos.append(_dialogue(capa_base + 1, inicio_cs, fin_cs, "Karaoke",
+                                 f"{{\\an7\\pos({x:.2f},{y})}}{texto}"))
+
+    if MOSTRAR_LIÑA_SEGUINTE and seguinte:
+        eventos.extend(_eventos_liña_seguinte(seguinte, inicio_cs, fin_cs, capa_base,
+                                              posicion_y + layout.altura + ESPACIADO_LIÑAS))
+    return eventos
+
+
+# mesmas medidas que render_next_line_rgba
+def _eventos_liña_seguinte(grupo: dict, inicio_cs: int, fin_cs: int, capa_base: int, posicion_y: int) -> list:
+    font_size = int(TAMAÑO_FONTE * FACTOR_FONTE_LIÑA_SEGUINTE)
+    texto_completo = grupo["line_text"]
+    tamaño_fonte = font_size
+    if len(texto_completo) > 100:
+        factor_reduccion = min(1.0, 100 / len(texto_completo))
+        tamaño_fonte = int(max(TAMAÑO_FONTE_MIN * FACTOR_FONTE_LIÑA_SEGUINTE, int(font_size * factor_reduccion)))
+    fonte = _cargar_fonte(FONTE, tamaño_fonte)
+    liñas = _axustar_liñas(texto_completo, fonte, TEXT_CLIP_WIDTH - 2 * PADDING_FONDO_TEXTO)
+    altura_liña = tamaño_fonte + 10
+    altura_total = len(liñas) * altura_liña + 2 * PADDING_FONDO_TEXTO
+    ancho_fondo = min(max(_ancho_texto(fonte, liña) for liña in liñas) + 2 * PADDING_FONDO_TEXTO, TEXT_CLIP_WIDTH)
+    x_canvas = (ANCHO_VIDEO - TEXT_CLIP_WIDTH) / 2
+
+    alpha_fondo = int(COR_FONDO_TEXTO[3] * ALPHA_LIÑA_SEGUINTE)
+    eventos = [_dialogue(capa_base, inicio_cs, fin_cs, "Fondo",
+                         f"{{\\an7\\pos({x_canvas + (TEXT_CLIP_WIDTH - ancho_fondo) // 2:.2f},{posicion_y})"
+                         f"\\1a&H{255 - alpha_fondo:02X}&\\p1}}{_rectangulo_ass(ancho_fondo, altura_total)}{{\\p0}}")]
+    for i, liña in enumerate(liñas):
+        x = x_canvas + (TEXT_CLIP_WIDTH - _ancho_texto(fonte, liña)) // 2
+        y = posicion_y + i * altura_liña + PADDING_FONDO_TEXTO
+        eventos.append(_dialogue(capa_base + 1, inicio_cs, fin_cs, "Seguinte",
+                                 f"{{\\an7\\pos({x:.2f},{y})\\fs{_tamaño_fonte_ass(tamaño_fonte)}}}{_escapar_texto(liña)}"))
+    return eventos
+
+
+def build_ass_document(grupos: list, advance: float = 0.5, duration_padding: float = 0.5,
+                       fps: float = FPS_VIDEO) -> str:
+
+    nome_fonte = _nome_fonte()
+    tamaño_principal = _tamaño_fonte_ass(TAMAÑO_FONTE)
+    tamaño_seguinte = _tamaño_fonte_ass(int(TAMAÑO_FONTE * FACTOR_FONTE_LIÑA_SEGUINTE))
+    contorno = _cor_ass(COR_CONTORNO_TEXTO)
+    fondo = _cor_ass("#{:02X}{:02X}{:02X}".format(*COR_FONDO_TEXTO[:3]), COR_FONDO_TEXTO[3])
+
+    # no karaoke de ASS a PrimaryColour é a cor xa cantada e a SecondaryColour a que falta por cantar
+    cabeceira = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {ANCHO_VIDEO}",
+        f"PlayResY: {ALTO_VIDEO}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+        "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, "
+        "MarginL, MarginR, MarginV, Encoding",
+        f"Style: Karaoke,{nome_fonte},{tamaño_principal},{_cor_ass(COR_RESALTADO)},{_cor_ass(COR_TEXTO)},"
+        f"{contorno},{contorno},0,0,0,0,100,100,0,0,1,{GROSOR_CONTORNO_TEXTO},0,7,0,0,0,1",
+        f"Style: Seguinte,{nome_fonte},{tamaño_seguinte},{_cor_ass(COR_LIÑA_SEGUINTE)},{_cor_ass(COR_LIÑA_SEGUINTE)},"
+        f"{contorno},{contorno},0,0,0,0,100,100,0,0,1,{int(GROSOR_CONTORNO_TEXTO * 0.75)},0,7,0,0,0,1",
+        f"Style: Fondo,{nome_fonte},{tamaño_principal},{fondo},{fondo},{fondo},{fondo},"
+        "0,0,0,0,100,100,0,0,1,0,0,7,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+
+    overlay = OverlayKaraoke(grupos, advance=advance, duration_padding=duration_padding)
+    layouts = {}
+    instantes = {}
+    eventos = []
+    for inicio, fin, indice, posicion in overlay.tramos_visibles():
+        grupo = grupos[indice]
+        if indice not in layouts:
+            layouts[indice] = build_line_layout(grupo)
+            instantes[indice] = _instantes_resaltado(grupo, layouts[indice], overlay.inicios[posicion],
+                                                     overlay.fins[posicion] - overlay.inicios[posicion], advance, fps)
+        seguinte = grupos[indice + 1] if indice + 1 < len(grupos) else None
+        eventos.extend(_eventos_liña(grupo, seguinte, layouts[indice], instantes[indice],
+                                     int(round(inicio * 100)), int(round(fin * 100)), 0, overlay.posicion_y))
+
+    return "\n".join(cabeceira + eventos) + "\n"
+
+
+def write_ass_file(grupos: list, ruta_ass: str, advance: float = 0.5, duration_padding: float = 0.5) -> str:
+    try:
+        contido = build_ass_document(grupos, advance=advance, duration_padding=duration_padding)
+        with open(ruta_ass, "w", encoding="utf-8") as f:
+            f.write(contido)
+        print(f"Subtitulos ASS gardados en {ruta_ass}")
+        return ruta_ass
+    except Exception as e:
+        print(f"Error xerando o ASS: {e}")
+        return ""
@@ -3,52 +3,141 @@ import subprocess
 import shutil
 import requests
 import torch
-from moviepy.editor import AudioFileClip
 from gpu_utils import detect_gpu_capability, get_optimal_demucs_args
+from config import VOLUME_VOCAL, FREQUENCIA_AUDIO_SEPARACION, CANLES_AUDIO_SEPARACION
+from artifact_cache import artifact_key, fetch_artifact_files, store_artifact_files, fetch_artifact_json, store_artifact_json
 
 #añador esto para detectas as capacidades da gpu en general, non solo do meu equipo
 GPU_INFO = detect_gpu_capability()
 DEMUCS_ARGS = get_optimal_demucs_args(GPU_INFO)
 
-def video_to_mp3(video_path: str) -> str:
 
-    
-    if video_path.lower().endswith('.mp3'):
+# parametros do demucs que cambian o resultado, para a clave da cache (o device e os jobs non, asi os stems
+# feitos en gpu valen tamen nun worker sen gpu)
+def _parametros_demucs() -> list:
+    parametros = []
+    saltar = False
+    for arg in DEMUCS_ARGS:
+        if saltar:
+            saltar = False
+        elif arg in ("--device", "--jobs"):
+            saltar = True
+        else:
+            parametros.append(arg)
+    return parametros
+
+
+# clave da cache ou None se non se pode ler a entrada (a etapa faise igual, solo non se garda)
+def _clave_cache(ruta: str, **parametros):
+    try:
+        return artifact_key(ruta, **parametros)
+    except OSError as e:
+        print(f"Non se puido calcular a clave da cache: {e}")
+        return None
+
+# Extrae o audio nun WAV PCM float32 a FREQUENCIA_AUDIO_SEPARACION estereo cun solo ffmpeg, que é o que le o demucs.
+# Antes pasaba por moviepy a mp3 e o demucs volvia decodificalo: unha codificacion con perdas e un remostreo mais.
+# Se a entrada xa é un WAV non se fai nada. directorio_saida: onde deixar o WAV (o directorio do traballo),
+# sen el vai ao lado do video
+def extract_audio_wav(video_path: str, directorio_saida: str = None) -> str:
+
+    if video_path.lower().endswith('.wav'):
         if os.path.exists(video_path):
             return video_path
         else:
-            print(f"Archivo MP3 non encontrado: {video_path}")
+            print(f"Archivo WAV non encontrado: {video_path}")
             return ""
     
-    ruta_audio = video_path.replace(".mp4", ".mp3")
+    ruta_audio = os.path.splitext(video_path)[0] + ".wav"
+    if directorio_saida:
+        ruta_audio = os.path.join(directorio_saida, os.path.basename(ruta_audio))
     if os.path.exists(ruta_audio):
         return ruta_audio
 
+    parametros = dict(formato="pcm_f32le", frecuencia=FREQUENCIA_AUDIO_SEPARACION, canles=CANLES_AUDIO_SEPARACION)
+    clave_cache = _clave_cache(video_path, **parametros)
+    if clave_cache and fetch_artifact_files("audio", clave_cache, {"audio.wav": ruta_audio}):
+        return ruta_audio
+
+    # escribese nun temporal e renomease, un WAV a medias non pode quedar coma se a extraccion estivese feita
+    ruta_temporal = ruta_audio.replace(".wav", ".part.wav")
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-map", "0:a:0",
+        "-vn",
+        "-ac", str(CANLES_AUDIO_SEPARACION),
+        "-ar", str(FREQUENCIA_AUDIO_SEPARACION),
+        "-c:a", "pcm_f32le",
+        ruta_temporal
+    ]
     try:
-        clip_audio = AudioFileClip(video_path)
-        clip_audio.write_audiofile(ruta_audio, logger="bar")
-    except Exception as e:
-        print(f" error ao convertir video a mp3: {e}")
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        os.replace(ruta_temporal, ruta_audio)
+    except subprocess.CalledProcessError as e:
+        print(f" error extraendo o audio: {e.stderr[-2000:] if e.stderr else e}")
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        return ""
+    except OSError as e:
+        print(f" error extraendo o audio: {e}")
         return ""
 
+    if clave_cache:
+        store_artifact_files("audio", clave_cache, {"audio.wav": ruta_audio})
     return ruta_audio
 
 
 #Funcion para usar demucs, separa as pistas de audio. Esto devolve a ruta da voz e a ruta da instrumental. ahora detecta a gpu automaticamente
-def separate_stems_cli(audio_file_path: str) -> tuple[str, str]:
+# Mestura do audio final (instrumental + voces a VOLUME_VOCAL) feita unha vez co ffmpeg e codificada a AAC.
+# Despois os videos solo copian este stream, antes cada write_videofile volvia mesturar en python e codificar.
+# amix divide entre o numero de entradas, por eso o volume=2 do final (queda igual que o CompositeAudioClip)
+def mix_audio_tracks(ruta_musica: str, ruta_voz: str, ruta_saida: str, bitrate: str = "192k") -> str:
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", ruta_musica,
+        "-i", ruta_voz,
+        "-filter_complex", f"[1:a]volume={VOLUME_VOCAL}[voz];[0:a][voz]amix=inputs=2:duration=longest,volume=2[audio]",
+        "-map", "[audio]",
+        "-ar", "44100",
+        "-c:a", "aac",
+        "-b:a", bitrate,
+        ruta_saida
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Error mesturando o audio: {e.stderr[-2000:] if e.stderr else e}")
+        return ""
+    if not os.path.exists(ruta_saida) or os.path.getsize(ruta_saida) == 0:
+        print("Non se xerou o audio mesturado")
+        return ""
+    return ruta_saida
+
+
+# directorio_traballo: o directorio do traballo, ahi van a saida do demucs e os stems finais (ten que estar en /data
+# para que o servicio de whisperx lea as voces). Sen el usanse ./separated e /data coma antes
+def separate_stems_cli(audio_file_path: str, directorio_traballo: str = None) -> tuple[str, str]:
 
 
     if GPU_INFO['has_cuda']:
         print(f"GPU detectada: {GPU_INFO['gpu_name']} ({GPU_INFO['gpu_memory']:.1f}GB)")
     
-    directorio_saida = "./separated"
-    if not os.path.exists("./stems"):
-        os.makedirs("./stems")
+    directorio_saida = os.path.join(directorio_traballo, "separated") if directorio_traballo else "./separated"
+    directorio_stems = directorio_traballo or "/data"
 
     nombreArchivo = os.path.basename(audio_file_path)
     nombreBase = os.path.splitext(nombreArchivo)[0]
+    ruta_final_vocals = os.path.join(directorio_stems, f"vocals_{nombreBase}.wav")
+    ruta_final_musica = os.path.join(directorio_stems, f"music_{nombreBase}.wav")
+
+    # o demucs é a etapa mais cara, se este audio xa se separou cos mismos parametros non se volve facer
+    clave_cache = _clave_cache(audio_file_path, demucs=_parametros_demucs())
+    if clave_cache and fetch_artifact_files("stems", clave_cache, {"vocals.wav": ruta_final_vocals,
+                                                                   "music.wav": ruta_final_musica}):
+        return ruta_final_vocals, ruta_final_musica
 
-    cmd = ["demucs"] + DEMUCS_ARGS + [audio_file_path]
+    cmd = ["demucs"] + DEMUCS_ARGS + ["-o", directorio_saida, audio_file_path]
     #print(f"Comando demucs: {' '.join(cmd)}")
 
     try:
@@ -60,7 +149,8 @@ def separate_stems_cli(audio_file_path: str) -> tuple[str, str]:
         if GPU_INFO['recommended_device'] == 'cuda':
             print("problemas con gpu, vaise seguir con cpu")
             try:
-                cmd_cpu = ["demucs", "--device", "cpu", "--two-stems=vocals", "--jobs", "2", audio_file_path]
+                cmd_cpu = ["demucs", "--device", "cpu", "--two-stems=vocals", "--jobs", "2", "-o", directorio_saida,
+                           audio_file_path]
                 result = subprocess.run(cmd_cpu, check=True, capture_output=True, text=True)
             except subprocess.CalledProcessError as e2:
                 print(f"error tamen con cpu: {e2}")
@@ -101,15 +191,14 @@ def separate_stems_cli(audio_file_path: str) -> tuple[str, str]:
     if not os.path.exists(vocals_wav) or not os.path.exists(instrumental_wav):
         return "", ""
 
-    ruta_final_vocals = f"/data/vocals_{nombreBase}.wav"
-    ruta_final_musica = f"/data/music_{nombreBase}.wav"
-
     try:
         shutil.move(vocals_wav, ruta_final_vocals)
         shutil.move(instrumental_wav, ruta_final_musica)
     except Exception as e:
         return "", ""
 
+    if clave_cache:
+        store_artifact_files("stems", clave_cache, {"vocals.wav": ruta_final_vocals, "music.wav": ruta_final_musica})
     return ruta_final_vocals, ruta_final_musica
 
 
@@ -154,6 +243,14 @@ def call_whisperx_endpoint_manual(vocals_path: str, manual_lyrics: str, language
     if language:
         datos_envio["language"] = language
     
+    # a mesma voz coa mesma letra e parametros da a mesma aliñacion. Solo se garda se trae as palabras no JSON,
+    # a resposta dun servicio vello solo apunta a un SRT que non vai seguir ahi
+    clave_cache = _clave_cache(vocals_path, letra=manual_lyrics, language=language,
+                               diarization=enable_diarization, whisper_model=whisper_model)
+    if clave_cache:
+        datos = fetch_artifact_json("alignment", clave_cache)
+        if datos:
+            return datos
    
     if hf_token:
         datos_envio["hf_token"] = hf_token
@@ -162,6 +259,8 @@ def call_whisperx_endpoint_manual(vocals_path: str, manual_lyrics: str, language
         resposta = requests.post(url, json=datos_envio, timeout=600)
         if resposta.status_code == 200:
             datos = resposta.json()
+            if clave_cache and "word_segments" in datos:
+                store_artifact_json("alignment", clave_cache, datos)
             return datos  
         else:
             print("Fallo do alineamento forzado:", resposta.text)
@@ -173,7 +272,17 @@ def call_whisperx_endpoint_manual(vocals_path: str, manual_lyrics: str, language
 
 
 #Cambio obligado. Problemas con VAD de whisperx, voy a transcribir directamente con faster whisper e alinear con whisperx
-def transcribe_with_faster_whisper(audio_path: str, model_size: str = "tiny") -> str:
+#con return_language=True devolve (texto, idioma) para poder escoller o dicionario de silabas
+def transcribe_with_faster_whisper(audio_path: str, model_size: str = "tiny", return_language: bool = False):
+
+    clave_cache = _clave_cache(audio_path, whisper_model=model_size)
+    if clave_cache:
+        datos = fetch_artifact_json("transcript", clave_cache)
+        if datos:
+            print(f"Idioma detectado: {datos['language']}")
+            if return_language:
+                return datos["text"], datos["language"]
+            return datos["text"]
 
     try:
         from faster_whisper import WhisperModel
@@ -200,10 +309,16 @@ def transcribe_with_faster_whisper(audio_path: str, model_size: str = "tiny") ->
         
         transcribed_text = transcribed_text.strip()
         print(f"Transcricion: {len(transcribed_text)} caracteres")
+        if clave_cache and transcribed_text:
+            store_artifact_json("transcript", clave_cache, {"text": transcribed_text, "language": info.language})
         
+        if return_language:
+            return transcribed_text, info.language
         return transcribed_text
         
     except Exception as e:
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
+        if return_language:
+            return None, None
         return None
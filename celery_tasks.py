@@ -3,7 +3,9 @@ import time
 import traceback
 from celery import current_task
 from celery_app import celery, active_processes
-from karaoke_generator import create, create_with_manual_lyrics, generate_instrumental
+from karaoke_generator import create, create_with_manual_lyrics, generate_instrumental, burn_karaoke_from_timeline, resume_job
+from job_checkpoints import cleanup_job
+from config import REINTENTOS_TRABALLO
 import signal
 
 
@@ -27,9 +29,10 @@ def check_if_cancelled():
             pass
 
 
-@celery.task(bind=True, name='process_automatic_karaoke')
+@celery.task(bind=True, name='process_automatic_karaoke', acks_late=True)
 def process_automatic_karaoke(self, video_path, enable_diarization=False, hf_token=None, whisper_model="small",
-                             source_type="upload", source_url=None, save_to_db=True):
+                             source_type="upload", source_url=None, save_to_db=True, render_profile=None,
+                             burn_subtitles=True):
  
     task_id = self.request.id
     
@@ -44,7 +47,8 @@ def process_automatic_karaoke(self, video_path, enable_diarization=False, hf_tok
         
         #chamar a función orixinal pero con checkeos de cancelacion e actualizacións de progreso
         resultado = create_with_cancellation_check(
-            self, video_path, enable_diarization, hf_token, whisper_model, source_type, source_url, save_to_db
+            self, video_path, enable_diarization, hf_token, whisper_model, source_type, source_url, save_to_db,
+            render_profile, burn_subtitles, job_id=task_id
         )
         
         if not resultado:
@@ -57,11 +61,12 @@ def process_automatic_karaoke(self, video_path, enable_diarization=False, hf_tok
         }
         
     except ProcessingCancelledException:
-        cleanup_partial_files(video_path)
+        cleanup_partial_files(video_path, task_id)
         self.update_state(state='REVOKED', meta={'status': 'Procesamento cancelado'})
         raise ProcessingCancelledException("Procesamento cancelado")
         
     except Exception as e:
+        retry_from_checkpoint(self, e)
         error_msg = str(e)
         traceback_str = traceback.format_exc()
         print(f" Error en process_automatic_karaoke: {error_msg}")
@@ -75,10 +80,11 @@ def process_automatic_karaoke(self, video_path, enable_diarization=False, hf_tok
         return {'status': 'failed', 'error': error_msg, 'traceback': traceback_str}
 
 
-@celery.task(bind=True, name='process_manual_lyrics_karaoke')  
+@celery.task(bind=True, name='process_manual_lyrics_karaoke', acks_late=True)  
 def process_manual_lyrics_karaoke(self, video_path, manual_lyrics, language=None, 
                                  enable_diarization=False, hf_token=None, whisper_model="small",
-                                 source_type="upload", source_url=None, save_to_db=True):
+                                 source_type="upload", source_url=None, save_to_db=True, render_profile=None,
+                                 burn_subtitles=True):
 
     task_id = self.request.id
     
@@ -92,7 +98,7 @@ def process_manual_lyrics_karaoke(self, video_path, manual_lyrics, language=None
         check_if_cancelled()
         resultado = create_with_manual_lyrics_with_cancellation_check(
             self, video_path, manual_lyrics, language, enable_diarization, hf_token, whisper_model,
-            source_type, source_url, save_to_db
+            source_type, source_url, save_to_db, render_profile, burn_subtitles, job_id=task_id
         )
         
         if not resultado:
@@ -105,11 +111,12 @@ def process_manual_lyrics_karaoke(self, video_path, manual_lyrics, language=None
         }
         
     except ProcessingCancelledException:
-        cleanup_partial_files(video_path)
+        cleanup_partial_files(video_path, task_id)
         self.update_state(state='REVOKED', meta={'status': 'Procesameento cancelado'})
         raise ProcessingCancelledException("Procesamento cancelado")
         
     except Exception as e:
+        retry_from_checkpoint(self, e)
         error_msg = str(e)
         traceback_str = traceback.format_exc()
         print(f"Traceback: {traceback_str}")
@@ -122,7 +129,7 @@ def process_manual_lyrics_karaoke(self, video_path, manual_lyrics, language=None
         return {'status': 'failed', 'error': error_msg, 'traceback': traceback_str}
 
 
-@celery.task(bind=True, name='process_instrumental_only')
+@celery.task(bind=True, name='process_instrumental_only', acks_late=True)
 def process_instrumental_only(self, video_path, source_type="upload", source_url=None, save_to_db=True):
 
     task_id = self.request.id
@@ -137,7 +144,7 @@ def process_instrumental_only(self, video_path, source_type="upload", source_url
         check_if_cancelled()
         
         resultado = generate_instrumental_with_cancellation_check(
-            self, video_path, source_type, source_url, save_to_db
+            self, video_path, source_type, source_url, save_to_db, job_id=task_id
         )
         
         if not resultado:
@@ -150,11 +157,12 @@ def process_instrumental_only(self, video_path, source_type="upload", source_url
         }
         
     except ProcessingCancelledException:
-        cleanup_partial_files(video_path)
+        cleanup_partial_files(video_path, task_id)
         self.update_state(state='REVOKED', meta={'status': 'Procesamento cancelado polo usuario'})
         raise ProcessingCancelledException("Procesamento cancelado")
         
     except Exception as e:
+        retry_from_checkpoint(self, e)
         error_msg = str(e)
         traceback_str = traceback.format_exc()
         print(f"Error en process_instrumental_only: {error_msg}")
@@ -167,8 +175,114 @@ def process_instrumental_only(self, video_path, source_type="upload", source_url
         return {'status': 'failed', 'error': error_msg, 'traceback': traceback_str}
 
 
+# Retomar a man un traballo que quedou a medias (o worker reiniciouse e a tarefa perdeuse, por exemplo)
+# dende a ultima etapa con checkpoint. job_id é o id da tarefa orixinal
+@celery.task(bind=True, name='resume_karaoke_job', acks_late=True)
+def resume_karaoke_job(self, job_id):
+
+    try:
+        self.update_state(state='PROGRESS', meta={
+            'status': 'Retomando procesamento...',
+            'current': 0,
+            'total': 100
+        })
+
+        check_if_cancelled()
+
+        resultado = resume_job(job_id, progress_callback=progress_callback_for(self))
+        if not resultado:
+            raise Exception("o procesamento non devolviu resultado")
+
+        return {
+            'status': 'completed',
+            'result': resultado,
+            'message': 'Procesamento retomado e completado'
+        }
+
+    except ProcessingCancelledException:
+        self.update_state(state='REVOKED', meta={'status': 'Procesamento cancelado'})
+        raise ProcessingCancelledException("Procesamento cancelado")
+
+    except Exception as e:
+        error_msg = str(e)
+        traceback_str = traceback.format_exc()
+        print(f"Error en resume_karaoke_job: {error_msg}")
+
+        self.update_state(state='FAILURE', meta={
+            'status': f'Error: {error_msg}',
+            'error': error_msg,
+            'traceback': traceback_str
+        })
+        return {'status': 'failed', 'error': error_msg, 'traceback': traceback_str}
+
+
+# Se a tarefa fallou e quedan reintentos volvese encolar co mismo id, asi o traballo retoma dende o ultimo
+# checkpoint (job_checkpoints) en vez de repetir normalizacion, demucs e aliñacion. Se non, non fai nada
+def retry_from_checkpoint(task, erro):
+    if task.request.retries < REINTENTOS_TRABALLO:
+        print(f"Reintentando a tarefa {task.request.id} dende o ultimo checkpoint: {erro}")
+        raise task.retry(exc=erro, countdown=10, max_retries=REINTENTOS_TRABALLO)
+
+
+# Queimar as letras no mp4 dun karaoke feito no modo sen queimar (cando se pide a descarga)
+@celery.task(bind=True, name='burn_karaoke_video')
+def burn_karaoke_video(self, karaoke_filename, render_profile=None):
+
+    try:
+        self.update_state(state='PROGRESS', meta={
+            'status': 'Preparando vídeo para descargar...',
+            'current': 0,
+            'total': 100
+        })
+
+        check_if_cancelled()
+
+        resultado = burn_karaoke_from_timeline(karaoke_filename, render_profile=render_profile,
+                                               progress_callback=progress_callback_for(self),
+                                               job_id=self.request.id)
+        if not resultado:
+            raise Exception("Non se puido queimar o karaoke")
+
+        return {
+            'status': 'completed',
+            'result': resultado,
+            'message': 'Karaoke con letras xerado'
+        }
+
+    except ProcessingCancelledException:
+        self.update_state(state='REVOKED', meta={'status': 'Procesamento cancelado'})
+        raise ProcessingCancelledException("Procesamento cancelado")
+
+    except Exception as e:
+        error_msg = str(e)
+        traceback_str = traceback.format_exc()
+        print(f"Error en burn_karaoke_video: {error_msg}")
+
+        self.update_state(state='FAILURE', meta={
+            'status': f'Error: {error_msg}',
+            'error': error_msg,
+            'traceback': traceback_str
+        })
+        return {'status': 'failed', 'error': error_msg, 'traceback': traceback_str}
+
+
+# callback de progreso para as funcions do generador. Os datos extra (p.ex. preview=archivo da previsualizacion)
+# quedan no meta das seguintes actualizacions, se non o seguinte paso borraríaos
+def progress_callback_for(task):
+    extra = {}
+
+    def callback(step, progress, **info):
+        extra.update(info)
+        task.update_state(
+            state='PROGRESS',
+            meta={'status': step, 'current': progress, 'total': 100, **extra}
+        )
+    return callback
+
+
 def create_with_cancellation_check(task, video_path, enable_diarization=False, hf_token=None, whisper_model="small",
-                                  source_type="upload", source_url=None, save_to_db=True):
+                                  source_type="upload", source_url=None, save_to_db=True, render_profile=None,
+                                  burn_subtitles=True, job_id=None):
 
     check_if_cancelled()
     
@@ -181,16 +295,17 @@ def create_with_cancellation_check(task, video_path, enable_diarization=False, h
         source_type=source_type, 
         source_url=source_url, 
         save_to_db=save_to_db,
-        progress_callback=lambda step, progress: task.update_state(
-            state='PROGRESS', 
-            meta={'status': step, 'current': progress, 'total': 100}
-        )
+        render_profile=render_profile,
+        burn_subtitles=burn_subtitles,
+        progress_callback=progress_callback_for(task),
+        job_id=job_id
     )
 
 
 def create_with_manual_lyrics_with_cancellation_check(task, video_path, manual_lyrics, language=None,
                                                      enable_diarization=False, hf_token=None, whisper_model="small",
-                                                     source_type="upload", source_url=None, save_to_db=True):
+                                                     source_type="upload", source_url=None, save_to_db=True,
+                                                     render_profile=None, burn_subtitles=True, job_id=None):
 
     check_if_cancelled()
     
@@ -205,64 +320,39 @@ def create_with_manual_lyrics_with_cancellation_check(task, video_path, manual_l
         source_type=source_type, 
         source_url=source_url, 
         save_to_db=save_to_db,
-        progress_callback=lambda step, progress: task.update_state(
-            state='PROGRESS', 
-            meta={'status': step, 'current': progress, 'total': 100}
-        )
+        render_profile=render_profile,
+        burn_subtitles=burn_subtitles,
+        progress_callback=progress_callback_for(task),
+        job_id=job_id
     )
 
 
-def generate_instrumental_with_cancellation_check(task, video_path, source_type="upload", source_url=None, save_to_db=True):
+def generate_instrumental_with_cancellation_check(task, video_path, source_type="upload", source_url=None, save_to_db=True,
+                                                 job_id=None):
 
     check_if_cancelled()
     return generate_instrumental(
         video_path, source_type, source_url, save_to_db,
-        progress_callback=lambda step, progress: task.update_state(
-            state='PROGRESS', 
-            meta={'status': step, 'current': progress, 'total': 100}
-        )
+        progress_callback=progress_callback_for(task),
+        job_id=job_id
     )
 
 
-def cleanup_partial_files(video_path):
+# Limpeza ao cancelar: o video de entrada e o que levou este traballo a output e o seu directorio.
+# Antes borrabase por patrons do nome en directorios compartidos e podia levar os archivos doutro traballo
+# que estivese procesando a mesma cancion
+def cleanup_partial_files(video_path, task_id):
 
     try:
         print(f"Limpando archivos parciales  {video_path}")
         
-        base_name = os.path.splitext(os.path.basename(video_path))[0]
-        
-        directories_to_clean = [
-            "./input",
-            "./output", 
-            "./separated",
-            "/data/input",
-            "/data/output",
-            "/data/separated"
-        ]
-        
-        patterns = [
-            f"*{base_name}*",
-            f"karaoke_{base_name}*",
-            f"karaoke_manual_{base_name}*",
-            f"instrumental_{base_name}*",
-            f"vocal_{base_name}*",
-            f"*_whisperx_*.srt"
-        ]
-        
-        import glob
-        files_deleted = 0
-        
-        for directory in directories_to_clean:
-            if os.path.exists(directory):
-                for pattern in patterns:
-                    files_to_delete = glob.glob(os.path.join(directory, pattern))
-                    for file_path in files_to_delete:
-                        try:
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                                files_deleted += 1
-                        except Exception as e:
-                            print(f" Erro eliminando {file_path}: {e}")
+        files_deleted = cleanup_job(task_id)
+        if video_path and os.path.exists(video_path):
+            try:
+                os.remove(video_path)
+                files_deleted += 1
+            except Exception as e:
+                print(f" Erro eliminando {video_path}: {e}")
         
         print(f"Limpeza completada: {files_deleted} archivos eliminados")
         
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import math
+import pickle
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from moviepy.editor import VideoFileClip
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+from config import FPS_VIDEO, PROCESOS_RENDER, DURACION_MINIMA_TRAMO
+from karaoke_rendering import OverlayKaraoke, get_frame_cache_stats, reset_frame_cache_stats, add_frame_cache_stats
+from video_processing import darken_frame, get_keyframe_times, get_render_profile, x264_quality_args
+
+# Render con moviepy por tramos en paralelo. O threads=4 do write_videofile solo axudaba ao x264, a composicion
+# dos subtitulos ia nun solo proceso de python. Aqui a cancion partese en N rangos de frames, cada proceso
+# renderiza o seu (karaoke e video sen audio) e ao final xuntanse co concat do ffmpeg sen recodificar,
+# metendo o audio unha solo vez.
+# Os procesos de cada tramo lanzanse con subprocess (este mismo archivo como script) e non con multiprocessing:
+# os workers prefork de celery son procesos daemon de billiard, que tamen marca o current_process do
+# multiprocessing, e un daemon non pode crear fillos cun Pool. Un subprocess pódese lanzar dende calquera
+# proceso, asi o render en paralelo funciona tamen dentro dos workers. Ao cancelar, o task_revoked
+# de celery_app mata os fillos do worker, estes incluidos
+
+
+# Numero de frames igual que o iter_frames de moviepy (np.arange(0, duracion, 1/fps))
+def _numero_frames(duracion: float, fps: float) -> int:
+    return len(np.arange(0, duracion, 1.0 / fps))
+
+
+# Limites dos tramos en frames. Repartense iguais e despois movense ao keyframe do video mais cercano
+# (dentro de medio tramo), asi cada proceso empeza a ler o video nun keyframe e o seek é inmediato
+def build_chunk_boundaries(total_frames: int, n_tramos: int, keyframes: list, fps: float = FPS_VIDEO) -> list:
+    limites = [round(i * total_frames / n_tramos) for i in range(n_tramos + 1)]
+    frames_clave = sorted({int(round(t * fps)) for t in keyframes if 0 < t * fps < total_frames})
+    if frames_clave:
+        marxe = total_frames / n_tramos / 2
+        for i in range(1, n_tramos):
+            cercano = min(frames_clave, key=lambda k: abs(k - limites[i]))
+            if abs(cercano - limites[i]) <= marxe:
+                limites[i] = cercano
+    return sorted(set(limites))
+
+
+# Traballo de cada proceso: abre o seu propio lector e o seu overlay e escribe os frames [frame_inicio, frame_fin)
+# nos dous archivos do tramo. Executao o script de cada tramo (ver o final do archivo)
+def _render_tramo(video_path: str, grupos: list, duracion_total: float, frame_inicio: int, frame_fin: int,
+                  ruta_karaoke: str, ruta_silencioso: str, threads: int, fps: float = FPS_VIDEO,
+                  render_profile: str = None) -> dict:
+    reset_frame_cache_stats()
+    perfil = get_render_profile(render_profile)
+    video_fondo = VideoFileClip(video_path, audio=False).set_duration(duracion_total).set_fps(fps)
+    overlay = OverlayKaraoke(grupos)
+    try:
+        with FFMPEG_VideoWriter(ruta_karaoke, video_fondo.size, fps, codec="libx264", preset=perfil["preset"],
+                                threads=threads, ffmpeg_params=x264_quality_args(perfil)) as escritor_karaoke, \
+             FFMPEG_VideoWriter(ruta_silencioso, video_fondo.size, fps, codec="libx264", preset=perfil["preset"],
+                                threads=threads, ffmpeg_params=x264_quality_args(perfil)) as escritor_silencioso:
+            for k in range(frame_inicio, frame_fin):
+                t = k / fps
+                frame = darken_frame(video_fondo.get_frame(t))
+                escritor_silencioso.write_frame(frame)
+                escritor_karaoke.write_frame(overlay.apply(frame, t))
+    finally:
+        video_fondo.close()
+    return get_frame_cache_stats()
+
+
+def _concatenar(rutas: list, ruta_saida: str, ruta_audio: str = None) -> bool:
+    ruta_lista = ruta_saida + ".concat.txt"
+    with open(ruta_lista, "w", encoding="utf-8") as f:
+        for ruta in rutas:
+            f.write(f"file '{os.path.abspath(ruta)}'\n")
+
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", ruta_lista]
+    if ruta_audio:
+        cmd += ["-i", ruta_audio, "-map", "0:v", "-map", "1:a"]
+    cmd += ["-c", "copy", ruta_saida]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0
+    except subprocess.CalledProcessError as e:
+        print(f"fallou o concat de {ruta_saida}: {e}")
+        if e.stderr:
+            print(f" Error ffmpeg: {e.stderr[-2000:]}")
+        return False
+    finally:
+        if os.path.exists(ruta_lista):
+            os.remove(ruta_lista)
+
+
+# Lanza o proceso dun tramo: os argumentos de _render_tramo van nun pickle e as estatisticas da cache
+# de frames volven nun json. O stderr vai a un archivo (o moviepy escribe moito e un PIPE podia encherse)
+def _lanzar_tramo(directorio_tramos: str, i: int, argumentos: dict) -> subprocess.Popen:
+    ruta_argumentos = os.path.join(directorio_tramos, f"tramo_{i:03d}.pkl")
+    with open(ruta_argumentos, "wb") as f:
+        pickle.dump(argumentos, f)
+    with open(os.path.join(directorio_tramos, f"tramo_{i:03d}.log"), "w") as log:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), ruta_argumentos],
+                                stdout=subprocess.DEVNULL, stderr=log)
+
+
+def _resultado_tramo(directorio_tramos: str, i: int, proceso: subprocess.Popen) -> dict:
+    if proceso.wait() != 0:
+        with open(os.path.join(directorio_tramos, f"tramo_{i:03d}.log"), "r", errors="replace") as log:
+            print(f"Fallou o tramo {i} do render en paralelo: {log.read()[-2000:]}")
+        return None
+    with open(os.path.join(directorio_tramos, f"tramo_{i:03d}.json"), "r") as f:
+        return json.load(f)
+
+
+# Devolve True se xerou os dous videos. Con False o chamador fai o render secuencial
+def render_karaoke_chunked(video_path: str, grupos: list, duracion: float, ruta_audio: str,
+                           ruta_saida: str, ruta_video_silencioso: str, fps: float = FPS_VIDEO,
+                           render_profile: str = None) -> bool:
+
+    procesos = PROCESOS_RENDER or os.cpu_count() or 1
+    n_tramos = max(1, min(procesos, math.ceil(duracion / DURACION_MINIMA_TRAMO)))
+    if n_tramos < 2:
+        return False
+
+    total_frames = _numero_frames(duracion, fps)
+    limites = build_chunk_boundaries(total_frames, n_tramos, get_keyframe_times(video_path), fps)
+    tramos = list(zip(limites, limites[1:]))
+    threads_x264 = max(1, (os.cpu_count() or 1) // len(tramos))
+    print(f"Render en paralelo: {len(tramos)} tramos, {total_frames} frames")
+
+    directorio_tramos = tempfile.mkdtemp(prefix="tramos_", dir=os.path.dirname(ruta_saida) or ".")
+    procesos_tramos = []
+    try:
+        rutas_karaoke = [os.path.join(directorio_tramos, f"karaoke_{i:03d}.mp4") for i in range(len(tramos))]
+        rutas_silencioso = [os.path.join(directorio_tramos, f"solo_{i:03d}.mp4") for i in range(len(tramos))]
+
+        for i, (inicio, fin) in enumerate(tramos):
+            procesos_tramos.append(_lanzar_tramo(directorio_tramos, i, dict(
+                video_path=video_path, grupos=grupos, duracion_total=duracion, frame_inicio=inicio, frame_fin=fin,
+                ruta_karaoke=rutas_karaoke[i], ruta_silencioso=rutas_silencioso[i], threads=threads_x264, fps=fps,
+                render_profile=render_profile)))
+        resultados = [_resultado_tramo(directorio_tramos, i, proceso) for i, proceso in enumerate(procesos_tramos)]
+        if any(resultado is None for resultado in resultados):
+            return False
+        for resultado in resultados:
+            add_frame_cache_stats(resultado)
+
+        if not _concatenar(rutas_karaoke, ruta_saida, ruta_audio):
+            return False
+        # sen o video sen audio o traballo apuntaria un _video_only.mp4 que non existe, faise en secuencial
+        if not _concatenar(rutas_silencioso, ruta_video_silencioso):
+            print("Fallou o concat do video sen audio, vaise en secuencial")
+            return False
+        return True
+    except Exception as e:
+        print(f"Error no render en paralelo: {e}")
+        return False
+    finally:
+        for proceso in procesos_tramos:     #se algo fallou no medio non se deixan procesos soltos
+            if proceso.poll() is None:
+                proceso.kill()
+                proceso.wait()
+        shutil.rmtree(directorio_tramos, ignore_errors=True)
+
+
+# Proceso dun tramo: python chunked_rendering.py <argumentos.pkl>. Deixa as estatisticas en <argumentos>.json
+if __name__ == "__main__":
+    ruta_argumentos = sys.argv[1]
+    with open(ruta_argumentos, "rb") as f:
+        argumentos = pickle.load(f)
+    estatisticas = _render_tramo(**argumentos)
+    with open(ruta_argumentos.replace(".pkl", ".json"), "w") as f:
+        json.dump(estatisticas, f)
@@ -4,6 +4,47 @@ from moviepy.config import change_settings
 
 
 VOLUME_VOCAL = 0.05
+FACTOR_ESCURECEMENTO = 0.3      #o fondo do karaoke multiplicase por esto para que se lean ben os subtitulos
+# o audio extraese xa como o quere o demucs (htdemucs traballa a 44.1 kHz estereo), asi non ten que remostrear
+FREQUENCIA_AUDIO_SEPARACION = 44100
+CANLES_AUDIO_SEPARACION = 2
+
+
+# Perfiles de codificacion para a normalizacion e o render final: preset e crf do x264, tune e bitrate do audio.
+# Elixense por traballo no formulario. draft para ensaiar rapido, archive para a biblioteca (lento pero ocupa pouco).
+# maxrate/bufsize son opcionales e solo se aplican na normalizacion (o standard mantén o limite que tiña),
+# o render final non ten limite de bitrate
+PERFILES_RENDER = {
+    "draft": {"preset": "ultrafast", "crf": 30, "tune": "fastdecode", "audio_bitrate": "128k"},
+    "standard": {"preset": "medium", "crf": 23, "tune": None, "audio_bitrate": "192k", "maxrate": "2M", "bufsize": "4M"},
+    "archive": {"preset": "slower", "crf": 20, "tune": "film", "audio_bitrate": "256k"},
+    # perfil interno da previsualizacion: alto e fps reducen a saida (os subtitulos compoñense igual ca no final)
+    "preview": {"preset": "ultrafast", "crf": 32, "tune": "fastdecode", "audio_bitrate": "96k", "alto": 360, "fps": 10},
+}
+PERFIL_RENDER_DEFECTO = "standard"
+PERFILES_RENDER_PUBLICOS = ("draft", "standard", "archive")    #os que se poden pedir dende o formulario
+
+# Despois da aliñacion xerase un karaoke pequeno co perfil "preview" para comprobar a sincronizacion
+# mentres se fai o render final (a paxina de progreso enlazao)
+XERAR_PREVISUALIZACION = True
+
+# Cache de artefactos por contido (artifact_cache.py): video normalizado, audio extraido, stems, transcripcions
+# e aliñacions, coa clave do hash da entrada e os parametros de cada etapa. Cando pasa de TAMAÑO_MAXIMO_CACHE
+# borranse as entradas que leven mais tempo sen usarse. Vai no mismo volume ca DIRECTORIO_TRABALLOS para que
+# gardar e recuperar sexan hardlinks (entre volumes distintos o os.link falla e copiaríase todo)
+CACHE_ARTEFACTOS = True
+DIRECTORIO_CACHE = "/data/cache"
+TAMAÑO_MAXIMO_CACHE = 20 * 1024 ** 3   # bytes
+
+# Checkpoints dos traballos (job_checkpoints.py): un directorio por tarefa co manifest das etapas feitas, para
+# que un reintento retome dende a ultima. En /data porque o servicio de whisperx ten que ler as voces de ahi.
+# Os que quedan a medias e non se retoman borranse despois de IDADE_MAXIMA_TRABALLOS
+DIRECTORIO_TRABALLOS = "/data/jobs"
+IDADE_MAXIMA_TRABALLOS = 24 * 3600   # segundos
+REINTENTOS_TRABALLO = 1       # reintentos de celery se falla unha etapa (retomase, non se empeza de cero)
+# A normalizacion do video (e o fondo no modo sen queimar) vai nun fio aparte mentres o audio pasa pola
+# extraccion, o demucs e a aliñacion, e xuntanse antes do render
+RAMAS_PARALELO = True
 
 
 ANCHO_VIDEO = 1280
@@ -38,6 +79,25 @@ PESO_PROGRESO_SEGMENTO = 0.8  #estes dous teñen que sumar 1
 UMBRAL_ACELERACION = 0.85  # A partir de qué progreso acelerar o final 
 FACTOR_ACELERACION_MAX = 2.0  
 
+# Cache de frames dos subtitulos. O frame solo cambia cando cambia o numero de silabas resaltadas, asi que se garda por ese indice
+TAMAÑO_CACHE_FRAMES = 32   # frames por clip (LRU)
+# Rasterizar cada linea solo dúas veces (normal e resaltada) e construir os frames recortando arrays de numpy.
+# Se se pon a False volvese a debuxar con PIL silaba por silaba en cada cambio de resaltado
+USAR_SPRITES_RESALTADO = True
+
+# Backend do render final. "moviepy" compon os subtitulos frame a frame en python (o de sempre),
+# "ass" xera un .ass e queimao co ffmpeg (libass) nun solo paso, moito mais rapido.
+# "overlay" garda solo os sprites distintos de PIL en PNG e o ffmpeg pegaos por rangos de frames (mismo aspecto que moviepy)
+BACKEND_RENDER = "moviepy"
+# Cos backends de ffmpeg non se normaliza o video antes: escalado, pad e fps van no mismo grafo que o escurecido
+# e os subtitulos, asi o video decodificase unha vez e codificase unha vez. Se o render falla normalizase e vaise por moviepy
+PIPELINE_UN_PASO = True
+# Render con moviepy por tramos en varios procesos (cada un renderiza un anaco da cancion e despois
+# xuntanse sen recodificar). 0 procesos = tantos como CPUs. Os tramos non se fan mais curtos que DURACION_MINIMA_TRAMO
+RENDER_PARALELO = True
+PROCESOS_RENDER = 0
+DURACION_MINIMA_TRAMO = 15   # segundos
+
 
 # Se imagemagick está instalado na localización estandar non lle di a moviepy onde esta, hai qye facer este codigo
 # https://dev.to/muddylemon/making-my-own-karaoke-videos-with-ai-4b8l
@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import subprocess
+
+from config import FPS_VIDEO, ANCHO_VIDEO
+from ass_processing import write_ass_file
+from karaoke_rendering import export_overlay_events
+from video_processing import get_media_duration, get_render_profile, x264_args, FILTRO_NORMALIZACION, FILTRO_ESCURECEMENTO
+
+# Backends de render que fan todo nun proceso de ffmpeg en vez de compoñer frame a frame con moviepy
+
+DIRECTORIO_FONTES = "./fonts"
+
+
+# dentro dun filtergraph os ':' e as comillas teñen significado, hai que escapalos nas rutas
+def _escapar_ruta_filtro(ruta: str) -> str:
+    return ruta.replace("\\", "/").replace(":", "\\:").replace("'", "\\'")
+
+
+def _executar_ffmpeg(cmd: list, descripcion: str) -> bool:
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"fallou ffmpeg ({descripcion}): {e}")
+        if e.stderr:
+            print(f" Error ffmpeg: {e.stderr[-2000:]}")
+        return False
+    except Exception as e:
+        print(f"Error executando ffmpeg ({descripcion}): {e}")
+        return False
+
+
+# fondo: (escalado/pad se o video non vén normalizado) + fps + escurecido (se non vén xa escurecido)
+def _filtro_fondo(normalizar: bool, escurecer: bool = True) -> str:
+    escalado = f"{FILTRO_NORMALIZACION}," if normalizar else ""
+    escurecido = f",{FILTRO_ESCURECEMENTO}" if escurecer else ""
+    return f"{escalado}fps={FPS_VIDEO}{escurecido}"
+
+
+# o video final dura o que dura o audio (igual que co set_duration de moviepy)
+def _duracion_audio(ruta_audio: str) -> float:
+    return get_media_duration(ruta_audio)
+
+
+# Paso comun dos backends de ffmpeg. filtro_subtitulos parte de [fondo] (video xa escurecido e a FPS_VIDEO)
+# e ten que rematar en [video]. O grafo vai nun archivo (-filter_complex_script) porque co overlay por eventos
+# pode ser moi longo. O fondo escurecido dividese con split e sae tamen tal cal como video sen audio para o
+# reprodutor web, asi as dúas saidas salen da mesma decodificacion nun solo proceso de ffmpeg.
+# O audio xa ven mesturado e en AAC (mix_audio_tracks), solo se copia.
+# Con normalizar=True o video_path é o orixinal e o escalado faise aqui, sen pasar por normalize_video.
+# As dúas saidas codificanse co preset/crf/tune do perfil de render.
+# Cun perfil reducido (alto/fps, a previsualizacion) solo sae o karaoke, baixado despois de compoñer os subtitulos
+# para que o overlay por eventos siga contando os frames a FPS_VIDEO.
+# Con fondo_escurecido=True o video_path xa é o _video_only.mp4 (queimar despois no modo sen queimar):
+# non se escurece outra vez e tampouco se escribe o video sen audio, que é a propia entrada
+def _render_con_filtro(video_path: str, ruta_audio: str, ruta_saida: str,
+                       filtro_subtitulos: str, duracion: float, descripcion: str, normalizar: bool = False,
+                       render_profile: str = None, fondo_escurecido: bool = False) -> bool:
+
+    perfil = get_render_profile(render_profile)
+    codificacion = x264_args(perfil)
+    limite_duracion = ["-t", f"{duracion:.3f}"] if duracion > 0 else ["-shortest"]
+    ruta_video_silencioso = ruta_saida.replace(".mp4", "_video_only.mp4")
+    reducido = bool(perfil.get("alto"))
+    if reducido:
+        filtro = (f"[0:v]{_filtro_fondo(normalizar, not fondo_escurecido)}[fondo];\n"
+                  f"{filtro_subtitulos};\n"
+                  f"[video]fps={perfil.get('fps', FPS_VIDEO)},scale=-2:{perfil['alto']}[video_reducido]")
+    elif fondo_escurecido:
+        filtro = (f"[0:v]{_filtro_fondo(normalizar, False)}[fondo];\n"
+                  f"{filtro_subtitulos}")
+    else:
+        filtro = (f"[0:v]{_filtro_fondo(normalizar)},split=2[fondo][fondo_solo];\n"
+                  f"[fondo_solo]format=yuv420p[video_solo];\n"
+                  f"{filtro_subtitulos}")
+
+    ruta_script = ruta_saida.replace(".mp4", "_filtro.txt")
+    with open(ruta_script, "w", encoding="utf-8") as f:
+        f.write(filtro)
+
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-i", ruta_audio,
+        "-filter_complex_script", ruta_script,
+        # saida 1: karaoke con audio
+        "-map", "[video_reducido]" if reducido else "[video]", "-map", "1:a",
+        "-c:v", "libx264", *codificacion,
+        "-c:a", "copy",
+        *limite_duracion,
+        ruta_saida
+    ]
+    if not reducido and not fondo_escurecido:
+        cmd += [
+            # saida 2: fondo escurecido sen audio
+            "-map", "[video_solo]",
+            "-an",
+            "-c:v", "libx264", *codificacion,
+            *limite_duracion,
+            ruta_video_silencioso
+        ]
+    correcto = _executar_ffmpeg(cmd, descripcion)
+    try:
+        os.remove(ruta_script)
+    except OSError:
+        pass
+    if not correcto:
+        return False
+
+    if not (os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0):
+        print("O archivo non se creou ben")
+        return False
+    print(f" Video generado correctamente ({descripcion}): {ruta_saida}")
+    return True
+
+
+# Render co backend ASS: xerase o .ass cos grupos e queimase co filtro subtitles (libass) nun solo paso
+# de ffmpeg, xunto co escurecido do fondo e a mestura do audio. Devolve True se se xerou o video final
+def render_karaoke_ass(video_path: str, grupos: list, ruta_audio: str, ruta_saida: str,
+                       normalizar: bool = False, render_profile: str = None, fondo_escurecido: bool = False) -> bool:
+
+    ruta_ass = write_ass_file(grupos, ruta_saida.replace(".mp4", ".ass"))
+    if not ruta_ass:
+        return False
+
+    filtro_subtitulos = (f"[fondo]subtitles={_escapar_ruta_filtro(ruta_ass)}"
+                         f":fontsdir={_escapar_ruta_filtro(DIRECTORIO_FONTES)},format=yuv420p[video]")
+    return _render_con_filtro(video_path, ruta_audio, ruta_saida, filtro_subtitulos,
+                              _duracion_audio(ruta_audio), "subtitulos ASS", normalizar, render_profile,
+                              fondo_escurecido)
+
+
+# Cadea de overlays, un por sprite distinto. Cada overlay solo se activa nos seus rangos de frames
+# (n é o numero de frame da entrada principal, despois do fps=, asi que cadra co frame do render de moviepy)
+def build_overlay_filter(eventos: list) -> str:
+    partes = []
+    entrada = "fondo"
+    for i, evento in enumerate(eventos):
+        activacion = "+".join(f"between(n,{inicio},{fin - 1})" for inicio, fin in evento.rangos)
+        saida = f"capa{i}"
+        partes.append(f"movie={_escapar_ruta_filtro(evento.ruta_png)}[sprite{i}]")
+        partes.append(f"[{entrada}][sprite{i}]overlay=x={evento.x}:y={evento.y}:enable='{activacion}'[{saida}]")
+        entrada = saida
+    partes.append(f"[{entrada}]format=yuv420p[video]")
+    return ";\n".join(partes)
+
+
+# Render por eventos: os subtitulos solo cambian cando cambia a silaba resaltada, asi que en vez de compoñer
+# cada frame en python gardanse os sprites distintos (os mismos pixels que o render de PIL) e o ffmpeg
+# pegaos co overlay activado por rangos de frames
+def render_karaoke_overlay_events(video_path: str, grupos: list, ruta_audio: str, ruta_saida: str,
+                                  normalizar: bool = False, render_profile: str = None,
+                                  fondo_escurecido: bool = False) -> bool:
+
+    duracion = _duracion_audio(ruta_audio)
+    if duracion <= 0:
+        print("Non se puido ler a duracion do audio para o overlay por eventos")
+        return False
+
+    directorio_sprites = tempfile.mkdtemp(prefix="sprites_", dir=os.path.dirname(ruta_saida) or ".")
+    try:
+        eventos = export_overlay_events(grupos, directorio_sprites, duracion, ancho_frame=ANCHO_VIDEO)
+        print(f"Overlay por eventos: {len(eventos)} sprites distintos")
+        return _render_con_filtro(video_path, ruta_audio, ruta_saida, build_overlay_filter(eventos),
+                                  duracion, "overlay por eventos", normalizar, render_profile,
+                                  fondo_escurecido)
+    except Exception as e:
+        print(f"Error no overlay por eventos: {e}")
+        return False
+    finally:
+        shutil.rmtree(directorio_sprites, ignore_errors=True)
+
+
+# Modo sen queimar: solo o fondo escurecido sen audio para o reprodutor web, que debuxa as letras no navegador.
+# Non depende do libass nin dos subtitulos, é un solo paso de ffmpeg
+def render_background_video(video_path: str, ruta_video_silencioso: str, duracion: float = 0,
+                            normalizar: bool = False, render_profile: str = None) -> bool:
+
+    limite_duracion = ["-t", f"{duracion:.3f}"] if duracion > 0 else []
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-vf", f"{_filtro_fondo(normalizar)},format=yuv420p",
+        "-an",
+        "-c:v", "libx264", *x264_args(get_render_profile(render_profile)),
+        *limite_duracion,
+        ruta_video_silencioso
+    ]
+    if not _executar_ffmpeg(cmd, "fondo sen subtitulos"):
+        return False
+    if not (os.path.exists(ruta_video_silencioso) and os.path.getsize(ruta_video_silencioso) > 0):
+        print("O archivo non se creou ben")
+        return False
+    print(f" Video sen subtitulos generado correctamente: {ruta_video_silencioso}")
+    return True
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DIRECTORIO_TRABALLOS, IDADE_MAXIMA_TRABALLOS, RAMAS_PARALELO
+from utils import promote_file
+
+# Checkpoints dos traballos: cada traballo (o id da tarefa de celery) ten un directorio en DIRECTORIO_TRABALLOS
+# cun manifest.json onde se apunta cada etapa completada e o que devolveu (rutas, letra, segmentos...).
+# Ese directorio é tamen o espacio de traballo: todos os archivos intermedios (normalizado, audio, stems, SRT,
+# renders) escribense ahi, asi varios traballos poden ir ao mismo tempo sen pisarse, e os resultados
+# pasan a output ao final con promote.
+# Se o render falla ou o worker se reinicia, a mesma tarefa (reintento de celery, mesmo id) ou resume_job
+# volven empezar dende a primeira etapa que non está feita en vez de repetir normalizacion, demucs e aliñacion.
+
+NOME_MANIFEST = "manifest.json"
+
+
+def job_directory(job_id: str) -> str:
+    return os.path.join(DIRECTORIO_TRABALLOS, job_id)
+
+
+def load_job_manifest(job_id: str) -> dict:
+    try:
+        with open(os.path.join(job_directory(job_id), NOME_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# borra os checkpoints dun traballo (rematou ou cancelouse)
+def discard_job(job_id: str):
+    shutil.rmtree(job_directory(job_id), ignore_errors=True)
+
+
+# Cancelacion: borra o que o traballo xa levou a output e o seu directorio. Solo o deste traballo,
+# antes borrabase por patrons en directorios compartidos e podia levar os archivos doutro traballo
+def cleanup_job(job_id: str) -> int:
+    borrados = 0
+    for ruta in load_job_manifest(job_id).get("promovidos", []):
+        try:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+                borrados += 1
+        except OSError as e:
+            print(f" Erro eliminando {ruta}: {e}")
+    discard_job(job_id)
+    return borrados
+
+
+class CheckpointsTraballo:
+
+    def __init__(self, job_id: str, tipo: str = None, parametros: dict = None):
+        self.job_id = job_id
+        self.directorio = job_directory(job_id)
+        self.manifest = load_job_manifest(job_id)
+        self.bloqueo = threading.Lock()     #as ramas en paralelo apuntan etapas ao mismo tempo
+        os.makedirs(self.directorio, exist_ok=True)
+        if not self.manifest:
+            self.manifest = {"job_id": job_id, "tipo": tipo, "parametros": parametros or {}, "etapas": {},
+                             "promovidos": []}
+        elif self.manifest.get("etapas"):
+            feitas = ", ".join(self.manifest["etapas"])
+            print(f"Retomando o traballo {job_id}, etapas xa feitas: {feitas}")
+
+    def completed(self, etapa: str) -> bool:
+        rexistro = self.manifest["etapas"].get(etapa)
+        if not rexistro:
+            return False
+        # se falta algun archivo da etapa hai que volver facela
+        return all(os.path.exists(rexistro["datos"][clave]) for clave in rexistro.get("archivos", []))
+
+    def result(self, etapa: str) -> dict:
+        return self.manifest["etapas"][etapa]["datos"]
+
+    # apunta a etapa como feita. archivos son as claves de datos que son rutas que teñen que seguir existindo
+    def complete(self, etapa: str, datos: dict, archivos: tuple = ()):
+        with self.bloqueo:
+            self.manifest["etapas"][etapa] = {"datos": datos, "archivos": list(archivos), "feita": time.time()}
+            self._gardar()
+
+    # leva un resultado a output (ou onde sexa) de forma atomica e apuntao, para poder borralo se se cancela
+    def promote(self, orixe: str, destino: str, copiar: bool = False) -> str:
+        promote_file(orixe, destino, copiar)
+        with self.bloqueo:
+            promovidos = self.manifest.setdefault("promovidos", [])
+            if destino not in promovidos:
+                promovidos.append(destino)
+            self._gardar()
+        return destino
+
+    # o manifest escribese nun temporal e renomease, un reinicio a medias non o deixa roto
+    def _gardar(self):
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directorio, prefix=".manifest_",
+                                         delete=False) as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+            ruta_temporal = f.name
+        os.replace(ruta_temporal, os.path.join(self.directorio, NOME_MANIFEST))
+
+    # o traballo rematou, xa non fai falta retomalo
+    def discard(self):
+        discard_job(self.job_id)
+
+
+# Executa unha etapa se non está feita e apunta o resultado. funcion devolve un dict ({} ou None se fallou,
+# e entonces non se apunta para que o seguinte intento a repita)
+def run_stage(checkpoints: CheckpointsTraballo, etapa: str, funcion, archivos: tuple = ()) -> dict:
+    if checkpoints.completed(etapa):
+        print(f"Etapa {etapa} xa feita, usase o checkpoint")
+        return checkpoints.result(etapa)
+    datos = funcion()
+    if datos:
+        checkpoints.complete(etapa, datos, archivos)
+    return datos
+
+
+# Executa ramas independentes do traballo ao mismo tempo (p.ex. a normalizacion do video mentres o audio pasa
+# polo demucs e a aliñacion) e devolve o resultado de cada unha cando rematan todas. Valen fios: o traballo
+# pesado fano o ffmpeg, o demucs e o servicio de whisperx en procesos aparte. Con RAMAS_PARALELO=False
+# executanse unha detras doutra na orde do dict. Se unha rama lanza unha excepcion, relanzase ao xuntar
+def run_parallel_branches(ramas: dict) -> dict:
+    if not RAMAS_PARALELO or len(ramas) < 2:
+        return {nome: funcion() for nome, funcion in ramas.items()}
+    with ThreadPoolExecutor(max_workers=len(ramas), thread_name_prefix="rama") as executor:
+        futuros = {nome: executor.submit(funcion) for nome, funcion in ramas.items()}
+        return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+
+# Borra os directorios de traballos que fallaron e nunca se retomaron
+def cleanup_stale_jobs(idade_maxima: float = IDADE_MAXIMA_TRABALLOS) -> int:
+    if not os.path.isdir(DIRECTORIO_TRABALLOS):
+        return 0
+    limite = time.time() - idade_maxima
+    borrados = 0
+    for job_id in os.listdir(DIRECTORIO_TRABALLOS):
+        directorio = job_directory(job_id)
+        try:
+            if os.path.isdir(directorio) and os.path.getmtime(directorio) < limite:
+                shutil.rmtree(directorio, ignore_errors=True)
+                borrados += 1
+        except OSError:
+            continue
+    if borrados:
+        print(f"Borrados {borrados} traballos antigos sen rematar")
+    return borrados
@@ -1,173 +1,462 @@
 import os
 import time
+import uuid
 import traceback
-from moviepy.editor import AudioFileClip, VideoFileClip, CompositeAudioClip, CompositeVideoClip
-
-from config import VOLUME_VOCAL, ALTO_VIDEO, MARXE_INFERIOR_SUBTITULO
-from audio_processing import video_to_mp3, separate_stems_cli, call_whisperx_endpoint, call_whisperx_endpoint_manual, transcribe_with_faster_whisper
-from video_processing import normalize_video
-from srt_processing import parse_word_srt, group_word_segments, group_word_segments_automatic
-from text_processing import normalize_manual_lyrics
-from karaoke_rendering import create_karaoke_text_clip
-from utils import remove_previous_srt, clean_abnormal_segments, sanitize_filename
+from moviepy.editor import VideoFileClip
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+from config import BACKEND_RENDER, PIPELINE_UN_PASO, RENDER_PARALELO, XERAR_PREVISUALIZACION
+from audio_processing import extract_audio_wav, mix_audio_tracks, separate_stems_cli, call_whisperx_endpoint, call_whisperx_endpoint_manual, transcribe_with_faster_whisper
+from video_processing import normalize_video, darken_frame, get_render_profile, x264_quality_args, get_audio_duration, get_media_duration
+from srt_processing import parse_word_srt, word_segments_from_response, group_word_segments, group_word_segments_automatic
+from text_processing import normalize_manual_lyrics, attach_syllable_tables
+from karaoke_rendering import OverlayKaraoke, get_frame_cache_stats, reset_frame_cache_stats
+from ffmpeg_rendering import render_karaoke_ass, render_karaoke_overlay_events, render_background_video
+from chunked_rendering import render_karaoke_chunked
+from utils import clean_abnormal_segments, sanitize_filename, promote_file, karaoke_base_name
+from lyrics_timeline import write_lyrics_timeline, load_lyrics_timeline, groups_from_timeline, timeline_filename
 from database import save_song_to_database
 from metadata_utils import generate_song_metadata
+from artifact_cache import get_artifact_cache_stats, reset_artifact_cache_stats
+from job_checkpoints import (CheckpointsTraballo, run_stage, run_parallel_branches, load_job_manifest, cleanup_stale_jobs,
+                             job_directory, discard_job)
 
 
 
-#Este é o create para a version automática. WhisperX transcribe él mismo, despois parsease o SRT en tokens
-#agrupanse en frases cada N palabras e despois renderizase o karaoke
+# Bucle dun solo proceso: cada frame do fondo escurecido vai tal cal ao video sen audio e co overlay ao karaoke.
+# Sen ruta_video_silencioso (previsualizacion) solo se escribe o karaoke, co alto e fps do perfil
+def _escribir_frames_secuencial(video_escurecido, overlay, ruta_saida: str, ruta_video_silencioso: str,
+                                ruta_audio: str, perfil: dict):
+    fps = perfil.get("fps", 30)
+    parametros_karaoke = x264_quality_args(perfil)
+    if perfil.get("alto"):
+        parametros_karaoke += ["-vf", f"scale=-2:{perfil['alto']}"]   #compoñese a 720p e o ffmpeg baixao
+    escritor_silencioso = None
+    with FFMPEG_VideoWriter(ruta_saida, video_escurecido.size, fps, codec="libx264", preset=perfil["preset"],
+                            audiofile=ruta_audio, threads=4, ffmpeg_params=parametros_karaoke) as escritor_karaoke:
+        try:
+            if ruta_video_silencioso:
+                escritor_silencioso = FFMPEG_VideoWriter(ruta_video_silencioso, video_escurecido.size, fps,
+                                                         codec="libx264", preset=perfil["preset"], threads=4,
+                                                         ffmpeg_params=x264_quality_args(perfil))
+            for t, frame in video_escurecido.iter_frames(fps=fps, with_times=True, logger="bar", dtype="uint8"):
+                if escritor_silencioso:
+                    escritor_silencioso.write_frame(frame)
+                escritor_karaoke.write_frame(overlay.apply(frame, t))   #apply copia o frame, o fondo non se toca
+        finally:
+            if escritor_silencioso:
+                escritor_silencioso.close()
 
-def create(video_path: str, enable_diarization: bool = False, hf_token: str = None, whisper_model: str = "small",
-           source_type: str = "upload", source_url: str = None, save_to_db: bool = True, progress_callback=None):
-    
-    remove_previous_srt()     ##Borro os srts anteriores por si acaso me daban conflicto ao ir probando a misma cancion repetidas veces
+
+# Render con moviepy: fondo escurecido e o overlay de subtitulos compoñendo frame a frame.
+# As dúas saidas (karaoke e video sen audio para o reprodutor web) escribense no mismo bucle de frames:
+# o fondo decodificase e escurecese unha vez e cada frame vai a dous escritores de ffmpeg.
+# O audio xa ven mesturado e codificado (ruta_audio), solo se copia ao karaoke
+# Con fondo_escurecido=True o video_path xa é o _video_only.mp4: nin se escurece nin se escribe outro video sen audio
+def _render_karaoke_moviepy(video_path: str, grupos: list, ruta_audio: str, ruta_saida: str,
+                            ruta_video_alternativa: str = None, render_profile: str = None,
+                            fondo_escurecido: bool = False) -> bool:
+    duracion = get_audio_duration(ruta_audio)
+    if duracion <= 0:
+        print(f"Error cargando audio {ruta_audio}")
+        return False
     
-    if progress_callback:
-        progress_callback("Iniciando procesamento...", 5)
- 
-   # Normalizo o video. Por que? Porque añadin a parte de poder meter un MP4 para poder recortar videos e facer que
-    # ocupen menos, para facer ensayo e error mais rapidamente. Entonces necesito que o formato do video do link de YT
-    # e o formato do Mp4 sean o mesmo, porque si os subtitulos non son iguais non me sirve de nada practicar cos mp4s.
     try:
-        if progress_callback:
-            progress_callback("Normalizando vídeo...", 10)
-        video_path = normalize_video(video_path)
-    except Exception as erro_normalizacion:      
-        print(f" Error na normalización: {erro_normalizacion}, continuando co video original")
+        video_fondo = VideoFileClip(video_path, audio=False).set_duration(duracion).set_fps(30)
+    except Exception as erro_video:
+        print(f"Error cargando video {erro_video}")
+        # Intentase co video original se o normalizado falla
+        if not ruta_video_alternativa or ruta_video_alternativa == video_path:
+            return False
+        try:
+            video_fondo = VideoFileClip(ruta_video_alternativa, audio=False).set_duration(duracion).set_fps(30)
+            video_path = ruta_video_alternativa
+        except Exception as erro_video2:
+            print(f"fallo tamen co video orixinal {erro_video2}")
+            return False
     
-    if progress_callback:
-        progress_callback("Extraendo audio...", 15)
-    ruta_audio = video_to_mp3(video_path)
+    video_escurecido = video_fondo if fondo_escurecido else video_fondo.fl_image(darken_frame)   #taboa uint8, sen pasar por float
+    
+    # un unico overlay indexado por tempo en vez dun clip por grupo de frases
+    overlay = OverlayKaraoke(grupos)
+    perfil = get_render_profile(render_profile)
+    so_karaoke = bool(perfil.get("alto")) or fondo_escurecido     #previsualizacion ou queimar despois: solo o karaoke, nun proceso
+    ruta_video_silencioso = None if so_karaoke else ruta_saida.replace(".mp4", "_video_only.mp4")
+    
+    try:
+        reset_frame_cache_stats()
+        # primeiro por tramos en varios procesos, se non se pode (ou falla) o bucle de sempre nun solo proceso
+        paralelo_ok = RENDER_PARALELO and not so_karaoke and render_karaoke_chunked(
+            video_path, grupos, duracion, ruta_audio, ruta_saida, ruta_video_silencioso, render_profile=render_profile)
+        if not paralelo_ok:
+            _escribir_frames_secuencial(video_escurecido, overlay, ruta_saida, ruta_video_silencioso, ruta_audio,
+                                        perfil)
+        print(f"Render moviepy: {'en paralelo por tramos' if paralelo_ok else 'secuencial'}")
+        print(f"Cache de frames dos subtitulos: {get_frame_cache_stats()}")
+        
+        if os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0:
+            print(f" Video generado correctamente: {ruta_saida}")
+        else:
+            print("O archivo non se creou ben")
+            return False
+            
+    except Exception as errorEscritura:
+        #logs para verificar errores. Moitos problemas aqui. MOSTRAR TRACEBACK enteiro 
+        print(f" error de escritura de video => {errorEscritura}")
+        print(f" Traceback completo: {traceback.format_exc()}")
+        return False
+    finally:
+        video_fondo.close()
+    return True
+
+
+# Render final do karaoke (video con subtitulos + video sen audio) co backend de config.BACKEND_RENDER.
+# Se o backend de ffmpeg falla (ffmpeg sen libass, por exemplo) vaise por moviepy
+BACKENDS_FFMPEG = {
+    "ass": render_karaoke_ass,
+    "overlay": render_karaoke_overlay_events,
+}
+
+# Con normalizar=True o video_path non está normalizado (modo dun paso) e normalizase aqui se hai que ir por moviepy.
+# O audio mesturase e codificase unha vez aqui e todos os backends copian ese stream.
+# render_profile é o nome do perfil de config.PERFILES_RENDER (preset/crf/tune do video e bitrate do audio)
+def render_karaoke_video(video_path: str, grupos: list, ruta_voz: str, ruta_musica: str, ruta_saida: str,
+                         ruta_video_alternativa: str = None, normalizar: bool = False,
+                         render_profile: str = None, fondo_escurecido: bool = False) -> bool:
+    perfil = get_render_profile(render_profile)
+    ruta_audio = mix_audio_tracks(ruta_musica, ruta_voz, ruta_saida.replace(".mp4", "_audio.m4a"),
+                                  bitrate=perfil["audio_bitrate"])
     if not ruta_audio:
+        return False
+
+    try:
+        if BACKEND_RENDER in BACKENDS_FFMPEG:
+            if BACKENDS_FFMPEG[BACKEND_RENDER](video_path, grupos, ruta_audio, ruta_saida, normalizar=normalizar,
+                                                render_profile=render_profile, fondo_escurecido=fondo_escurecido):
+                return True
+            print(f"Fallou o render con {BACKEND_RENDER}, usando moviepy")
+            if normalizar:
+                try:
+                    video_path = normalize_video(video_path, render_profile, os.path.dirname(ruta_saida))
+                except Exception as erro_normalizacion:
+                    print(f" Error na normalización: {erro_normalizacion}, continuando co video original")
+        return _render_karaoke_moviepy(video_path, grupos, ruta_audio, ruta_saida, ruta_video_alternativa,
+                                       render_profile, fondo_escurecido)
+    finally:
+        if os.path.exists(ruta_audio):
+            os.remove(ruta_audio)
+
+
+# Previsualizacion rapida (perfil "preview": 360p, poucos fps, ultrafast) cos mismos grupos e o mismo backend
+# que o render final. Pasase o nome ao progress_callback para que a paxina de progreso a enlace mentres
+# segue o render final. Devolve a ruta ou "" se non se xerou (non é un erro, o render final segue igual).
+# Renderizase no directorio do traballo e pasa a output xa enteira
+def _xerar_previsualizacion(video_path: str, grupos: list, ruta_voz: str, ruta_musica: str, ruta_saida: str,
+                            normalizar: bool, progress_callback=None, checkpoints: CheckpointsTraballo = None) -> str:
+    if not XERAR_PREVISUALIZACION:
         return ""
-    
     if progress_callback:
-        progress_callback("Separando voces e instrumental...", 25)
-    ruta_voz, ruta_musica = separate_stems_cli(ruta_audio)
-    
-    if not ruta_voz or not ruta_musica:
-        return ""    
-    
+        progress_callback("Xerando previsualización...", 82)
+    ruta_preview = ruta_saida.replace(".mp4", "_preview.mp4")
+    if not render_karaoke_video(video_path, grupos, ruta_voz, ruta_musica, ruta_preview,
+                                normalizar=normalizar, render_profile="preview"):
+        print("Non se puido xerar a previsualización, seguese co render final")
+        return ""
+    if checkpoints:
+        ruta_preview = checkpoints.promote(ruta_preview, os.path.join("./output", os.path.basename(ruta_preview)))
     if progress_callback:
-        progress_callback("Transcribindo letra con IA...", 45)
-    #cambio a faster whisper para o automatico por culpa do VAD de whisperx.
-    transcribed_lyrics = transcribe_with_faster_whisper(ruta_voz, whisper_model)
-    if not transcribed_lyrics:
+        progress_callback("Previsualización lista, renderizando vídeo final...", 85,
+                          preview=os.path.basename(ruta_preview))
+    return ruta_preview
+
+
+# Modo sen queimar: no canto do render cos subtitulos solo se xera o fondo escurecido (_video_only.mp4) e o
+# reprodutor web debuxa as letras co timeline. O mp4 coas letras queimadas faise solo se se pide (burn_karaoke_from_timeline).
+# Non depende das letras, asi que vai na rama do video mentres se separa e aliña o audio. Dura o que o audio do orixinal
+def _render_sen_queimar(video_path: str, ruta_audio_orixe: str, ruta_saida: str, normalizar: bool,
+                        render_profile: str = None) -> bool:
+    return render_background_video(video_path, ruta_saida.replace(".mp4", "_video_only.mp4"),
+                                   get_audio_duration(ruta_audio_orixe), normalizar=normalizar,
+                                   render_profile=render_profile)
+
+
+# Queimar as letras no mp4 dun karaoke feito no modo sen queimar, para descargalo. Usa o timeline, o _video_only.mp4
+# (xa escurecido) e os stems que quedaron en output, sen repetir separacion nin aliñacion. Devolve o nome do mp4 ou "".
+# O render faise no directorio do traballo (job_id, o da tarefa de celery) e o mp4 pasa a output enteiro
+def burn_karaoke_from_timeline(karaoke_filename: str, render_profile: str = None, progress_callback=None,
+                               job_id: str = None) -> str:
+    ruta_saida = os.path.join("./output", karaoke_filename)
+    if os.path.exists(ruta_saida):
+        return karaoke_filename
+
+    if progress_callback:
+        progress_callback("Cargando letras...", 10)
+    grupos = groups_from_timeline(load_lyrics_timeline(os.path.join("./output", timeline_filename(karaoke_filename))))
+    if not grupos:
+        print(f"Non hai timeline de letras para {karaoke_filename}")
         return ""
-    
-    
-    #solucion medio casera, normalizo as letras como se foran manuales. mais ou menos fago todo o posible como se fora manual menos a trancricion
-    letras_normalizadas = normalize_manual_lyrics(transcribed_lyrics)
-    
+
+    nome_base = karaoke_base_name(karaoke_filename)
+    ruta_video_silencioso = ruta_saida.replace(".mp4", "_video_only.mp4")
+    ruta_voz = os.path.join("./output", f"vocal_{nome_base}.wav")
+    ruta_musica = os.path.join("./output", f"instrumental_{nome_base}.wav")
+    for ruta in (ruta_video_silencioso, ruta_voz, ruta_musica):
+        if not os.path.exists(ruta):
+            print(f"Falta {ruta} para queimar o karaoke")
+            return ""
+
     if progress_callback:
-        progress_callback("Sincronizando letra con audio...", 60)
-    whisper_response = call_whisperx_endpoint_manual(ruta_voz, letras_normalizadas, None, enable_diarization, hf_token, whisper_model)
-    archivoSRT = ruta_voz.replace(".wav", f"_whisperx_{whisper_model}.srt")
-    
-    tempo_maximo = 30  
+        progress_callback("Queimando letras no vídeo...", 30)
+    job_id = job_id or uuid.uuid4().hex
+    directorio_traballo = job_directory(job_id)
+    os.makedirs(directorio_traballo, exist_ok=True)
+    try:
+        ruta_render = os.path.join(directorio_traballo, karaoke_filename)
+        if not render_karaoke_video(ruta_video_silencioso, grupos, ruta_voz, ruta_musica, ruta_render,
+                                    render_profile=render_profile, fondo_escurecido=True):
+            return ""
+        promote_file(ruta_render, ruta_saida)
+    finally:
+        discard_job(job_id)
+    return karaoke_filename
+
+
+# Segmentos de palabra da aliñacion. O servicio de whisperx devolveos no JSON de /align cos tempos exactos de cada
+# palabra, asi que non hai que esperar polo SRT nin repartir os tempos dos bloques. Se a resposta non os trae
+# (servicio sen actualizar) faise coma antes: esperase polo SRT ata 30s e parsease
+def _segmentos_aliñacion(whisper_response: dict, ruta_voz: str, whisper_model: str) -> list:
+    if not whisper_response:
+        print("Error: o servicio de aliñacion non respondeu")
+        return []
+
+    segmentos = word_segments_from_response(whisper_response)
+    if segmentos is not None:
+        print(f"Aliñacion recibida no JSON: {len(segmentos)} palabras")
+        return segmentos
+
+    archivoSRT = whisper_response.get("srt_path") or ruta_voz.replace(".wav", f"_whisperx_{whisper_model}.srt")
+    tempo_maximo = 30
     tempo_esperado = 0
     while not os.path.exists(archivoSRT) and tempo_esperado < tempo_maximo:
         time.sleep(1)
         tempo_esperado += 1
-    
+
     if not os.path.exists(archivoSRT):
-        print(f"Error: Nnn se xerou o arquivo SRT despois d {tempo_maximo}s")    #se non encontra o srt despois do tempo ese, return ""
-        return ""
-    
+        print(f"Error: Nnn se xerou o arquivo SRT despois d {tempo_maximo}s")
+        return []
     if os.path.getsize(archivoSRT) == 0:  #Esto é para asegurar que o srt non esta vacio
         print("error: O arquivo SRT está vacio")
+        return []
+    return parse_word_srt(archivoSRT)
+
+
+# O modo dun paso solo ten sentido cos backends de ffmpeg, moviepy necesita o video xa normalizado
+def _usar_pipeline_un_paso() -> bool:
+    return PIPELINE_UN_PASO and BACKEND_RENDER in BACKENDS_FFMPEG
+
+
+# Checkpoints e directorio do traballo. Co id da tarefa de celery un reintento retoma o traballo, sen id (main.py) xerase un novo.
+# Os parametros gardanse para poder retomalo con resume_job (o hf_token non, non se escribe en disco)
+def _checkpoints_traballo(job_id: str, tipo: str, parametros: dict) -> CheckpointsTraballo:
+    cleanup_stale_jobs()
+    parametros = {clave: valor for clave, valor in parametros.items() if clave != "hf_token"}
+    return CheckpointsTraballo(job_id or uuid.uuid4().hex, tipo, parametros)
+
+
+# Etapas dos traballos. Cada unha devolve un dict co que necesitan as seguintes ({} se falla)
+
+def _etapa_normalizar(video_path: str, render_profile: str, un_paso: bool, directorio_traballo: str) -> dict:
+    try:
+        if not un_paso:
+            video_path = normalize_video(video_path, render_profile, directorio_traballo)
+    except Exception as erro_normalizacion:
+        print(f" Error na normalización: {erro_normalizacion}, continuando co video original")
+    return {"video_path": video_path}
+
+
+def _etapa_extraer_audio(video_path: str, directorio_traballo: str) -> dict:
+    ruta_audio = extract_audio_wav(video_path, directorio_traballo)
+    return {"ruta_audio": ruta_audio} if ruta_audio else {}
+
+
+def _etapa_separar(ruta_audio: str, directorio_traballo: str) -> dict:
+    ruta_voz, ruta_musica = separate_stems_cli(ruta_audio, directorio_traballo)
+    if not ruta_voz or not ruta_musica:
+        print(" Falta ou vocals ou music")
+        return {}
+    return {"ruta_voz": ruta_voz, "ruta_musica": ruta_musica}
+
+
+def _etapa_transcribir(ruta_voz: str, whisper_model: str) -> dict:
+    #cambio a faster whisper para o automatico por culpa do VAD de whisperx.
+    letra, idioma = transcribe_with_faster_whisper(ruta_voz, whisper_model, return_language=True)
+    return {"letra": letra, "idioma": idioma} if letra else {}
+
+
+def _etapa_aliñar(ruta_voz: str, letras_normalizadas: str, language, enable_diarization: bool, hf_token: str,
+                  whisper_model: str) -> dict:
+    whisper_response = call_whisperx_endpoint_manual(ruta_voz, letras_normalizadas, language, enable_diarization,
+                                                     hf_token, whisper_model)
+    segmentos = _segmentos_aliñacion(whisper_response, ruta_voz, whisper_model)
+    if not segmentos:
+        return {}
+    return {"segmentos": segmentos, "idioma": whisper_response.get("language")}
+
+
+def _etapa_fondo(video_path: str, ruta_video_orixinal: str, nome_saida: str, un_paso: bool,
+                 render_profile: str, checkpoints: CheckpointsTraballo) -> dict:
+    ruta_saida = os.path.join(checkpoints.directorio, nome_saida)
+    if not _render_sen_queimar(video_path, ruta_video_orixinal, ruta_saida, un_paso, render_profile):
+        return {}
+    nome_video_silencioso = nome_saida.replace(".mp4", "_video_only.mp4")
+    return {"ruta_video": checkpoints.promote(os.path.join(checkpoints.directorio, nome_video_silencioso),
+                                              os.path.join("./output", nome_video_silencioso))}
+
+
+# Render final e o timeline das letras. No modo sen queimar o fondo xa o fixo a rama do video e solo queda
+# o timeline. Todo se renderiza no directorio do traballo e pasa a output ao rematar. Devolve a ruta en output
+def _etapa_render(video_path: str, grupos: list, ruta_voz: str, ruta_musica: str, nome_saida: str, un_paso: bool,
+                  render_profile: str, burn_subtitles: bool, checkpoints: CheckpointsTraballo,
+                  ruta_video_alternativa: str = None, progress_callback=None) -> dict:
+    ruta_saida = os.path.join(checkpoints.directorio, nome_saida)
+    nome_timeline = timeline_filename(nome_saida)
+    ruta_timeline = write_lyrics_timeline(grupos, os.path.join(checkpoints.directorio, nome_timeline))
+    if ruta_timeline:
+        ruta_timeline = checkpoints.promote(ruta_timeline, os.path.join("./output", nome_timeline))
+    if burn_subtitles:
+        ruta_preview = _xerar_previsualizacion(video_path, grupos, ruta_voz, ruta_musica, ruta_saida,
+                                               un_paso, progress_callback, checkpoints)
+        if progress_callback:
+            progress_callback("Renderizando vídeo final...", 90)
+        if not render_karaoke_video(video_path, grupos, ruta_voz, ruta_musica, ruta_saida,
+                                    ruta_video_alternativa=ruta_video_alternativa, normalizar=un_paso,
+                                    render_profile=render_profile):
+            return {}
+        ruta_video_silencioso = ruta_saida.replace(".mp4", "_video_only.mp4")
+        if os.path.exists(ruta_video_silencioso):
+            checkpoints.promote(ruta_video_silencioso, os.path.join("./output", os.path.basename(ruta_video_silencioso)))
+        ruta_final = checkpoints.promote(ruta_saida, os.path.join("./output", nome_saida))
+        if ruta_preview and os.path.exists(ruta_preview):
+            os.remove(ruta_preview)     #xa está o bo
+        return {"ruta_video": ruta_final}
+
+    ruta_video_silencioso = os.path.join("./output", nome_saida.replace(".mp4", "_video_only.mp4"))
+    if not ruta_timeline or not os.path.exists(ruta_video_silencioso):
+        return {}
+    return {"ruta_video": ruta_video_silencioso}
+
+
+#Aqui gardo os archivos separados para o tema do reprodutor web (os do traballo, que se borra despois)
+def _gardar_stems_reprodutor(ruta_voz: str, ruta_musica: str, whisper_model: str, nome_video_seguro: str,
+                             checkpoints: CheckpointsTraballo):
+    try:
+        nome_sin_extension = nome_video_seguro.replace('.mp4', '')
+        ruta_vocal_output = os.path.join("./output", f"vocal_{whisper_model}_{nome_sin_extension}.wav")
+        ruta_instrumental_output = os.path.join("./output", f"instrumental_{whisper_model}_{nome_sin_extension}.wav")
+        
+        checkpoints.promote(ruta_voz, ruta_vocal_output, copiar=True)
+        checkpoints.promote(ruta_musica, ruta_instrumental_output, copiar=True)
+        
+    except Exception as e:
+        print(f"Erro cos archivos separados: {e}")
+
+
+#Este é o create para a version automática. WhisperX transcribe él mismo, despois parsease o SRT en tokens
+#agrupanse en frases cada N palabras e despois renderizase o karaoke.
+# Vai por etapas con checkpoint (job_checkpoints): se se chama outra vez co mismo job_id empeza na primeira sen facer
+
+def create(video_path: str, enable_diarization: bool = False, hf_token: str = None, whisper_model: str = "small",
+           source_type: str = "upload", source_url: str = None, save_to_db: bool = True, progress_callback=None,
+           render_profile: str = None, burn_subtitles: bool = True, job_id: str = None):
+    
+    checkpoints = _checkpoints_traballo(job_id, "automatic", dict(
+        video_path=video_path, enable_diarization=enable_diarization, whisper_model=whisper_model,
+        source_type=source_type, source_url=source_url, save_to_db=save_to_db, render_profile=render_profile,
+        burn_subtitles=burn_subtitles))
+    reset_artifact_cache_stats()
+    
+    if progress_callback:
+        progress_callback("Iniciando procesamento...", 5)
+ 
+   # Normalizo o video. Por que? Porque añadin a parte de poder meter un MP4 para poder recortar videos e facer que
+    # ocupen menos, para facer ensayo e error mais rapidamente. Entonces necesito que o formato do video do link de YT
+    # e o formato do Mp4 sean o mesmo, porque si os subtitulos non son iguais non me sirve de nada practicar cos mp4s.
+    # (no modo dun paso a normalizacion vai dentro do render final)
+    # O video e o audio van en dúas ramas ao mismo tempo: o audio sacase do orixinal, non ten que esperar polo normalizado
+    un_paso = _usar_pipeline_un_paso()
+    ruta_video_orixinal = video_path
+
+    def rama_video():
+        if progress_callback and not un_paso:
+            progress_callback("Normalizando vídeo...", 10)
+        video_normalizado = run_stage(checkpoints, "normalize", lambda: _etapa_normalizar(
+            ruta_video_orixinal, render_profile, un_paso, checkpoints.directorio), ("video_path",))["video_path"]
+        nome_video_seguro = sanitize_filename(os.path.basename(video_normalizado).replace("_normalized", ""))
+        nome_saida = f"karaoke_{whisper_model}_{nome_video_seguro}"
+        if not burn_subtitles and not run_stage(checkpoints, "background", lambda: _etapa_fondo(
+                video_normalizado, ruta_video_orixinal, nome_saida, un_paso, render_profile, checkpoints), ("ruta_video",)):
+            return {}
+        return {"video_path": video_normalizado, "nome_video_seguro": nome_video_seguro, "nome_saida": nome_saida}
+
+    def rama_audio():
+        if progress_callback:
+            progress_callback("Extraendo audio...", 15)
+        audio = run_stage(checkpoints, "extract_audio", lambda: _etapa_extraer_audio(ruta_video_orixinal, checkpoints.directorio),
+                          ("ruta_audio",))
+        if not audio:
+            return {}
+        
+        if progress_callback:
+            progress_callback("Separando voces e instrumental...", 25)
+        stems = run_stage(checkpoints, "separate", lambda: _etapa_separar(audio["ruta_audio"], checkpoints.directorio),
+                          ("ruta_voz", "ruta_musica"))
+        if not stems:
+            return {}
+        
+        if progress_callback:
+            progress_callback("Transcribindo letra con IA...", 45)
+        transcricion = run_stage(checkpoints, "transcribe", lambda: _etapa_transcribir(stems["ruta_voz"], whisper_model))
+        if not transcricion:
+            return {}
+        
+        #solucion medio casera, normalizo as letras como se foran manuales. mais ou menos fago todo o posible como se fora manual menos a trancricion
+        letras_normalizadas = normalize_manual_lyrics(transcricion["letra"])
+        
+        if progress_callback:
+            progress_callback("Sincronizando letra con audio...", 60)
+        aliñacion = run_stage(checkpoints, "align", lambda: _etapa_aliñar(
+            stems["ruta_voz"], letras_normalizadas, None, enable_diarization, hf_token, whisper_model))
+        if not aliñacion:
+            return {}
+        return {**stems, "segmentos": aliñacion["segmentos"], "idioma": transcricion["idioma"]}
+
+    ramas = run_parallel_branches({"video": rama_video, "audio": rama_audio})
+    if not ramas["video"] or not ramas["audio"]:
         return ""
+    video_path = ramas["video"]["video_path"]
+    nome_video_seguro, nome_saida = ramas["video"]["nome_video_seguro"], ramas["video"]["nome_saida"]
+    ruta_voz, ruta_musica = ramas["audio"]["ruta_voz"], ramas["audio"]["ruta_musica"]
     
     if progress_callback:
         progress_callback("Procesando subtítulos...", 70)
     #fixen unha funcion para agrupar frases no modo automatico, porque non pode ser con saltos de linea
-    segmento_palabras = parse_word_srt(archivoSRT)
-    grupos_texto = group_word_segments_automatic(segmento_palabras, max_words_per_phrase=6, max_duration=3.5)
+    grupos_texto = group_word_segments_automatic(ramas["audio"]["segmentos"], max_words_per_phrase=6, max_duration=3.5)
     if not grupos_texto:
         return ""
     
     print(f"Creados {len(grupos_texto)} grupos de frases (debug) ")
+    attach_syllable_tables(grupos_texto, ramas["audio"]["idioma"])    #silabas unha vez por canción, o render xa non chama ao pyphen
     
     if progress_callback:
         progress_callback("Creando vídeo final...", 80)
-    # Composición con moviepy (igual q en modo manual)
-    try:
-        audio_musica = AudioFileClip(ruta_musica).set_fps(44100)
-        audio_voces = AudioFileClip(ruta_voz).volumex(VOLUME_VOCAL).set_fps(44100)
-        audio_mesturado = CompositeAudioClip([audio_musica, audio_voces])
-    except Exception as erro_audio:
-        print(f"Error cargando audio {erro_audio}")
-        return ""
-    
-    try:
-        video_fondo = VideoFileClip(video_path).set_duration(audio_mesturado.duration).set_fps(30)
-    except Exception as erro_video:
-        print(f"Error cargando video {erro_video}")
-        return ""
-    
-    video_escurecido = video_fondo.fl_image(lambda img: (img*0.3).astype("uint8"))
-    
-   
-    clips_karaoke = []
-    for indice, grupo in enumerate(grupos_texto):
-        #mostrar medio segundo antes por comodidad
-        inicio_compensado = max(grupo["start"] - 0.5, 0)
-        duracion_extendida = grupo["end"] - grupo["start"] + 1.0  
-        
-        linha_seguinte = grupos_texto[indice + 1] if indice + 1 < len(grupos_texto) else None
-        clip_texto = create_karaoke_text_clip(grupo, next_line_info=linha_seguinte, advance=0.5, duration_padding=0.5)
-        
-        posicion_baixo = ALTO_VIDEO - MARXE_INFERIOR_SUBTITULO
-        
-        clip_texto = clip_texto.set_start(inicio_compensado).set_duration(duracion_extendida)
-        clip_texto = clip_texto.set_position(('center', posicion_baixo))
-        
-        clips_karaoke.append(clip_texto) 
 
-    video_final = CompositeVideoClip([video_escurecido] + clips_karaoke).set_audio(audio_mesturado)
-    
-    nome_video_base = os.path.basename(video_path).replace("_normalized", "")
-    nome_video_seguro = sanitize_filename(nome_video_base)
-    nome_saida = f"karaoke_{whisper_model}_{nome_video_seguro}"
-
-    
-    if not os.path.exists("./output"):
-        os.makedirs("./output")
-    ruta_saida = os.path.join("./output", nome_saida)
-    try:
-        if progress_callback:
-            progress_callback("Renderizando vídeo final...", 90)
-        video_final.write_videofile(ruta_saida, fps=30, threads=4)
-        
-        if os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0:
-            print(f" Video generado correctamente: {ruta_saida}")
-        else:
-            print("O archivo non se creou ben")
-            return ""
-            
-    except Exception as errorEscritura:
-        #logs para verificar errores. Moitos problemas aqui. MOSTRAR TRACEBACK enteiro 
-        print(f" error de escritura de video => {errorEscritura}")
-        print(f" Traceback completo: {traceback.format_exc()}")
+    if not run_stage(checkpoints, "render", lambda: _etapa_render(
+            video_path, grupos_texto, ruta_voz, ruta_musica, nome_saida, un_paso, render_profile, burn_subtitles,
+            checkpoints, progress_callback=progress_callback), ("ruta_video",)):
         return ""
     
-    #Aqui gardo os archivos separados para o tema do reprodutor web
-    try:
-        video_sin_audio = video_escurecido
-        ruta_video_silencioso = ruta_saida.replace(".mp4", "_video_only.mp4")
-        video_sin_audio.write_videofile(ruta_video_silencioso, fps=30, threads=4, audio=False)
-        
-        nome_sin_extension = nome_video_seguro.replace('.mp4', '')
-        ruta_vocal_output = os.path.join("./output", f"vocal_{whisper_model}_{nome_sin_extension}.wav")
-        ruta_instrumental_output = os.path.join("./output", f"instrumental_{whisper_model}_{nome_sin_extension}.wav")
-        
-        import shutil
-        shutil.copy2(ruta_voz, ruta_vocal_output)
-        shutil.copy2(ruta_musica, ruta_instrumental_output)
-        
-    except Exception as e:
-        print(f"Erro cos archivos separados: {e}")
+    _gardar_stems_reprodutor(ruta_voz, ruta_musica, whisper_model, nome_video_seguro, checkpoints)
+    print(f"Cache de artefactos: {get_artifact_cache_stats()}")
     
     #gardar na base de datos se está habilitado
     if save_to_db:
@@ -188,6 +477,7 @@ def create(video_path: str, enable_diarization: bool = False, hf_token: str = No
         except Exception as e:
             print(f"Erro gardando na base de datos: {e}")
     
+    checkpoints.discard()
     return nome_saida
 
 
@@ -195,164 +485,88 @@ def create(video_path: str, enable_diarization: bool = False, hf_token: str = No
 
 # A outra variante, uso de FORCED ALIGNMENT
 def create_with_manual_lyrics(video_path: str, manual_lyrics: str, language=None, enable_diarization: bool = False, hf_token: str = None, whisper_model: str = "small",
-                             source_type: str = "upload", source_url: str = None, save_to_db: bool = True, progress_callback=None) -> str:
+                             source_type: str = "upload", source_url: str = None, save_to_db: bool = True, progress_callback=None,
+                             render_profile: str = None, burn_subtitles: bool = True, job_id: str = None) -> str:
 
-    remove_previous_srt()
+    checkpoints = _checkpoints_traballo(job_id, "manual_lyrics", dict(
+        video_path=video_path, manual_lyrics=manual_lyrics, language=language, enable_diarization=enable_diarization,
+        whisper_model=whisper_model, source_type=source_type, source_url=source_url, save_to_db=save_to_db,
+        render_profile=render_profile, burn_subtitles=burn_subtitles))
+    reset_artifact_cache_stats()
     
     if progress_callback:
         progress_callback("Iniciando procesamento con letras manuais...", 5)
     letras_normalizadas = normalize_manual_lyrics(manual_lyrics)
     
     #Forzar normalizado porque se non os subtitulos poden salir diferentes en algunhas ocasions
+    # (no modo dun paso vai dentro do render final, que escala o mismo)
+    # Igual que no automatico, o video e o audio van en dúas ramas ao mismo tempo
     ruta_video_orixinal = video_path
-    try:
-        if progress_callback:
+    un_paso = _usar_pipeline_un_paso()
+
+    def rama_video():
+        if progress_callback and not un_paso:
             progress_callback("Normalizando vídeo...", 10)
-        ruta_normalizada = normalize_video(video_path)
-        if ruta_normalizada != video_path:
-            video_path = ruta_normalizada
-        else:
-            print("")
-    except Exception as erro_norm:
-        print(f"error na normalización: {erro_norm}, continuando co video orixinal")
-    
-    if progress_callback:
-        progress_callback("Extraendo audio...", 15)
-    ruta_audio = video_to_mp3(video_path)
-    if not ruta_audio:
-        return ""
-    
-    if progress_callback:
-        progress_callback("Separando voces e instrumental...", 25)
-    ruta_voz, ruta_musica = separate_stems_cli(ruta_audio)
-    if not ruta_voz or not ruta_musica:
-        print(" Falta ou vocals ou music")
-        return ""    
-    
-    if progress_callback:
-        progress_callback("Sincronizando letras con audio...", 45)
-    # Endpoint pero da letra manual con parámetros de diarization
-    whisper_response = call_whisperx_endpoint_manual(ruta_voz, letras_normalizadas, language, enable_diarization, hf_token, whisper_model)
-    archivoSRT = ruta_voz.replace(".wav", f"_whisperx_{whisper_model}.srt")
-    
-    
-    tempo_limite = 30  
-    tempo_transcorrido = 0
-    while not os.path.exists(archivoSRT) and tempo_transcorrido < tempo_limite:
-        time.sleep(1)    
-        tempo_transcorrido += 1
-    
-    if not os.path.exists(archivoSRT):
-        print(f"non se encontrou o srt {tempo_limite}s ")
-        return ""
-    
-    if os.path.getsize(archivoSRT) == 0:
+        video_normalizado = run_stage(checkpoints, "normalize", lambda: _etapa_normalizar(
+            ruta_video_orixinal, render_profile, un_paso, checkpoints.directorio), ("video_path",))["video_path"]
+        nome_video_seguro = sanitize_filename(os.path.basename(video_normalizado))
+        nombreArchivo = f"karaoke_manual_{whisper_model}_{nome_video_seguro}"
+        if not burn_subtitles and not run_stage(checkpoints, "background", lambda: _etapa_fondo(
+                video_normalizado, ruta_video_orixinal, nombreArchivo, un_paso, render_profile, checkpoints), ("ruta_video",)):
+            return {}
+        return {"video_path": video_normalizado, "nome_video_seguro": nome_video_seguro, "nome_saida": nombreArchivo}
+
+    def rama_audio():
+        if progress_callback:
+            progress_callback("Extraendo audio...", 15)
+        audio = run_stage(checkpoints, "extract_audio", lambda: _etapa_extraer_audio(ruta_video_orixinal, checkpoints.directorio),
+                          ("ruta_audio",))
+        if not audio:
+            return {}
+        
+        if progress_callback:
+            progress_callback("Separando voces e instrumental...", 25)
+        stems = run_stage(checkpoints, "separate", lambda: _etapa_separar(audio["ruta_audio"], checkpoints.directorio),
+                          ("ruta_voz", "ruta_musica"))
+        if not stems:
+            return {}
+        
+        if progress_callback:
+            progress_callback("Sincronizando letras con audio...", 45)
+        # Endpoint pero da letra manual con parámetros de diarization
+        aliñacion = run_stage(checkpoints, "align", lambda: _etapa_aliñar(
+            stems["ruta_voz"], letras_normalizadas, language, enable_diarization, hf_token, whisper_model))
+        if not aliñacion:
+            return {}
+        return {**stems, "segmentos": aliñacion["segmentos"], "idioma": aliñacion.get("idioma")}
+
+    ramas = run_parallel_branches({"video": rama_video, "audio": rama_audio})
+    if not ramas["video"] or not ramas["audio"]:
         return ""
+    video_path = ramas["video"]["video_path"]
+    nome_video_seguro, nombreArchivo = ramas["video"]["nome_video_seguro"], ramas["video"]["nome_saida"]
+    ruta_voz, ruta_musica = ramas["audio"]["ruta_voz"], ramas["audio"]["ruta_musica"]
     
     if progress_callback:
         progress_callback("Procesando subtítulos...", 60)
     # DIFERENTE: agrupanse as palabras segun a letra manual
-    segmento_palabras = parse_word_srt(archivoSRT)
-    grupos_manuais = group_word_segments(letras_normalizadas, segmento_palabras)
+    grupos_manuais = group_word_segments(letras_normalizadas, ramas["audio"]["segmentos"])
     if not grupos_manuais:
         print("error na agrupacion")
         return ""
+    # se non se indicou idioma usase o que detectou o servicio para o dicionario de silabas
+    attach_syllable_tables(grupos_manuais, language or ramas["audio"]["idioma"])
     
     if progress_callback:
         progress_callback("Creando vídeo final...", 75)
-    #Compoñer con moviepy
-    try:
-        audio_musica = AudioFileClip(ruta_musica).set_fps(44100)
-        audio_voces = AudioFileClip(ruta_voz).volumex(VOLUME_VOCAL).set_fps(44100)
-        audio_mesturado = CompositeAudioClip([audio_musica, audio_voces])
-        #print(f"audio combinado OK, dura: {audio_mesturado.duration}s")
-    except Exception as erro_audio:
-        print(f"error cargando audio {erro_audio}")
-        return ""
-    
-    try:
-        video_fondo = VideoFileClip(video_path).set_duration(audio_mesturado.duration).set_fps(30)
-        #print(f" Video OK, dura: {video_fondo.duration}s, e ocupa: {video_fondo.size}")
-    except Exception as erro_video:
 
-        # Intentase co video original se onormalizado falla
-        if video_path != ruta_video_orixinal:
-            try:
-                video_fondo = VideoFileClip(ruta_video_orixinal).set_duration(audio_mesturado.duration).set_fps(30)
-            except Exception as erro_video2:
-                print(f"fallo tamen co video orixinal {erro_video2}")
-                return ""
-        else:
-            return ""
-    
-    video_escurecido = video_fondo.fl_image(lambda img: (img*0.3).astype("uint8"))
-    
-
-
-    clips_karaoke = []
-    for indice, grupo in enumerate(grupos_manuais):
-        #mostrase medio segundo antes por comodidad
-        inicio_compensado = max(grupo["start"] - 0.5, 0)
-        duracion_extendida = grupo["end"] - grupo["start"] + 1.0  
-        
-        # arreglo por frases largas. MIRAR CAL SERIA O LIMITE!!!!
-        linha_seguinte = grupos_manuais[indice + 1] if indice + 1 < len(grupos_manuais) else None
-        clip_texto = create_karaoke_text_clip(grupo, next_line_info=linha_seguinte, advance=0.5, duration_padding=0.5)
-        
-
-        posicion_baixo = ALTO_VIDEO - MARXE_INFERIOR_SUBTITULO
-        
-        clip_texto = clip_texto.set_start(inicio_compensado).set_duration(duracion_extendida)
-        clip_texto = clip_texto.set_position(('center', posicion_baixo))
-        
-        clips_karaoke.append(clip_texto) 
-
-    # Faise o video final superpoñendo os clips de karaoke sobre o fondo
-    video_final = CompositeVideoClip([video_escurecido] + clips_karaoke).set_audio(audio_mesturado)
-    
-
-    nome_video_base = os.path.basename(video_path)
-    nome_video_seguro = sanitize_filename(nome_video_base)
-    nombreArchivo = f"karaoke_manual_{whisper_model}_{nome_video_seguro}"
-
-
-    if not os.path.exists("./output"):
-        os.makedirs("./output")
-    ruta_saida = os.path.join("./output", nombreArchivo)
-    
-    try:
-        if progress_callback:
-            progress_callback("Renderizando vídeo final...", 90)
-        video_final.write_videofile(ruta_saida, fps=30, threads=4)
-        
-        if os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0:
-            print(f" Video generado correctamente: {ruta_saida}")
-        else:
-            print("non se creou o archivo de salida")
-            return ""
-            
-    except Exception as errorEscritura:
-        print(f"error de escritura => {errorEscritura}")
-        # O mismo que no automatico, mostramos mais info do error debido a varios problemas
-        print(f"Traceback completo: {traceback.format_exc()}")
+    if not run_stage(checkpoints, "render", lambda: _etapa_render(
+            video_path, grupos_manuais, ruta_voz, ruta_musica, nombreArchivo, un_paso, render_profile, burn_subtitles,
+            checkpoints, ruta_video_alternativa=ruta_video_orixinal, progress_callback=progress_callback), ("ruta_video",)):
         return ""
     
-    #Aqui gardo os archivos separados para o tema do reprodutor web
-    try:
-        video_sin_audio = video_escurecido
-        ruta_video_silencioso = ruta_saida.replace(".mp4", "_video_only.mp4")
-        video_sin_audio.write_videofile(ruta_video_silencioso, fps=30, threads=4, audio=False)
-        
-        nome_sin_extension = nome_video_seguro.replace('.mp4', '')
-        ruta_vocal_output = os.path.join("./output", f"vocal_{whisper_model}_{nome_sin_extension}.wav")
-        ruta_instrumental_output = os.path.join("./output", f"instrumental_{whisper_model}_{nome_sin_extension}.wav")
-        
-        import shutil
-        shutil.copy2(ruta_voz, ruta_vocal_output)
-        shutil.copy2(ruta_musica, ruta_instrumental_output)
-        
-    except Exception as e:
-        print(f"Error cos arquivos separados: {e}")
+    _gardar_stems_reprodutor(ruta_voz, ruta_musica, whisper_model, nome_video_seguro, checkpoints)
+    print(f"Cache de artefactos: {get_artifact_cache_stats()}")
     
     #Gardar na base de datos 
     if save_to_db:
@@ -375,38 +589,54 @@ def create_with_manual_lyrics(video_path: str, manual_lyrics: str, language=None
         except Exception as e:
             print(f"Erro gardando na base de datos: {e}")
     
+    checkpoints.discard()
     return nombreArchivo
 
 
-def generate_instrumental(video_path: str, source_type: str = "upload", source_url: str = None, save_to_db: bool = True, progress_callback=None) -> str:
+# a instrumental final é unha copia dos stems do traballo (o stem queda para a cache), pasada a output enteira
+def _etapa_copiar_instrumental(ruta_musica: str, nome_saida: str, checkpoints: CheckpointsTraballo) -> dict:
+    ruta_saida = os.path.join("./output", nome_saida)
+    
+    try:
+        checkpoints.promote(ruta_musica, ruta_saida, copiar=True)
+        
+        if os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0:
+            print(f"Instrumental xerada. {ruta_saida}")
+        else:
+            return {}
+            
+    except Exception as error_copia:
+        return {}
+    return {"ruta_saida": ruta_saida}
+
+
+def generate_instrumental(video_path: str, source_type: str = "upload", source_url: str = None, save_to_db: bool = True,
+                          progress_callback=None, job_id: str = None) -> str:
 
+    checkpoints = _checkpoints_traballo(job_id, "instrumental", dict(
+        video_path=video_path, source_type=source_type, source_url=source_url, save_to_db=save_to_db))
+    reset_artifact_cache_stats()
     if progress_callback:
         progress_callback("Iniciando extracción instrumental...", 5)
     
-    #solo normalizar se é un video mp4, non se é mp3
-    if not video_path.lower().endswith('.mp3'):
-        try:
-            if progress_callback:
-                progress_callback("Normalizando vídeo...", 15)
-            video_path = normalize_video(video_path)
-        except Exception as erro_normalizacion:      
-            print(f"Error na normalización: {erro_normalizacion}, continuando co video orixinal")
-    
+    # a instrumental solo precisa o audio, que se extrae do orixinal: o video non se normaliza
     if progress_callback:
         progress_callback("Extraendo audio...", 25)
-    ruta_audio = video_to_mp3(video_path)
-    if not ruta_audio:
+    audio = run_stage(checkpoints, "extract_audio", lambda: _etapa_extraer_audio(video_path, checkpoints.directorio),
+                      ("ruta_audio",))
+    if not audio:
         return ""
     
     if progress_callback:
         progress_callback("Separando instrumental...", 50)
-    ruta_voz, ruta_musica = separate_stems_cli(ruta_audio)
-    if not ruta_musica:
+    stems = run_stage(checkpoints, "separate", lambda: _etapa_separar(audio["ruta_audio"], checkpoints.directorio),
+                      ("ruta_voz", "ruta_musica"))
+    if not stems:
         print("Error separando a instrumental ")
         return ""
+    ruta_musica = stems["ruta_musica"]
     
-    nome_video_base = os.path.basename(video_path).replace("_normalized", "")
-    nome_video_seguro = sanitize_filename(nome_video_base)
+    nome_video_seguro = sanitize_filename(os.path.basename(video_path))
     
     if nome_video_seguro.lower().endswith('.mp4'):
         nome_saida = f"instrumental_{nome_video_seguro.replace('.mp4', '.wav')}"
@@ -416,32 +646,20 @@ def generate_instrumental(video_path: str, source_type: str = "upload", source_u
         #fallback: añadir extension .wav
         nome_saida = f"instrumental_{nome_video_seguro}.wav"
     
-    if not os.path.exists("./output"):
-        os.makedirs("./output")
-    
-    ruta_saida = os.path.join("./output", nome_saida)
-    
-    try:
-        if progress_callback:
-            progress_callback("Copiando arquivo final...", 85)
-        import shutil
-        shutil.copy2(ruta_musica, ruta_saida)
-        
-        if os.path.exists(ruta_saida) and os.path.getsize(ruta_saida) > 0:
-            print(f"Instrumental xerada. {ruta_saida}")
-        else:
-            return ""
-            
-    except Exception as error_copia:
+    if progress_callback:
+        progress_callback("Copiando arquivo final...", 85)
+    copia = run_stage(checkpoints, "copy_instrumental", lambda: _etapa_copiar_instrumental(ruta_musica, nome_saida, checkpoints),
+                      ("ruta_saida",))
+    if not copia:
         return ""
+    ruta_saida = copia["ruta_saida"]
+    print(f"Cache de artefactos: {get_artifact_cache_stats()}")
     
     #gardar instrumental na base de datos se está activado
     if save_to_db:
         try:
-            from moviepy.editor import AudioFileClip
-            
             nome_original = os.path.basename(video_path)
-            title = nome_original.replace('_normalized', '')
+            title = nome_original
             if title.lower().endswith('.mp4'):
                 title = title[:-4]   # eliminar .mp4
             elif title.lower().endswith('.mp3'):
@@ -450,12 +668,7 @@ def generate_instrumental(video_path: str, source_type: str = "upload", source_u
             
             file_size = os.path.getsize(ruta_saida)
             
-            try:
-                audio_clip = AudioFileClip(ruta_saida)
-                duration = audio_clip.duration
-                audio_clip.close()
-            except:
-                duration = None
+            duration = get_media_duration(ruta_saida) or None
             
             song_data = {
                 'title': title,
@@ -479,4 +692,23 @@ def generate_instrumental(video_path: str, source_type: str = "upload", source_u
         except Exception as e:
             print(f"Erro gardando instrumental na bd: {e}")
     
+    checkpoints.discard()
     return nome_saida
+
+
+# Retoma un traballo que quedou a medias dende a ultima etapa completada (os mismos parametros do manifest).
+# Os reintentos das tarefas de celery xa o fan solos porque pasan o mismo job_id, esto é para retomalo a man
+def resume_job(job_id: str, progress_callback=None) -> str:
+    manifest = load_job_manifest(job_id)
+    if not manifest:
+        print(f"Non hai checkpoints do traballo {job_id}")
+        return ""
+    funcions = {
+        "automatic": create,
+        "manual_lyrics": create_with_manual_lyrics,
+        "instrumental": generate_instrumental,
+    }
+    if manifest.get("tipo") not in funcions:
+        print(f"Tipo de traballo descoñecido: {manifest.get('tipo')}")
+        return ""
+    return funcions[manifest["tipo"]](**manifest["parametros"], progress_callback=progress_callback, job_id=job_id)
@@ -1,14 +1,72 @@
+import os
 import numpy as np
+from bisect import bisect_right
+from dataclasses import dataclass
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
 from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import VideoClip
+from moviepy.editor import VideoClip, ImageClip
 from config import (
     TEXT_CLIP_WIDTH, FONTE, TAMAÑO_FONTE, TAMAÑO_FONTE_MIN, COR_TEXTO, COR_RESALTADO,
     GROSOR_CONTORNO_TEXTO, COR_CONTORNO_TEXTO, COR_FONDO_TEXTO, PADDING_FONDO_TEXTO,
     COR_LIÑA_SEGUINTE, ALPHA_LIÑA_SEGUINTE, FACTOR_FONTE_LIÑA_SEGUINTE, ESPACIADO_LIÑAS,
     MOSTRAR_LIÑA_SEGUINTE, MODO_SILABICO, BUFFER_ANTICIPACION, PESO_PROGRESO_TEMPORAL,
-    PESO_PROGRESO_SEGMENTO, UMBRAL_ACELERACION, FACTOR_ACELERACION_MAX
+    PESO_PROGRESO_SEGMENTO, UMBRAL_ACELERACION, FACTOR_ACELERACION_MAX, TAMAÑO_CACHE_FRAMES,
+    USAR_SPRITES_RESALTADO, ALTO_VIDEO, ANCHO_VIDEO, MARXE_INFERIOR_SUBTITULO, FPS_VIDEO
 )
-from text_processing import dic_pyphen
+from text_processing import syllabify_word
+
+
+# Contadores globais da cache de frames, para ver canto se aforra nun render enteiro
+ESTATISTICAS_CACHE_FRAMES = {"hits": 0, "misses": 0}
+
+
+def get_frame_cache_stats() -> dict:
+    hits = ESTATISTICAS_CACHE_FRAMES["hits"]
+    misses = ESTATISTICAS_CACHE_FRAMES["misses"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": (hits / total) if total else 0.0
+    }
+
+
+def reset_frame_cache_stats():
+    ESTATISTICAS_CACHE_FRAMES["hits"] = 0
+    ESTATISTICAS_CACHE_FRAMES["misses"] = 0
+
+
+# suma as estatisticas doutro proceso (render por tramos en paralelo)
+def add_frame_cache_stats(estatisticas: dict):
+    ESTATISTICAS_CACHE_FRAMES["hits"] += estatisticas.get("hits", 0)
+    ESTATISTICAS_CACHE_FRAMES["misses"] += estatisticas.get("misses", 0)
+
+
+# LRU pequena para os frames xa rasterizados dun clip. A clave é o numero de unidades resaltadas
+class CacheFrames:
+
+    def __init__(self, max_size: int = TAMAÑO_CACHE_FRAMES):
+        self.max_size = max_size
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clave, crear_frame):
+        if clave in self.frames:
+            self.frames.move_to_end(clave)
+            self.hits += 1
+            ESTATISTICAS_CACHE_FRAMES["hits"] += 1
+            return self.frames[clave]
+
+        self.misses += 1
+        ESTATISTICAS_CACHE_FRAMES["misses"] += 1
+        frame = crear_frame()
+        self.frames[clave] = frame
+        if len(self.frames) > self.max_size:
+            self.frames.popitem(last=False)
+        return frame
 
 
 # Función auxiliar para obter a cor dun speaker específico
@@ -23,290 +81,389 @@ def get_speaker_color(word_info: dict, is_highlighted: bool = False) -> str:
     else:
         return COR_TEXTO  #blanco
 
-# Renderiza a imaxe la linea principal de texto. VARIAS MELLORAS:
-#Silabeador implementado --> chequear mais abaixo a info
-#
-def render_line_image(line_info: dict, t_offset: float, clip_width: int = TEXT_CLIP_WIDTH, 
-                      font_path: str = FONTE, font_size: int = TAMAÑO_FONTE, 
-                      normal_color: str = COR_TEXTO, highlight_color: str = COR_RESALTADO) -> np.ndarray:
-
-
-    texto_completo = line_info["line_text"]
-    
-    #Aqui temos que usar fuentes fijas para as lineas pero o problema é que si a frase é moi larga(xa que a delimita o salto de linea),
-    #pois temos que reducir o tamaño nese caso (improbable, a maioria de casos son frases cortas)
-    tamaño_fonte_dinamico = font_size
-    if len(texto_completo) > 100:  
-        factor_reduccion = min(1.0, 100 / len(texto_completo))
-        tamaño_fonte_dinamico = max(TAMAÑO_FONTE_MIN, int(font_size * factor_reduccion))
-    
-    
+# Cargar a fonte con ImageFont.truetype custa bastante e antes faciase en cada frame. Gardase por (ruta, tamaño)
+@lru_cache(maxsize=32)
+def _cargar_fonte(font_path: str, tamaño: int):
     try:
-        fonte = ImageFont.truetype(font_path, tamaño_fonte_dinamico)
+        return ImageFont.truetype(font_path, tamaño)
     except Exception as e:
-        print(f"Non se puido cargar a fonte {e}")        
-        fonte = ImageFont.load_default()
-    
-    #axustes visuales varios:
+        print(f"Non se puido cargar a fonte {e}")
+        return ImageFont.load_default()
+
+
+def _ancho_texto(fonte, texto: str) -> float:
+    return fonte.getlength(texto) if hasattr(fonte, 'getlength') else fonte.getsize(texto)[0]
+
+
+#axustes visuales varios: wrap das palabras para que non se saian do ancho do clip
+def _axustar_liñas(texto_completo: str, fonte, ancho_maximo: float) -> list:
+
     lineasAjustadas = []
-    palabras = texto_completo.split()
     lineaActual = ""
-    
-    ancho_maximo = clip_width - 2 * PADDING_FONDO_TEXTO    
-    for palabra in palabras:
+
+    for palabra in texto_completo.split():
         if not lineaActual:
             lineaActual = palabra
             continue
-            
+
         liñaPrueba = lineaActual + " " + palabra
-        ancho_texto = fonte.getlength(liñaPrueba) if hasattr(fonte, 'getlength') else fonte.getsize(liñaPrueba)[0]
-        
-        if ancho_texto <= ancho_maximo:
+        if _ancho_texto(fonte, liñaPrueba) <= ancho_maximo:
             lineaActual = liñaPrueba
         else:
             lineasAjustadas.append(lineaActual)
             lineaActual = palabra
-    
+
     if lineaActual:
         lineasAjustadas.append(lineaActual)
-    
+
     if not lineasAjustadas:
         lineasAjustadas = [texto_completo]
-    
+
+    return lineasAjustadas
+
+
+# Mapear palabras visuales con palabras de datos para obter speaker info
+def _word_info_para(line_info: dict, palabra_index: int) -> dict:
+
+    palabras_datos = line_info.get("words") or []
+    word_info = {}
+
+    if palabra_index < len(palabras_datos):
+        word_info = palabras_datos[palabra_index]
+
+    if not word_info.get("speaker") and palabras_datos:
+        # Buscar nun rango máis amplo
+        for offset in [-2, -1, 1, 2]:
+            test_index = palabra_index + offset
+            if 0 <= test_index < len(palabras_datos):
+                test_word = palabras_datos[test_index]
+                if test_word.get("speaker"):
+                    word_info = test_word
+                    break
+
+    return word_info
+
+
+# Unha unidade de resaltado: sílaba (modo silábico) ou palabra enteira, xa posicionada
+@dataclass(frozen=True)
+class UnidadeTexto:
+    texto: str
+    x: float
+    y: int
+    ancho: float
+    liña_visual: int
+    indice_palabra: int
+    speaker: Optional[str]
+    cor_resaltado: str
+
+
+# Layout precalculado dunha liña. Todo esto antes recalculabase en cada frame (fonte, wrap, silabas, posicions)
+# e o resultado nunca cambia, solo cambia cantas unidades van resaltadas
+@dataclass(frozen=True)
+class LayoutLiña:
+    fonte: object
+    tamaño_fonte: int
+    liñas: Tuple[str, ...]
+    altura_liña: int
+    ancho: int
+    altura: int
+    x_fondo: int
+    ancho_fondo: int
+    modo_silabico: bool
+    unidades: Tuple[UnidadeTexto, ...]
+
+
+def build_line_layout(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
+                      font_path: str = FONTE, font_size: int = TAMAÑO_FONTE) -> LayoutLiña:
+
+    texto_completo = line_info["line_text"]
+
+    #Aqui temos que usar fuentes fijas para as lineas pero o problema é que si a frase é moi larga(xa que a delimita o salto de linea),
+    #pois temos que reducir o tamaño nese caso (improbable, a maioria de casos son frases cortas)
+    tamaño_fonte_dinamico = font_size
+    if len(texto_completo) > 100:
+        factor_reduccion = min(1.0, 100 / len(texto_completo))
+        tamaño_fonte_dinamico = max(TAMAÑO_FONTE_MIN, int(font_size * factor_reduccion))
+
+    fonte = _cargar_fonte(font_path, tamaño_fonte_dinamico)
+
+    ancho_maximo = clip_width - 2 * PADDING_FONDO_TEXTO
+    lineasAjustadas = _axustar_liñas(texto_completo, fonte, ancho_maximo)
+
     altura_liña = int(tamaño_fonte_dinamico * 1.4)  #puxen un espaciado de linea un 40% mais alto ca o tamaño da fonte
 
     #aqui temos q calcular a altura total para todas as lineas visuales e asegurar unha altura minima (para as lineas cortas tamen. REVISAR)
     altura_minima = tamaño_fonte_dinamico + 2 * PADDING_FONDO_TEXTO
-    altura_total = max(altura_minima, len(lineasAjustadas) * altura_liña + 2 * PADDING_FONDO_TEXTO)  
-
+    altura_total = max(altura_minima, len(lineasAjustadas) * altura_liña + 2 * PADDING_FONDO_TEXTO)
 
-    #tuven que poñer esto para asegurar a consistencia no posicionamento.
-    imaxe = Image.new("RGBA", (clip_width, altura_total), (0, 0, 0, 0))
-    debuxar = ImageDraw.Draw(imaxe)
-    
-    capa_fondo = Image.new("RGBA", (clip_width, altura_total), (0, 0, 0, 0)) #fondo +- transparente
-    debuxar_fondo = ImageDraw.Draw(capa_fondo)
-    
-    
     ancho_maximo_liña = 0
     for liña in lineasAjustadas:
-        ancho_liña = fonte.getlength(liña) if hasattr(fonte, 'getlength') else fonte.getsize(liña)[0]  #serviume esto para o problema do ancho. REVISAR A REFERENCIA EN INTERNET PARA AÑADILA NA MEMORIA!!!
-        ancho_maximo_liña = max(ancho_maximo_liña, ancho_liña)     
-    
+        ancho_maximo_liña = max(ancho_maximo_liña, _ancho_texto(fonte, liña))   #serviume esto para o problema do ancho
 
     #Fondo trnsparente con bordes redondeados
     ancho_minimo = int(clip_width * 0.4)  #colle polo menos un 40% do ancho disponible do clip
     ancho_fondo = max(ancho_minimo, min(ancho_maximo_liña + 2 * PADDING_FONDO_TEXTO, clip_width))
     x_fondo = (clip_width - ancho_fondo) // 2
-    
+
+    # no modo silabico cada palabra partese coas silabas do pyphen, se non cada palabra é unha unidade
+    modo_silabico = bool(MODO_SILABICO and line_info.get("words"))
+    ancho_espacio = _ancho_texto(fonte, " ")
+
+    # a taboa de silabas ven precalculada co grupo (attach_syllable_tables). Se non está ou non cadra co texto calculase aqui
+    taboa_silabas = line_info.get("syllables")
+    if taboa_silabas is None or len(taboa_silabas) != len(texto_completo.split()):
+        taboa_silabas = None
+
+    unidades = []
+    palabra_index = 0
+    for i, liña in enumerate(lineasAjustadas):
+        y = i * altura_liña + PADDING_FONDO_TEXTO
+        x = (clip_width - _ancho_texto(fonte, liña)) // 2     #centrado da linea
+
+        palabras_liña = liña.split()
+        for idx_palabra, palabra in enumerate(palabras_liña):
+            word_info = _word_info_para(line_info, palabra_index)
+            cor_resaltado = get_speaker_color(word_info, True)
+
+            if modo_silabico and taboa_silabas is not None:
+                silabas_palabra = taboa_silabas[palabra_index]
+            elif modo_silabico:
+                silabas_palabra = syllabify_word(palabra, line_info.get("language"))
+            else:
+                silabas_palabra = [palabra]
+
+            for sil in silabas_palabra:
+                ancho_sil = _ancho_texto(fonte, sil)
+                unidades.append(UnidadeTexto(sil, x, y, ancho_sil, i, palabra_index,
+                                             word_info.get("speaker"), cor_resaltado))
+                x += ancho_sil
+
+            # IMPORTANTE: Añadir espacio pois de cada palabra (menos a ultima da linea no modo silabico) REVISAR ESTO
+            if not modo_silabico or idx_palabra < len(palabras_liña) - 1:
+                x += ancho_espacio
+
+            palabra_index += 1
+
+    return LayoutLiña(
+        fonte=fonte,
+        tamaño_fonte=tamaño_fonte_dinamico,
+        liñas=tuple(lineasAjustadas),
+        altura_liña=altura_liña,
+        ancho=clip_width,
+        altura=altura_total,
+        x_fondo=x_fondo,
+        ancho_fondo=ancho_fondo,
+        modo_silabico=modo_silabico,
+        unidades=tuple(unidades)
+    )
+
+
+# Vale, IMPORTANTE, arreglei o silabeador, xa non fai cousas raras cos caracteres especiales. Esta documentado nas notas
+#COMO FUNCIONA? --> primeiro calculo o progreso temporal basandome nos segmentos de audio (usase tanto o nº de segmentos como o progreso dentro do segmento actual)
+# Promediamos o progreso temporal e o progreso de segmentos. Crease a estructura de silabas do texto orixinal
+# e faise un calculo de cantas silabas resaltar en base ao progreso combinado
+# Antes faciase cun bucle por palabras en cada frame. Agora calculase para un array de instantes dunha vez con numpy
+# (matriz instantes x palabras), coa mesma semantica de PESO_PROGRESO_*, BUFFER_ANTICIPACION e UMBRAL_ACELERACION
+def compute_highlight_counts(line_info: dict, layout: LayoutLiña, t_offsets) -> np.ndarray:
+
+    t_offsets = np.asarray(t_offsets, dtype=np.float64)
+    palabras = line_info.get("words") or []
+
+    if layout.modo_silabico:
+
+        total_silabas = len(layout.unidades)
+        duracion_total_liña = line_info["end"] - line_info["start"]
+
+        if duracion_total_liña <= 0:
+            return np.zeros(len(t_offsets), dtype=np.int64)
+
+        tempoActual = (line_info["start"] + t_offsets)[:, None]
+        progreso_temporal = np.minimum(1.0, np.maximum(0.0, t_offsets / duracion_total_liña))
+
+        inicios = np.array([seg["start"] for seg in palabras], dtype=np.float64)
+        fins_efectivos = np.array([seg["end"] for seg in palabras], dtype=np.float64)
+        # Buffer para anticipar a última sílaba (para que a ultima palabra se resalte tamen)
+        fins_efectivos[-1] = max(palabras[-1]["start"] + 0.1, palabras[-1]["end"] - BUFFER_ANTICIPACION)
+
+        pasados = tempoActual >= fins_efectivos[None, :]
+        dentro = ~pasados & (tempoActual >= inicios[None, :])
+
+        # o segmento actual é o primeiro no que estamos dentro, os pasados solo contan ata el (igual que o break do bucle)
+        hai_actual = dentro.any(axis=1)
+        actual = np.where(hai_actual, dentro.argmax(axis=1), len(palabras))
+        antes_do_actual = np.arange(len(palabras))[None, :] < actual[:, None]
+        segmentos_pasados = (pasados & antes_do_actual).sum(axis=1)
+
+        bonus_progreso_segmento = np.zeros(len(t_offsets))
+        if hai_actual.any():
+            filas = np.flatnonzero(hai_actual)
+            indices_actual = actual[filas]
+            duracion_seg = fins_efectivos[indices_actual] - inicios[indices_actual]
+            con_duracion = duracion_seg > 0
+            filas = filas[con_duracion]
+            indices_actual = indices_actual[con_duracion]
+            progreso_seg = (tempoActual[filas, 0] - inicios[indices_actual]) / duracion_seg[con_duracion]
+            progreso_seg = np.minimum(1.0, progreso_seg * 1.2)  # Acelerar lixeiramente o final
+            bonus_progreso_segmento[filas] = progreso_seg / len(palabras)
+
+        progreso_segmento = segmentos_pasados / len(palabras)
+        progreso_final = np.minimum(1.0, progreso_segmento + bonus_progreso_segmento)
+
+        #axustar pesos para dar mais importancia ao progreso por segmentos
+        progreso_combinado = (progreso_temporal * PESO_PROGRESO_TEMPORAL) + (progreso_final * PESO_PROGRESO_SEGMENTO)
+
+        # Usar redondeo en lugar de truncameento para mellor precisión (np.round redondea a par igual que round)
+        silabas_para_resaltar = np.minimum(total_silabas, np.round(progreso_combinado * total_silabas).astype(np.int64))
+
+        acelerar = progreso_combinado > UMBRAL_ACELERACION
+        if acelerar.any():
+            factor_progreso = (progreso_combinado[acelerar] - UMBRAL_ACELERACION) / (1.0 - UMBRAL_ACELERACION)
+            factor_aceleracion = 1 + factor_progreso * (FACTOR_ACELERACION_MAX - 1)
+            acelerado = (progreso_combinado[acelerar] * total_silabas * factor_aceleracion).astype(np.int64)
+            silabas_para_resaltar[acelerar] = np.minimum(total_silabas, acelerado)
+
+        return silabas_para_resaltar
+
+    #original antes do silabeador: Esto seria para o modo de resaltado palabra por palabra por si acaso, q é como fai whisperx, fai un srt a nivel de palabra, non de silaba nin frase (visualmente incomodo para o resaltado)
+    # para sincronizar usanse os tempos dos segmentos de palabras
+    if palabras:
+        tempos_relativos = np.array([seg["start"] - line_info["start"] for seg in palabras], dtype=np.float64)
+        empezadas = t_offsets[:, None] >= tempos_relativos[None, :]
+        # a ultima palabra xa empezada + 1 (non o numero de empezadas, igual que o bucle orixinal)
+        ultima = len(palabras) - 1 - empezadas[:, ::-1].argmax(axis=1)
+        return np.where(empezadas.any(axis=1), ultima + 1, 0).astype(np.int64)
+
+    #outro fallback q avanza proporcional ao tempo
+    ratio_progreso = np.minimum(1.0, np.maximum(0.0, t_offsets / (line_info["end"] - line_info["start"])))
+    return (ratio_progreso * len(line_info["line_text"].split())).astype(np.int64)
+
+
+def count_highlighted_units(line_info: dict, layout: LayoutLiña, t_offset: float) -> int:
+    return int(compute_highlight_counts(line_info, layout, [t_offset])[0])
+
+
+# Programa completo de resaltado: para cada frame do video (a fps dados) que cae dentro do clip, cantas unidades
+# van resaltadas. inicio_clip é onde empeza o clip no video, asi os frames son os da grella global (k / fps) e
+# o tempo dentro do clip é k / fps - inicio_clip, igual que o calcula moviepy. O clip empeza advance segundos
+# antes da liña, asi que o tempo efectivo é max(t - advance, 0).
+# Devolve (primeiro frame global, array de unidades resaltadas por frame)
+def build_highlight_schedule(line_info: dict, layout: LayoutLiña, fps: float, duracion_clip: float,
+                             advance: float = 0.5, inicio_clip: float = 0.0) -> tuple:
+
+    primeiro_frame = int(np.ceil(inicio_clip * fps - 1e-9))
+    ultimo_frame = int(np.floor((inicio_clip + duracion_clip) * fps + 1e-9))
+    tempos = np.arange(primeiro_frame, ultimo_frame + 1) / fps - inicio_clip
+    return primeiro_frame, compute_highlight_counts(line_info, layout, np.maximum(tempos - advance, 0))
+
+
+# Frames nos que cambia o resaltado (o primeiro sempre conta). Entre dous puntos de cambio o frame é identico
+def highlight_change_points(schedule: np.ndarray) -> np.ndarray:
+    if len(schedule) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(np.diff(schedule)) + 1))
+
+
+# Debuxa o layout coas primeiras n_resaltadas unidades resaltadas. Devolve RGBA para poder usar a alpha como mascara
+def draw_line_layout_rgba(layout: LayoutLiña, n_resaltadas: int) -> np.ndarray:
+
+    #tuven que poñer esto para asegurar a consistencia no posicionamento.
+    imaxe = Image.new("RGBA", (layout.ancho, layout.altura), (0, 0, 0, 0))
+    debuxar = ImageDraw.Draw(imaxe)
+
+    capa_fondo = Image.new("RGBA", (layout.ancho, layout.altura), (0, 0, 0, 0)) #fondo +- transparente
+    debuxar_fondo = ImageDraw.Draw(capa_fondo)
 
     #o fondo vai ser un rectangulo. Verifico ahi si a version do PIL soporta a funcion de rounded_rectangle porque me daba problemas
     if hasattr(debuxar_fondo, 'rounded_rectangle'):
         debuxar_fondo.rounded_rectangle(
-            [(x_fondo, 0), (x_fondo + ancho_fondo, altura_total)],
+            [(layout.x_fondo, 0), (layout.x_fondo + layout.ancho_fondo, layout.altura)],
             radius=10,  # Radio de las esquinas redondeadas
             fill=COR_FONDO_TEXTO
         )
     else:
-        
         #polo problema ese fago un fallback para versions antiguas de PIL
         debuxar_fondo.rectangle(
-            [(x_fondo, 0), (x_fondo + ancho_fondo, altura_total)],
+            [(layout.x_fondo, 0), (layout.x_fondo + layout.ancho_fondo, layout.altura)],
             fill=COR_FONDO_TEXTO
-        )    
+        )
 
-    # Vale, IMPORTANTE, arreglei o silabeador, xa non fai cousas raras cos caracteres especiales. Esta documentado nas notas
-    #COMO FUNCIONA? --> primeiro calculo o progreso temporal basandome nos segmentos de audio (usase tanto o nº de segmentos como o progreso dentro do segmento actual)
-    # Promediamos o progreso temporal e o progreso de segmentos. Crease a estructura de silabas do texto orixinal
-    # e faise un calculo de cantas silabas resaltar en base ao progreso combinado e renderizase línea por línea e sílaba por sílaba
+    for indice, unidade in enumerate(layout.unidades):
+        cor = unidade.cor_resaltado if indice < n_resaltadas else COR_TEXTO
+        debuxar.text((unidade.x, unidade.y), unidade.texto, font=layout.fonte, fill=cor,
+                     stroke_width=GROSOR_CONTORNO_TEXTO, stroke_fill=COR_CONTORNO_TEXTO)
 
-    if MODO_SILABICO and line_info.get("words"):
+    imaxe = Image.alpha_composite(capa_fondo, imaxe)
 
-        tempoActual = line_info["start"] + t_offset
-        tempoActual = line_info["start"] + t_offset
-        duracion_total_liña = line_info["end"] - line_info["start"]
-        
-        if duracion_total_liña > 0:
-            progreso_temporal = min(1.0, max(0.0, t_offset / duracion_total_liña))
-            
-            segmentos_pasados = 0
-            bonus_progreso_segmento = 0.0
-            
-            # Buffer para anticipar a última sílaba (para que a ultima palabra se resalte tamen)
-            buffer_anticipacion = BUFFER_ANTICIPACION
-            
-            for i, seg in enumerate(line_info["words"]):
-                
-                tiempo_fin_efectivo = seg["end"]
-                if i == len(line_info["words"]) - 1:  
-                    tiempo_fin_efectivo = max(seg["start"] + 0.1, seg["end"] - buffer_anticipacion)
-                
-                if tempoActual >= tiempo_fin_efectivo:
-                    segmentos_pasados += 1
-                elif tempoActual >= seg["start"]:
-                    # Estamos dentro deste segmento
-                    duracion_seg = tiempo_fin_efectivo - seg["start"]
-                    if duracion_seg > 0:
-                        progreso_seg = (tempoActual - seg["start"]) / duracion_seg
-                        # Aplicar curva suave para o progreso
-                        progreso_seg = min(1.0, progreso_seg * 1.2)  # Acelerar lixeiramente o final
-                        bonus_progreso_segmento = progreso_seg / len(line_info["words"])
-                    break
-            
-            progreso_segmento = (segmentos_pasados / len(line_info["words"])) if line_info["words"] else 0.0
-            progreso_final = min(1.0, progreso_segmento + bonus_progreso_segmento)
-            
-            #axustar pesos para dar mais importancia ao progreso por segmentos
-            progreso_combinado = (progreso_temporal * PESO_PROGRESO_TEMPORAL) + (progreso_final * PESO_PROGRESO_SEGMENTO) 
-        else:
-            progreso_combinado = 0.0
-        
-        info_todas_silabas = []  # Lista de [silaba, es_final_de_palabra]
-        
-        for palabra in texto_completo.split():
+    return np.array(imaxe)
 
-            silabas_palabra = dic_pyphen.inserted(palabra).split('-')
-            
-            if len(silabas_palabra) <= 1:   # Palabra non divisible
-                
-                info_todas_silabas.append((palabra, True))
+
+# O mesmo pero so RGB (igual que facia convert("RGB"), que descarta a alpha)
+def draw_line_layout(layout: LayoutLiña, n_resaltadas: int) -> np.ndarray:
+    return np.ascontiguousarray(draw_line_layout_rgba(layout, n_resaltadas)[..., :3])
+
+
+# Motor de sprites para o resaltado. Debuxar texto con contorno (stroke_width) silaba por silaba é o mais caro
+# de todo o render, asi que a liña rasterizase solo dúas veces: toda en COR_TEXTO e toda resaltada (coa cor
+# do speaker de cada palabra). Como o resaltado sempre é un prefixo das unidades, un frame son dúas copias de arrays:
+# as filas visuales anteriores enteiras e a fila actual ata o final da ultima unidade resaltada
+class MotorSpritesLiña:
+
+    def __init__(self, layout: LayoutLiña):
+        self.layout = layout
+        raster_normal = draw_line_layout_rgba(layout, 0)
+        self.raster_normal = np.ascontiguousarray(raster_normal[..., :3])
+        self.raster_resaltado = draw_line_layout(layout, len(layout.unidades))
+        self.alpha = np.ascontiguousarray(raster_normal[..., 3])   #a forma do texto non cambia co resaltado, solo a cor
+
+        # limites verticais de cada fila visual. Empezan un pouco antes da posicion y polo contorno do texto
+        self.inicio_filas = []
+        for i in range(len(layout.liñas)):
+            if i == 0:
+                self.inicio_filas.append(0)
             else:
-                # si que é divisible
-                for i, sil in enumerate(silabas_palabra):
-                    e_ultima_silaba = (i == len(silabas_palabra) - 1)
-                    info_todas_silabas.append((sil, e_ultima_silaba))
-        
-        # Calculalse cantas silabas resaltar dependendo do progreso
-        total_silabas = len(info_todas_silabas)
-        # Usar redondeo en lugar de truncameento para mellor precisión
-        silabas_para_resaltar = min(total_silabas, round(progreso_combinado * total_silabas))
-        
-        
-        if progreso_combinado > UMBRAL_ACELERACION:
-            factor_progreso = (progreso_combinado - UMBRAL_ACELERACION) / (1.0 - UMBRAL_ACELERACION)
-            factor_aceleracion = 1 + factor_progreso * (FACTOR_ACELERACION_MAX - 1)
-            silabas_para_resaltar = min(total_silabas, int(progreso_combinado * total_silabas * factor_aceleracion))
-        
-        
-        indice_silaba = 0
-        
-        for i, liña in enumerate(lineasAjustadas):
-            y = i * altura_liña + PADDING_FONDO_TEXTO
-            
-            ancho_liña = fonte.getlength(liña) if hasattr(fonte, 'getlength') else fonte.getsize(liña)[0]    #fajo un cálculo do ancho total da linea para o tema de que este centrada
-            x = (clip_width - ancho_liña) // 2
-            
-            palabras_liña = liña.split()
-            
-            # Mapear palabras visuales con palabras de datos para obter speaker info
-            total_palabras_visuales = sum(len(línea.split()) for línea in lineasAjustadas[:i])
-            
-            for idx_palabra, palabra in enumerate(palabras_liña):
-                word_info = {}
-                palabra_index = total_palabras_visuales + idx_palabra
-                
-                if line_info.get("words") and palabra_index < len(line_info["words"]):
-                    word_info = line_info["words"][palabra_index]
-                
-                if not word_info.get("speaker") and line_info.get("words"):
-                    # Buscar nun rango máis amplo
-                    for offset in [-2, -1, 1, 2]:
-                        test_index = palabra_index + offset
-                        if 0 <= test_index < len(line_info["words"]):
-                            test_word = line_info["words"][test_index]
-                            if test_word.get("speaker"):
-                                word_info = test_word
-                                break
-                
-                silabas_palabra = dic_pyphen.inserted(palabra).split('-')
-                
-                if len(silabas_palabra) <= 1:
-                    # se a palabra é non divisible -> renderizar completa
-                    cor = get_speaker_color(word_info, indice_silaba < silabas_para_resaltar)
-                    debuxar.text((x, y), palabra, font=fonte, fill=cor,
-                             stroke_width=GROSOR_CONTORNO_TEXTO, stroke_fill=COR_CONTORNO_TEXTO)
-                    ancho_palabra = fonte.getlength(palabra) if hasattr(fonte, 'getlength') else fonte.getsize(palabra)[0]
-                    x += ancho_palabra
-                    indice_silaba += 1
-                else:
-                    # se é divisible -> renderizase silaba por silaba
-                    for idx_sil, sil in enumerate(silabas_palabra):
-                        cor = get_speaker_color(word_info, indice_silaba < silabas_para_resaltar)
-                        debuxar.text((x, y), sil, font=fonte, fill=cor,
-                                 stroke_width=GROSOR_CONTORNO_TEXTO, stroke_fill=COR_CONTORNO_TEXTO)
-                        ancho_sil = fonte.getlength(sil) if hasattr(fonte, 'getlength') else fonte.getsize(sil)[0]
-                        x += ancho_sil
-                        indice_silaba += 1
-                
-                # IMPORTANTE: Añadir espacio pois de cada palabra (menos a ultima da linea) REVISAR ESTO -> contraproducente? Non se ve demasiado smooth
-                if idx_palabra < len(palabras_liña) - 1:
-                    ancho_espacio = fonte.getlength(" ") if hasattr(fonte, 'getlength') else fonte.getsize(" ")[0]
-                    x += ancho_espacio    
-    else:
-        #original antes do silabeador: Esto seria para o modo de resaltado palabra por palabra por si acaso, q é como fai whisperx, fai un srt a nivel de palabra, non de silaba nin frase (visualmente incomodo para o resaltado)
-        palabras = texto_completo.split()
-        palabras_para_resaltar = 0
-        
-        # para sincronizar usanse os tempos dos segmentos de palabras
-        if line_info.get("words"):
-            for i, seg in enumerate(line_info["words"]):
-                tempo_relativo_palabra = seg["start"] - line_info["start"]
-                if t_offset >= tempo_relativo_palabra:
-                    palabras_para_resaltar = i + 1
-        else:
-            #outro fallback q avanza proporcional ao tempo
-            ratio_progreso = min(1.0, max(0.0, t_offset / (line_info["end"] - line_info["start"])))
-            palabras_para_resaltar = int(ratio_progreso * len(palabras))
-        
-        #Vanse dibujando as lineas e as palabras
-        palabras_asignadas = 0
-        for i, liña in enumerate(lineasAjustadas):
-            palabras_liña = liña.split()
-            y = i * altura_liña + PADDING_FONDO_TEXTO
-            
-            ancho_liña = fonte.getlength(liña) if hasattr(fonte, 'getlength') else fonte.getsize(liña)[0]   
-            x = (clip_width - ancho_liña) // 2
-            
-            # Calcular offset de palabras para esta línea
-            total_palabras_visuales = sum(len(línea.split()) for línea in lineasAjustadas[:i])
-            
-            for idx_palabra, palabra in enumerate(palabras_liña):
-                word_info = {}
-                palabra_index = total_palabras_visuales + idx_palabra
-                
-                if line_info.get("words") and palabra_index < len(line_info["words"]):
-                    word_info = line_info["words"][palabra_index]
-                
-                if not word_info.get("speaker") and line_info.get("words"):
-                    for offset in [-2, -1, 1, 2]:
-                        test_index = palabra_index + offset
-                        if 0 <= test_index < len(line_info["words"]):
-                            test_word = line_info["words"][test_index]
-                            if test_word.get("speaker"):
-                                word_info = test_word
-                                break
-                
-                cor = get_speaker_color(word_info, palabras_asignadas < palabras_para_resaltar)
-                
-                debuxar.text((x, y), palabra, font=fonte, fill=cor,
-                         stroke_width=GROSOR_CONTORNO_TEXTO, stroke_fill=COR_CONTORNO_TEXTO)
-                
-                #Avanzase a posivion x para a siguiente palabra
-                ancho_palabra = fonte.getlength(palabra) if hasattr(fonte, 'getlength') else fonte.getsize(palabra)[0]
-                x += ancho_palabra + (fonte.getlength(" ") if hasattr(fonte, 'getlength') else fonte.getsize(" ")[0])
-                
-                palabras_asignadas += 1
-    
-    imaxe = Image.alpha_composite(capa_fondo, imaxe)
-    
-    frame = np.array(imaxe.convert("RGB"))
-    return frame
+                self.inicio_filas.append(max(0, i * layout.altura_liña + PADDING_FONDO_TEXTO - GROSOR_CONTORNO_TEXTO))
+        self.inicio_filas.append(layout.altura)
+
+        # columna onde remata cada unidade (o corte entre resaltado e normal)
+        self.cortes_x = [min(layout.ancho, int(np.ceil(u.x + u.ancho))) for u in layout.unidades]
+
+    def frame(self, n_resaltadas: int) -> np.ndarray:
+
+        if n_resaltadas <= 0:
+            return self.raster_normal.copy()
+        if n_resaltadas >= len(self.layout.unidades):
+            return self.raster_resaltado.copy()
+
+        ultima = self.layout.unidades[n_resaltadas - 1]
+        y_inicio = self.inicio_filas[ultima.liña_visual]
+        y_fin = self.inicio_filas[ultima.liña_visual + 1]
+        x_corte = self.cortes_x[n_resaltadas - 1]
+
+        frame = self.raster_normal.copy()
+        frame[:y_inicio] = self.raster_resaltado[:y_inicio]
+        frame[y_inicio:y_fin, :x_corte] = self.raster_resaltado[y_inicio:y_fin, :x_corte]
+        return frame
+
+
+# Renderiza a imaxe la linea principal de texto. VARIAS MELLORAS:
+#Silabeador implementado --> chequear count_highlighted_units
+#Se se lle pasa o layout xa calculado (build_line_layout) solo se decide o resaltado e se debuxa
+def render_line_image(line_info: dict, t_offset: float, clip_width: int = TEXT_CLIP_WIDTH, 
+                      font_path: str = FONTE, font_size: int = TAMAÑO_FONTE, 
+                      normal_color: str = COR_TEXTO, highlight_color: str = COR_RESALTADO,
+                      layout: LayoutLiña = None) -> np.ndarray:
+
+    if layout is None:
+        layout = build_line_layout(line_info, clip_width, font_path, font_size)
+
+    n_resaltadas = count_highlighted_units(line_info, layout, t_offset)
+    return draw_line_layout(layout, n_resaltadas)
 
 
 #Funcion de dibujado da linea siguiente (ALTERNATIVA seria que aparecesa a linea actual un pouco antes de que empece o cantante)
 # feito para que se vexa un pouco mais transparente e mais pequena
-def render_next_line_image(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
-                        font_path: str = FONTE, font_size: int = None) -> np.ndarray:
+def render_next_line_rgba(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
+                          font_path: str = FONTE, font_size: int = None) -> np.ndarray:
 
     if font_size is None:
 
@@ -318,39 +475,12 @@ def render_next_line_image(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
     tamaño_fonte_dinamico = font_size
     if len(texto_completo) > 100:
         factor_reduccion = min(1.0, 100 / len(texto_completo))
-        tamaño_fonte_dinamico = max(TAMAÑO_FONTE_MIN * FACTOR_FONTE_LIÑA_SEGUINTE, int(font_size * factor_reduccion))
+        tamaño_fonte_dinamico = int(max(TAMAÑO_FONTE_MIN * FACTOR_FONTE_LIÑA_SEGUINTE, int(font_size * factor_reduccion)))   #int, PIL non acepta tamaños float
     
-    try:
-        fonte = ImageFont.truetype(font_path, tamaño_fonte_dinamico)
-    except Exception as e:
-        print(f"fallo cargando a fonte {e}")
-        fonte = ImageFont.load_default()
-    
-    lineasAjustadas = []
-    palabras = texto_completo.split()
-    lineaActual = ""
+    fonte = _cargar_fonte(font_path, tamaño_fonte_dinamico)
     
     ancho_maximo = clip_width - 2 * PADDING_FONDO_TEXTO
-    
-    for palabra in palabras:
-        if not lineaActual:
-            lineaActual = palabra
-            continue
-            
-        liñaPrueba = lineaActual + " " + palabra
-        ancho_texto = fonte.getlength(liñaPrueba) if hasattr(fonte, 'getlength') else fonte.getsize(liñaPrueba)[0]
-        
-        if ancho_texto <= ancho_maximo:
-            lineaActual = liñaPrueba
-        else:
-            lineasAjustadas.append(lineaActual)
-            lineaActual = palabra
-    
-    if lineaActual:
-        lineasAjustadas.append(lineaActual)
-    
-    if not lineasAjustadas:
-        lineasAjustadas = [texto_completo]
+    lineasAjustadas = _axustar_liñas(texto_completo, fonte, ancho_maximo)
     
     altura_liña = tamaño_fonte_dinamico + 10
     altura_total = len(lineasAjustadas) * altura_liña + 2 * PADDING_FONDO_TEXTO    
@@ -361,8 +491,7 @@ def render_next_line_image(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
     
     ancho_maximo_liña = 0
     for liña in lineasAjustadas:
-        ancho_liña = fonte.getlength(liña) if hasattr(fonte, 'getlength') else fonte.getsize(liña)[0]
-        ancho_maximo_liña = max(ancho_maximo_liña, ancho_liña)
+        ancho_maximo_liña = max(ancho_maximo_liña, _ancho_texto(fonte, liña))
     
     colorDeFondoDaSiguienteLinea = (COR_FONDO_TEXTO[0], COR_FONDO_TEXTO[1], COR_FONDO_TEXTO[2], 
                          int(COR_FONDO_TEXTO[3] * ALPHA_LIÑA_SEGUINTE))
@@ -376,63 +505,340 @@ def render_next_line_image(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
     for i, liña in enumerate(lineasAjustadas):
         y = i * altura_liña + PADDING_FONDO_TEXTO
         
-        ancho_liña = fonte.getlength(liña) if hasattr(fonte, 'getlength') else fonte.getsize(liña)[0]
-        x = (clip_width - ancho_liña) // 2
+        x = (clip_width - _ancho_texto(fonte, liña)) // 2
         
         debuxar.text((x, y), liña, font=fonte, fill=COR_LIÑA_SEGUINTE,
                  stroke_width=int(GROSOR_CONTORNO_TEXTO * 0.75), stroke_fill=COR_CONTORNO_TEXTO)
     
     imaxe = Image.alpha_composite(capa_fondo, imaxe)
     
-    frame = np.array(imaxe.convert("RGB"))
-    return frame
+    return np.array(imaxe)
+
+
+def render_next_line_image(line_info: dict, clip_width: int = TEXT_CLIP_WIDTH,
+                        font_path: str = FONTE, font_size: int = None) -> np.ndarray:
+    return np.ascontiguousarray(render_next_line_rgba(line_info, clip_width, font_path, font_size)[..., :3])
 
 
-# Función para crear o clip de video para a linea de karaoke. Como funciona?
+# Renderizador dunha linea de karaoke (con ou sen a linea seguinte). Como funciona?
 # iniciase advance segundos antes do tempo real (non negativo) e dura hasta (line_info["end"] - line_info["start"] + advance + duration_padding)
 # ten o wrap automatico polo tema dos textos largos
 # renderizase a imagen da línea con t - display_offset (se xa é positivo)
 # Se a configuración permite mostrar a línea siguiente e temos a información, combinamos os dous frames e crease un frame combinado con espacio abondo entre lineas. 
 # Centro horizontalmente as duas imagenes, copio la linea actual na parte de arriba e a linea siguiente ponse na parte de abaixo
 # CHEQUEAR A REF EN INTERNET, esta explicado mais ou menos
-def create_karaoke_text_clip(line_info: dict, next_line_info: dict = None, advance: float=0.5, duration_padding: float=0.5):
+class RenderizadorLiña:
 
-    duracion_liña = line_info["end"] - line_info["start"]
-    duracion_clip = duracion_liña + advance + duration_padding
-    offset_visualizacion = advance  # esto é o retraso interno do clip
+    def __init__(self, line_info: dict, next_line_info: dict = None, advance: float = 0.5,
+                 premultiplicado: bool = False, duration_padding: float = 0.5, fps: float = FPS_VIDEO,
+                 inicio_clip: float = 0.0):
+        self.line_info = line_info
+        self.offset_visualizacion = advance  # esto é o retraso interno do clip
+        self.premultiplicado = premultiplicado
+        self.fps = fps
+        self.inicio_clip = inicio_clip
+        self.layout = build_line_layout(line_info)   #calculase unha vez por clip, non por frame
 
-    def facer_frame(t):
-        # t es el tiempo transcurrido en el clip
-        
-        t_efectivo = max(t - offset_visualizacion, 0) #t seria o tempo transcurrido no clip
-        
-        frameActual = render_line_image(line_info, t_efectivo)
-        
-        
+        # programa de resaltado para todos os frames do clip, o render solo indexa nel
+        duracion_clip = line_info["end"] - line_info["start"] + advance + duration_padding
+        self.primeiro_frame, self.programa_resaltado = build_highlight_schedule(
+            line_info, self.layout, fps, duracion_clip, advance, inicio_clip)
+        self.puntos_cambio = self.primeiro_frame + highlight_change_points(self.programa_resaltado)   #en frames globais
+        self.motor_sprites = MotorSpritesLiña(self.layout) if USAR_SPRITES_RESALTADO else None
+        self.cache_frames = CacheFrames()
+
+        if self.motor_sprites is not None:
+            alpha_actual = self.motor_sprites.alpha
+        else:
+            alpha_actual = draw_line_layout_rgba(self.layout, 0)[..., 3]
+
+        # A linea seguinte é estatica durante todo o clip, asi que se renderiza unha vez e preparase
+        # o lenzo combinado (plantilla) coa linea seguinte xa copiada abaixo. Por frame solo se escribe a parte de arriba
+        self.plantilla_combinada = None
+        self.offset_x1 = 0
         if MOSTRAR_LIÑA_SEGUINTE and next_line_info:
-            frame_seguinte = render_next_line_image(next_line_info)
+            rgba_seguinte = render_next_line_rgba(next_line_info)
             
-            
-            altura1 = frameActual.shape[0]
-            altura2 = frame_seguinte.shape[0]
-            ancho = max(frameActual.shape[1], frame_seguinte.shape[1])
+            altura1 = self.layout.altura
+            altura2 = rgba_seguinte.shape[0]
+            ancho = max(self.layout.ancho, rgba_seguinte.shape[1])
             
             altura_combinada = altura1 + ESPACIADO_LIÑAS + altura2
-            frame_combinado = np.zeros((altura_combinada, ancho, 3), dtype=np.uint8)
-            
+            self.plantilla_combinada = np.zeros((altura_combinada, ancho, 3), dtype=np.uint8)
+            alpha_combinada = np.zeros((altura_combinada, ancho), dtype=np.uint8)
             
-            offset_x1 = (ancho - frameActual.shape[1]) // 2
-            offset_x2 = (ancho - frame_seguinte.shape[1]) // 2
-            
-            frame_combinado[:altura1, offset_x1:offset_x1+frameActual.shape[1]] = frameActual
+            self.offset_x1 = (ancho - self.layout.ancho) // 2
+            offset_x2 = (ancho - rgba_seguinte.shape[1]) // 2
             
             y_seguinte_liña = altura1 + ESPACIADO_LIÑAS
-            frame_combinado[y_seguinte_liña:y_seguinte_liña+altura2, offset_x2:offset_x2+frame_seguinte.shape[1]] = frame_seguinte
-            
-            return frame_combinado
+            self.plantilla_combinada[y_seguinte_liña:y_seguinte_liña+altura2, offset_x2:offset_x2+rgba_seguinte.shape[1]] = rgba_seguinte[..., :3]
+            alpha_combinada[y_seguinte_liña:y_seguinte_liña+altura2, offset_x2:offset_x2+rgba_seguinte.shape[1]] = rgba_seguinte[..., 3]
+            alpha_combinada[:altura1, self.offset_x1:self.offset_x1+self.layout.ancho] = alpha_actual
+        else:
+            alpha_combinada = np.ascontiguousarray(alpha_actual)
+
+        # Antes o frame era todo o ancho do clip e opaco (o transparente saía negro). Agora recortase ao
+        # rectangulo que ocupan os fondos e gardase a alpha como mascara. A forma non cambia co resaltado,
+        # asi que a mascara calculase unha vez por linea
+        self.alto_total, self.ancho_total = alpha_combinada.shape
+        filas = np.flatnonzero(alpha_combinada.any(axis=1))
+        columnas = np.flatnonzero(alpha_combinada.any(axis=0))
+        if len(filas) and len(columnas):
+            self.recorte = (int(filas[0]), int(filas[-1]) + 1, int(columnas[0]), int(columnas[-1]) + 1)
+        else:
+            self.recorte = (0, self.alto_total, 0, self.ancho_total)
+        y0, y1, x0, x1 = self.recorte
+        self.mascara = np.ascontiguousarray(alpha_combinada[y0:y1, x0:x1])
+        self.alpha16 = self.mascara.astype(np.uint16)[..., None]
+        self.alpha16_inversa = 255 - self.alpha16
+
+    def rasterizar(self, n_resaltadas: int) -> np.ndarray:
         
-        # se non hai linea siguiente solo se devolve o frame actual
-        return frameActual
+        if self.motor_sprites is not None:
+            frameActual = self.motor_sprites.frame(n_resaltadas)
+        else:
+            frameActual = draw_line_layout(self.layout, n_resaltadas)
+        
+        if self.plantilla_combinada is None:
+            frame = frameActual
+        else:
+            #copiase a plantilla porque os frames quedan gardados na cache e non se poden pisar entre eles
+            frame = self.plantilla_combinada.copy()
+            frame[:frameActual.shape[0], self.offset_x1:self.offset_x1+frameActual.shape[1]] = frameActual
+        
+        y0, y1, x0, x1 = self.recorte
+        frame = np.ascontiguousarray(frame[y0:y1, x0:x1])
+        if self.premultiplicado:
+            # para o overlay gardase xa multiplicado pola alpha, asi por frame solo queda sumar o fondo
+            return frame.astype(np.uint16) * self.alpha16
+        return frame
+
+    # Tramos [inicio, fin) de frames globais dentro de [frame_inicio, frame_fin) nos que o resaltado non cambia,
+    # cos puntos de cambio do programa: (inicio, fin, unidades resaltadas). Sen percorrer frame a frame
+    def tramos_resaltado(self, frame_inicio: int, frame_fin: int) -> list:
+        frame_inicio = max(frame_inicio, self.primeiro_frame)
+        frame_fin = min(frame_fin, self.primeiro_frame + len(self.programa_resaltado))
+        if frame_fin <= frame_inicio:
+            return []
+        cambios = self.puntos_cambio[(self.puntos_cambio > frame_inicio) & (self.puntos_cambio < frame_fin)]
+        limites = [frame_inicio, *cambios.tolist(), frame_fin]
+        return [(inicio, fin, int(self.programa_resaltado[inicio - self.primeiro_frame]))
+                for inicio, fin in zip(limites, limites[1:])]
+
+    def unidades_resaltadas(self, t: float) -> int:
+        # t es el tiempo transcurrido en el clip
+        frame_global = (t + self.inicio_clip) * self.fps
+        indice_frame = int(round(frame_global)) - self.primeiro_frame
+        if 0 <= indice_frame < len(self.programa_resaltado) and abs(frame_global - round(frame_global)) < 1e-6:
+            return int(self.programa_resaltado[indice_frame])
+        
+        #fora da grella de frames (outro fps) calculase directamente
+        t_efectivo = max(t - self.offset_visualizacion, 0)
+        return count_highlighted_units(self.line_info, self.layout, t_efectivo)
+
+    def frame(self, t: float) -> np.ndarray:
+        # o frame solo depende de cantas silabas van resaltadas, os demais saen da cache
+        n_resaltadas = self.unidades_resaltadas(t)
+        return self.cache_frames.get(n_resaltadas, lambda: self.rasterizar(n_resaltadas))
+
+
+# Función para crear o clip de video para a linea de karaoke, envolve o RenderizadorLiña nun VideoClip
+# O clip vai recortado e con mascara, clip_texto.recorte ten o desprazamento (x, y) respecto ao frame sen recortar
+def create_karaoke_text_clip(line_info: dict, next_line_info: dict = None, advance: float=0.5, duration_padding: float=0.5):
+
+    duracion_liña = line_info["end"] - line_info["start"]
+    duracion_clip = duracion_liña + advance + duration_padding
+    renderizador = RenderizadorLiña(line_info, next_line_info, advance, duration_padding=duration_padding)
 
-    clip_texto = VideoClip(facer_frame, duration=duracion_clip)
+    clip_texto = VideoClip(renderizador.frame, duration=duracion_clip)
+    mascara = ImageClip(renderizador.mascara.astype(np.float64) / 255.0, ismask=True).set_duration(duracion_clip)
+    clip_texto = clip_texto.set_mask(mascara)
+    clip_texto.cache_frames = renderizador.cache_frames    #para poder consultar hits/misses deste clip
+    clip_texto.recorte = (renderizador.recorte[2], renderizador.recorte[0])
     return clip_texto
+
+
+# Overlay único para todos os subtitulos. Antes creabase un VideoClip por grupo de frases e todos ian a un
+# CompositeVideoClip, que en cada frame mira todos os clips (80+ en cancions longas). Aqui os intervalos
+# de cada linea gardanse ordenados e en cada frame buscase a linea activa con bisect, e solo esa se pega no frame.
+# Se se solapan dúas lineas (por o advance/padding) gana a ultima que empezou, como pasaba co composite
+class OverlayKaraoke:
+
+    def __init__(self, grupos: list, advance: float = 0.5, duration_padding: float = 0.5,
+                 posicion_y: int = ALTO_VIDEO - MARXE_INFERIOR_SUBTITULO, max_renderizadores: int = 2):
+        self.grupos = grupos
+        self.advance = advance
+        self.duration_padding = duration_padding
+        self.posicion_y = posicion_y
+        self.max_renderizadores = max_renderizadores
+        self.renderizadores = OrderedDict()
+
+        #mostrar medio segundo antes por comodidad
+        intervalos = []
+        for indice, grupo in enumerate(grupos):
+            inicio_compensado = max(grupo["start"] - advance, 0)
+            duracion_extendida = grupo["end"] - grupo["start"] + advance + duration_padding
+            intervalos.append((inicio_compensado, inicio_compensado + duracion_extendida, indice))
+        intervalos.sort(key=lambda intervalo: (intervalo[0], intervalo[2]))
+
+        self.inicios = [intervalo[0] for intervalo in intervalos]
+        self.fins = [intervalo[1] for intervalo in intervalos]
+        self.indices = [intervalo[2] for intervalo in intervalos]
+
+        # maximo dos fins ata cada posicion, para cortar a busca cara atras cando xa non pode haber ningunha activa
+        self.fin_maximo = []
+        maximo = float("-inf")
+        for fin in self.fins:
+            maximo = max(maximo, fin)
+            self.fin_maximo.append(maximo)
+
+    def linea_activa(self, t: float):
+        posicion = bisect_right(self.inicios, t) - 1
+        while posicion >= 0 and self.fin_maximo[posicion] > t:
+            if self.fins[posicion] > t:
+                return posicion
+            posicion -= 1
+        return None
+
+    # Tramos de tempo (inicio, fin, indice do grupo, posicion) nos que se ve sempre a mesma linea. linea_activa
+    # é constante entre dous inicios/fins, asi que abonda con mirala unha vez en cada intervalo
+    def tramos_visibles(self) -> list:
+        limites = sorted(set(self.inicios) | set(self.fins))
+        tramos = []
+        for a, b in zip(limites, limites[1:]):
+            posicion = self.linea_activa((a + b) / 2)
+            if posicion is None:
+                continue
+            indice = self.indices[posicion]
+            if tramos and tramos[-1][2] == indice and tramos[-1][1] == a:
+                tramos[-1] = (tramos[-1][0], b, indice, posicion)
+            else:
+                tramos.append((a, b, indice, posicion))
+        return tramos
+
+    def _renderizador(self, indice: int, inicio_clip: float) -> RenderizadorLiña:
+        if indice in self.renderizadores:
+            self.renderizadores.move_to_end(indice)
+            return self.renderizadores[indice]
+
+        seguinte = self.grupos[indice + 1] if indice + 1 < len(self.grupos) else None
+        renderizador = RenderizadorLiña(self.grupos[indice], next_line_info=seguinte, advance=self.advance,
+                                        premultiplicado=True, duration_padding=self.duration_padding,
+                                        inicio_clip=inicio_clip)
+        self.renderizadores[indice] = renderizador
+        if len(self.renderizadores) > self.max_renderizadores:
+            self.renderizadores.popitem(last=False)
+        return renderizador
+
+    def sprite_en(self, t: float):
+        """Devolve (renderizador, sprite premultiplicado) da linea activa no instante t ou None"""
+        posicion = self.linea_activa(t)
+        if posicion is None:
+            return None
+        renderizador = self._renderizador(self.indices[posicion], self.inicios[posicion])
+        return renderizador, renderizador.frame(t - self.inicios[posicion])
+
+    def apply(self, frame: np.ndarray, t: float) -> np.ndarray:
+        activa = self.sprite_en(t)
+        if activa is None:
+            return frame
+        renderizador, sprite = activa
+
+        # copiase sempre: o frame de fondo pode vir compartido (ImageClip, frame memoizado do lector...)
+        frame = frame.copy()
+
+        alto_frame, ancho_frame = frame.shape[:2]
+        y_recorte, _, x_recorte, _ = renderizador.recorte
+        alto_sprite, ancho_sprite = sprite.shape[:2]
+        x = int((ancho_frame - renderizador.ancho_total) / 2) + x_recorte   #centrado horizontal
+        y = self.posicion_y + y_recorte
+
+        # recortar o que se saia do frame (igual que facia o blit de moviepy)
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + ancho_sprite, ancho_frame), min(y + alto_sprite, alto_frame)
+        if x2 <= x1 or y2 <= y1:
+            return frame
+
+        # mestura alpha en enteiros: (sprite*a + fondo*(255-a)) / 255, o sprite xa ven multiplicado
+        zona = (slice(y1 - y, y2 - y), slice(x1 - x, x2 - x))
+        mestura = frame[y1:y2, x1:x2] * renderizador.alpha16_inversa[zona]
+        mestura += sprite[zona]
+        mestura += 127
+        mestura //= 255
+        frame[y1:y2, x1:x2] = mestura
+        return frame
+
+
+# Aplica o overlay de subtitulos sobre o video de fondo como un unico clip
+def create_karaoke_overlay_clip(video_fondo, grupos: list, advance: float = 0.5, duration_padding: float = 0.5):
+
+    overlay = OverlayKaraoke(grupos, advance=advance, duration_padding=duration_padding)
+    clip_final = video_fondo.fl(lambda gf, t: overlay.apply(gf(t), t))
+    clip_final.overlay_karaoke = overlay
+    return clip_final
+
+
+# Evento do overlay por ffmpeg: un sprite PNG (RGBA xa recortado), a posicion no frame e os rangos
+# de frames [inicio, fin) nos que se ve
+@dataclass
+class EventoOverlay:
+    ruta_png: str
+    x: int
+    y: int
+    rangos: list
+
+
+# primeiro frame k (da grella k / fps) con k / fps >= t, comparando igual que linea_activa
+def _primeiro_frame_desde(t: float, fps: float) -> int:
+    k = max(int(np.ceil(t * fps)), 0)
+    while k > 0 and (k - 1) / fps >= t:
+        k -= 1
+    while k / fps < t:
+        k += 1
+    return k
+
+
+# Eventos do overlay sen percorrer os frames: os tramos nos que se ve cada linea saen dos inicios/fins do
+# OverlayKaraoke (o mismo que usa o render con moviepy) e dentro de cada tramo os cambios de resaltado
+# saen dos puntos de cambio do programa de cada linea. Cada combinacion distinta (linea, n) gardase unha vez
+# como PNG, asi que unha cancion queda en uns centos de imaxes e o ffmpeg fai o resto
+def export_overlay_events(grupos: list, directorio: str, duracion: float, ancho_frame: int = ANCHO_VIDEO,
+                          fps: float = FPS_VIDEO, advance: float = 0.5, duration_padding: float = 0.5) -> list:
+
+    overlay = OverlayKaraoke(grupos, advance=advance, duration_padding=duration_padding)
+    total_frames = int(np.ceil(duracion * fps))
+    eventos = {}
+    renderizadores = {}
+    anterior = None
+
+    for inicio, fin, indice, posicion in overlay.tramos_visibles():
+        frame_inicio = _primeiro_frame_desde(inicio, fps)
+        frame_fin = min(_primeiro_frame_desde(fin, fps), total_frames)
+        if frame_fin <= frame_inicio:
+            continue
+
+        if indice not in renderizadores:
+            seguinte = grupos[indice + 1] if indice + 1 < len(grupos) else None
+            renderizadores[indice] = RenderizadorLiña(grupos[indice], next_line_info=seguinte, advance=advance,
+                                                      duration_padding=duration_padding, fps=fps,
+                                                      inicio_clip=overlay.inicios[posicion])
+        renderizador = renderizadores[indice]
+
+        for a, b, n_resaltadas in renderizador.tramos_resaltado(frame_inicio, frame_fin):
+            clave = (indice, n_resaltadas)
+            if clave not in eventos:
+                ruta_png = os.path.join(directorio, f"sprite_{len(eventos):05d}.png")
+                rgba = np.dstack([renderizador.rasterizar(n_resaltadas), renderizador.mascara])
+                Image.fromarray(rgba, "RGBA").save(ruta_png, compress_level=1)
+                y_recorte, _, x_recorte, _ = renderizador.recorte
+                x = int((ancho_frame - renderizador.ancho_total) / 2) + x_recorte   #igual que OverlayKaraoke.apply
+                eventos[clave] = EventoOverlay(ruta_png, x, overlay.posicion_y + y_recorte, [])
+
+            rangos = eventos[clave].rangos
+            if clave == anterior and rangos[-1][1] == a:
+                rangos[-1][1] = b
+            else:
+                rangos.append([a, b])
+            anterior = clave
+
+    return list(eventos.values())
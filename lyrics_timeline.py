@@ -0,0 +1,145 @@
+import os
+import json
+
+from config import (ANCHO_VIDEO, ALTO_VIDEO, FPS_VIDEO, COR_TEXTO, COR_RESALTADO, COR_CONTORNO_TEXTO,
+                    GROSOR_CONTORNO_TEXTO, TAMAÑO_FONTE, FACTOR_FONTE_LIÑA_SEGUINTE, FONTE, TEXT_CLIP_WIDTH,
+                    COR_FONDO_TEXTO, PADDING_FONDO_TEXTO, COR_LIÑA_SEGUINTE, ALPHA_LIÑA_SEGUINTE,
+                    ESPACIADO_LIÑAS, MOSTRAR_LIÑA_SEGUINTE, TAMAÑO_FONTE_MIN)
+from karaoke_rendering import build_line_layout, OverlayKaraoke
+from ass_processing import _instantes_resaltado
+from utils import karaoke_base_name
+
+# Timeline das letras en JSON para o modo sen queimar: o reprodutor web debuxa os subtitulos nun canvas enriba
+# do _video_only.mp4 en vez de reproducir un video coas letras xa queimadas.
+# Os instantes de resaltado de cada silaba sacanse do mismo codigo que o render (igual que no ASS), e gardanse
+# tamen as palabras cos seus tempos e as silabas para poder reconstruir os grupos e queimar o mp4 cando se pida
+
+VERSION_TIMELINE = 1
+
+
+# lyrics_<nome base>.json, ao lado dos stems vocal_/instrumental_ do mismo karaoke
+def timeline_filename(karaoke_filename: str) -> str:
+    return f"lyrics_{karaoke_base_name(karaoke_filename)}.json"
+
+
+def _segundos(valor) -> float:
+    return round(float(valor), 3)
+
+
+# filas visuales da liña: cada unidade é [texto, instante en centesimas (ou null se non se chega a resaltar), cor].
+# A cor solo vai se é a dun speaker, null é COR_RESALTADO. O espacio entre palabras vai no texto da unidade
+def _filas_liña(layout, instantes: list) -> list:
+    filas = []
+    for liña_visual in range(len(layout.liñas)):
+        indices = [i for i, u in enumerate(layout.unidades) if u.liña_visual == liña_visual]
+        fila = []
+        for posicion, i in enumerate(indices):
+            unidade = layout.unidades[i]
+            texto = unidade.texto
+            if posicion + 1 < len(indices) and layout.unidades[indices[posicion + 1]].indice_palabra != unidade.indice_palabra:
+                texto += " "
+            cor = unidade.cor_resaltado if unidade.cor_resaltado != COR_RESALTADO else None
+            fila.append([texto, instantes[i], cor])
+        if fila:
+            filas.append(fila)
+    return filas
+
+
+def _palabras_compactas(grupo: dict) -> list:
+    return [[palabra.get("word", ""), _segundos(palabra["start"]), _segundos(palabra["end"]),
+             palabra.get("speaker"), palabra.get("color")] for palabra in grupo.get("words") or []]
+
+
+def build_lyrics_timeline(grupos: list, advance: float = 0.5, duration_padding: float = 0.5,
+                          fps: float = FPS_VIDEO) -> dict:
+
+    overlay = OverlayKaraoke(grupos, advance=advance, duration_padding=duration_padding)
+    posicions = {indice: posicion for posicion, indice in enumerate(overlay.indices)}
+
+    liñas = []
+    for indice, grupo in enumerate(grupos):
+        posicion = posicions[indice]
+        inicio, fin = overlay.inicios[posicion], overlay.fins[posicion]
+        layout = build_line_layout(grupo)
+        instantes = _instantes_resaltado(grupo, layout, inicio, fin - inicio, advance, fps)
+        liñas.append({
+            "text": grupo["line_text"],
+            "start": _segundos(grupo["start"]),
+            "end": _segundos(grupo["end"]),
+            "font_size": layout.tamaño_fonte,
+            "rows": _filas_liña(layout, instantes),
+            "words": _palabras_compactas(grupo),
+            "syllables": grupo.get("syllables"),
+            "language": grupo.get("language"),
+        })
+
+    # tramos [inicio, fin) en centesimas nos que se ve cada liña (a ultima que empezou gaña, igual que no video)
+    tramos = [[int(round(a * 100)), int(round(b * 100)), indice] for a, b, indice, _ in overlay.tramos_visibles()]
+
+    return {
+        "version": VERSION_TIMELINE,
+        "width": ANCHO_VIDEO,
+        "height": ALTO_VIDEO,
+        "style": {
+            "font": os.path.basename(FONTE),
+            "font_size": TAMAÑO_FONTE,
+            "font_size_min": TAMAÑO_FONTE_MIN,
+            "next_font_factor": FACTOR_FONTE_LIÑA_SEGUINTE,
+            "clip_width": TEXT_CLIP_WIDTH,
+            "padding": PADDING_FONDO_TEXTO,
+            "line_spacing": ESPACIADO_LIÑAS,
+            "y": overlay.posicion_y,
+            "text": COR_TEXTO,
+            "highlight": COR_RESALTADO,
+            "outline": COR_CONTORNO_TEXTO,
+            "outline_width": GROSOR_CONTORNO_TEXTO,
+            "background": list(COR_FONDO_TEXTO),
+            "next": COR_LIÑA_SEGUINTE,
+            "next_alpha": ALPHA_LIÑA_SEGUINTE,
+            "show_next": MOSTRAR_LIÑA_SEGUINTE,
+        },
+        "spans": tramos,
+        "lines": liñas,
+    }
+
+
+# JSON sen espacios, é o que se descarga o navegador
+def write_lyrics_timeline(grupos: list, ruta_json: str, advance: float = 0.5, duration_padding: float = 0.5) -> str:
+    try:
+        timeline = build_lyrics_timeline(grupos, advance=advance, duration_padding=duration_padding)
+        with open(ruta_json, "w", encoding="utf-8") as f:
+            json.dump(timeline, f, ensure_ascii=False, separators=(",", ":"))
+        print(f"Timeline das letras gardado en {ruta_json}")
+        return ruta_json
+    except Exception as e:
+        print(f"Error xerando o timeline das letras: {e}")
+        return ""
+
+
+# Grupos de frases reconstruidos dende o timeline (para queimar o mp4 despois, sen volver aliñar)
+def groups_from_timeline(timeline: dict) -> list:
+    grupos = []
+    for liña in timeline.get("lines", []):
+        palabras = []
+        for palabra, inicio, fin, speaker, cor in liña.get("words", []):
+            datos = {"word": palabra, "start": inicio, "end": fin}
+            if speaker:
+                datos["speaker"] = speaker
+            if cor:
+                datos["color"] = cor
+            palabras.append(datos)
+        grupo = {"line_text": liña["text"], "start": liña["start"], "end": liña["end"], "words": palabras,
+                 "language": liña.get("language")}
+        if liña.get("syllables") is not None:
+            grupo["syllables"] = liña["syllables"]
+        grupos.append(grupo)
+    return grupos
+
+
+def load_lyrics_timeline(ruta_json: str) -> dict:
+    try:
+        with open(ruta_json, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Non se puido ler o timeline {ruta_json}: {e}")
+        return {}
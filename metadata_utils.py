@@ -1,8 +1,8 @@
 import os
 import re
-from moviepy.editor import VideoFileClip
 from typing import Dict, Optional
 from urllib.parse import urlparse, parse_qs
+from video_processing import get_media_duration
 
 #extrae un titulo limpo do nome do archivo
 def extract_title_from_filename(filename: str) -> str:
@@ -24,12 +24,10 @@ def extract_youtube_title_from_url(url: str) -> Optional[str]:
     except:
         return None
 
+# co ffprobe (cacheado) en vez de abrir un VideoFileClip enteiro solo para a duracion
 def get_video_duration(video_path: str) -> Optional[float]:
-    try:
-        with VideoFileClip(video_path) as video:
-            return video.duration
-    except Exception as e:
-        return None
+    duracion = get_media_duration(video_path)
+    return duracion if duracion > 0 else None
 
 def get_file_size(file_path: str) -> int:
     try:
@@ -86,6 +84,8 @@ def generate_song_metadata(
             title = youtube_title
     
     karaoke_path = os.path.join(output_dir, karaoke_filename)
+    if not os.path.exists(karaoke_path):
+        karaoke_path = os.path.join(output_dir, video_only_filename)   #modo sen queimar, o mp4 coas letras faise ao descargalo
     file_size = get_file_size(karaoke_path)
     duration = get_video_duration(karaoke_path)
     
@@ -78,6 +78,27 @@ def parse_word_srt(srt_path: str) -> list:
     return segmentos
 
 
+# Segmentos de palabra que devolve o servicio de whisperx no JSON de /align, co mesmo formato que parse_word_srt
+# pero cos tempos reais de cada palabra. Devolve None se a resposta non os trae (servicio vello, solo SRT)
+def word_segments_from_response(resposta: dict):
+
+    if not resposta or "word_segments" not in resposta:
+        return None
+    segmentos = []
+    for palabra in resposta["word_segments"]:
+        texto = (palabra.get("word") or "").strip()
+        if not texto:
+            continue
+        segmentos.append({
+            "start": float(palabra["start"]),
+            "end": float(palabra["end"]),
+            "word": texto,
+            "speaker": palabra.get("speaker"),
+            "color": palabra.get("color")
+        })
+    return clean_abnormal_segments(segmentos)
+
+
 # agrupanse os segmentos de palabra en lineas e asignanse os tokens proporcionalmente respecto a cantidade esperada na
 # letra manual. Asegurome de que cada linea obteña polo menos 1 token se hai polo menos unha palabra na letra.
 # Devolve outra lista de diccionarios
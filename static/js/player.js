@@ -30,6 +30,12 @@ class KaraokePlayer {
         this.setupSynchronization();
         this.setupBeforeUnloadConfirmation();
         
+        //modo sen queimar: as letras debuxanse nun canvas enriba do video
+        const lyricsCanvas = document.getElementById('lyricsCanvas');
+        if (lyricsCanvas) {
+            this.lyrics = new LyricsCanvas(this.video, lyricsCanvas);
+        }
+        
         this.video.addEventListener('loadeddata', () => {
             this.video.volume = 0;
             this.video.muted = true;
@@ -269,6 +275,253 @@ class KaraokePlayer {
     }
 }
 
+// Letras debuxadas no navegador (modo sen queimar). O timeline trae os instantes de resaltado de cada silaba
+// calculados no servidor co mismo codigo que o render, aqui solo se debuxa a liña que toca.
+// As medidas van en pixels do video (timeline.width x timeline.height) e escalanse ao tamaño do reprodutor
+class LyricsCanvas {
+    constructor(video, canvas) {
+        this.video = video;
+        this.canvas = canvas;
+        this.ctx = canvas.getContext('2d');
+        this.timeline = null;
+        this.fontFamily = 'sans-serif';
+        this.lastKey = null;
+        
+        window.addEventListener('resize', () => this.resize());
+        this.video.addEventListener('loadedmetadata', () => this.resize());
+        
+        this.load(canvas.dataset.lyricsUrl);
+    }
+    
+    async load(url) {
+        try {
+            //no-cache: o navegador revalida co ETag e se non cambiou o servidor devolve un 304
+            const response = await fetch(url, { cache: 'no-cache' });
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            this.timeline = await response.json();
+            await this.loadFont(this.timeline.style.font);
+            this.resize();
+            requestAnimationFrame(() => this.draw());
+        } catch (error) {
+            console.error('Erro cargando as letras:', error);
+        }
+    }
+    
+    //a mesma fonte que o render, se non se pode cargar queda a do navegador
+    async loadFont(fontFile) {
+        if (!fontFile || !window.FontFace) {
+            return;
+        }
+        try {
+            const font = new FontFace('KaraokeLyrics', `url(/fonts/${fontFile})`);
+            await font.load();
+            document.fonts.add(font);
+            this.fontFamily = 'KaraokeLyrics';
+        } catch (error) {
+            console.warn('Non se puido cargar a fonte das letras:', error);
+        }
+    }
+    
+    resize() {
+        const rect = this.canvas.getBoundingClientRect();
+        const ratio = window.devicePixelRatio || 1;
+        this.canvas.width = Math.round(rect.width * ratio);
+        this.canvas.height = Math.round(rect.height * ratio);
+        this.lastKey = null;
+    }
+    
+    //zona do canvas onde está o video (o elemento video deixa bandas se non ten a mesma proporcion)
+    videoArea() {
+        const videoWidth = this.video.videoWidth || this.timeline.width;
+        const videoHeight = this.video.videoHeight || this.timeline.height;
+        const scale = Math.min(this.canvas.width / videoWidth, this.canvas.height / videoHeight);
+        const width = videoWidth * scale;
+        const height = videoHeight * scale;
+        return {
+            x: (this.canvas.width - width) / 2,
+            y: (this.canvas.height - height) / 2,
+            scale: width / this.timeline.width
+        };
+    }
+    
+    //busca binaria nos tramos [inicio, fin) en centesimas, devolve o indice da liña ou null
+    activeLine(cs) {
+        const spans = this.timeline.spans;
+        let low = 0;
+        let high = spans.length - 1;
+        while (low <= high) {
+            const mid = (low + high) >> 1;
+            if (spans[mid][1] <= cs) {
+                low = mid + 1;
+            } else if (spans[mid][0] > cs) {
+                high = mid - 1;
+            } else {
+                return spans[mid][2];
+            }
+        }
+        return null;
+    }
+    
+    countHighlighted(line, cs) {
+        let count = 0;
+        for (const row of line.rows) {
+            for (const unit of row) {
+                if (unit[1] !== null && unit[1] <= cs) {
+                    count++;
+                }
+            }
+        }
+        return count;
+    }
+    
+    draw() {
+        requestAnimationFrame(() => this.draw());
+        
+        const cs = Math.round(this.video.currentTime * 100);
+        const index = this.activeLine(cs);
+        const line = index === null ? null : this.timeline.lines[index];
+        
+        //solo se volve debuxar cando cambia a liña ou as silabas resaltadas
+        const key = `${index}:${line ? this.countHighlighted(line, cs) : 0}:${this.canvas.width}x${this.canvas.height}`;
+        if (key === this.lastKey) {
+            return;
+        }
+        this.lastKey = key;
+        
+        const ctx = this.ctx;
+        ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
+        if (!line) {
+            return;
+        }
+        
+        const style = this.timeline.style;
+        const area = this.videoArea();
+        ctx.save();
+        ctx.translate(area.x, area.y);
+        ctx.scale(area.scale, area.scale);
+        
+        const height = this.drawLine(line, cs);
+        const nextLine = this.timeline.lines[index + 1];
+        if (style.show_next && nextLine) {
+            this.drawNextLine(nextLine, style.y + height + style.line_spacing);
+        }
+        ctx.restore();
+    }
+    
+    //mesmas medidas que o layout do render: alto de liña 1.4 x fonte, fondo de polo menos o 40% do ancho
+    drawLine(line, cs) {
+        const ctx = this.ctx;
+        const style = this.timeline.style;
+        const lineHeight = Math.floor(line.font_size * 1.4);
+        const left = (this.timeline.width - style.clip_width) / 2;
+        
+        ctx.font = `${line.font_size}px ${this.fontFamily}`;
+        ctx.textBaseline = 'top';
+        ctx.lineJoin = 'round';
+        
+        const rowWidths = line.rows.map(row => ctx.measureText(row.map(unit => unit[0]).join('')).width);
+        const height = Math.max(line.font_size + 2 * style.padding, line.rows.length * lineHeight + 2 * style.padding);
+        const backgroundWidth = Math.max(style.clip_width * 0.4,
+                                         Math.min(Math.max(...rowWidths) + 2 * style.padding, style.clip_width));
+        
+        this.roundedRect(left + (style.clip_width - backgroundWidth) / 2, style.y, backgroundWidth, height, 10);
+        ctx.fillStyle = this.rgba(style.background);
+        ctx.fill();
+        
+        //primeiro todos os contornos e despois os rechenos, para que o contorno dunha silaba non tape a anterior
+        for (const pass of ['stroke', 'fill']) {
+            line.rows.forEach((row, r) => {
+                let x = left + (style.clip_width - rowWidths[r]) / 2;
+                const y = style.y + style.padding + r * lineHeight;
+                for (const [text, onset, color] of row) {
+                    if (pass === 'stroke') {
+                        ctx.lineWidth = style.outline_width * 2;
+                        ctx.strokeStyle = style.outline;
+                        ctx.strokeText(text, x, y);
+                    } else {
+                        const highlighted = onset !== null && onset <= cs;
+                        ctx.fillStyle = highlighted ? (color || style.highlight) : style.text;
+                        ctx.fillText(text, x, y);
+                    }
+                    x += ctx.measureText(text).width;
+                }
+            });
+        }
+        return height;
+    }
+    
+    //liña seguinte: mais pequena, gris e semitransparente
+    drawNextLine(line, y) {
+        const ctx = this.ctx;
+        const style = this.timeline.style;
+        let fontSize = Math.floor(style.font_size * style.next_font_factor);
+        if (line.text.length > 100) {
+            const reduction = Math.min(1.0, 100 / line.text.length);
+            fontSize = Math.floor(Math.max(style.font_size_min * style.next_font_factor, Math.floor(fontSize * reduction)));
+        }
+        ctx.font = `${fontSize}px ${this.fontFamily}`;
+        
+        const rows = this.wrapText(line.text, style.clip_width - 2 * style.padding);
+        const rowHeight = fontSize + 10;
+        const height = rows.length * rowHeight + 2 * style.padding;
+        const width = Math.min(Math.max(...rows.map(row => ctx.measureText(row).width)) + 2 * style.padding,
+                               style.clip_width);
+        const left = (this.timeline.width - style.clip_width) / 2;
+        
+        this.roundedRect(left + (style.clip_width - width) / 2, y, width, height, 0);
+        ctx.fillStyle = this.rgba(style.background, style.next_alpha);
+        ctx.fill();
+        
+        ctx.globalAlpha = style.next_alpha;
+        ctx.lineWidth = style.outline_width * 1.5;
+        ctx.strokeStyle = style.outline;
+        ctx.fillStyle = style.next;
+        rows.forEach((row, r) => {
+            const x = left + (style.clip_width - ctx.measureText(row).width) / 2;
+            const rowY = y + style.padding + r * rowHeight;
+            ctx.strokeText(row, x, rowY);
+            ctx.fillText(row, x, rowY);
+        });
+        ctx.globalAlpha = 1;
+    }
+    
+    wrapText(text, maxWidth) {
+        const rows = [];
+        let current = '';
+        for (const word of text.split(/\s+/).filter(Boolean)) {
+            const candidate = current ? `${current} ${word}` : word;
+            if (current && this.ctx.measureText(candidate).width > maxWidth) {
+                rows.push(current);
+                current = word;
+            } else {
+                current = candidate;
+            }
+        }
+        if (current) {
+            rows.push(current);
+        }
+        return rows.length ? rows : [text];
+    }
+    
+    roundedRect(x, y, width, height, radius) {
+        const ctx = this.ctx;
+        ctx.beginPath();
+        ctx.moveTo(x + radius, y);
+        ctx.arcTo(x + width, y, x + width, y + height, radius);
+        ctx.arcTo(x + width, y + height, x, y + height, radius);
+        ctx.arcTo(x, y + height, x, y, radius);
+        ctx.arcTo(x, y, x + width, y, radius);
+        ctx.closePath();
+    }
+    
+    rgba(color, factor = 1) {
+        const [r, g, b, a] = color;
+        return `rgba(${r}, ${g}, ${b}, ${(a / 255) * factor})`;
+    }
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     console.log('DOM cargado, inicializando reprodutor de karaoke...');
     
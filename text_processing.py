@@ -1,8 +1,70 @@
 import re
+from functools import lru_cache
 import pyphen
 
-#pyhen é o que uso para o silabeador
-dic_pyphen = pyphen.Pyphen(lang='es_ES')
+#pyhen é o que uso para o silabeador. Antes estaba fixo en es_ES, agora escollese o dicionario
+#segun o idioma detectado ou declarado e cargase unha soa vez por proceso (lazy)
+IDIOMA_SILABAS_DEFECTO = "es_ES"
+
+#preferencias para codigos curtos que en algunhas versions de pyphen solo existen con rexion
+IDIOMAS_PYPHEN_PREFERIDOS = {
+    "en": "en_US",
+    "pt": "pt_PT",
+    "de": "de_DE",
+    "it": "it_IT",
+}
+
+
+def _codigo_pyphen(language: str = None) -> str:
+    if not language:
+        return IDIOMA_SILABAS_DEFECTO
+
+    codigo = language.strip().replace("-", "_")
+    for candidato in (IDIOMAS_PYPHEN_PREFERIDOS.get(codigo.lower()), codigo, codigo.lower()):
+        if candidato:
+            resolto = pyphen.language_fallback(candidato)
+            if resolto:
+                return resolto
+
+    print(f"Non hai dicionario de silabas para '{language}', usando {IDIOMA_SILABAS_DEFECTO}")
+    return IDIOMA_SILABAS_DEFECTO
+
+
+@lru_cache(maxsize=None)
+def _cargar_dicionario(codigo: str) -> pyphen.Pyphen:
+    return pyphen.Pyphen(lang=codigo)
+
+
+def get_pyphen_dictionary(language: str = None) -> pyphen.Pyphen:
+    return _cargar_dicionario(_codigo_pyphen(language))
+
+
+# Silabas dunha palabra, memoizado por (palabra, idioma). Se a palabra non se pode dividir devolvese enteira
+@lru_cache(maxsize=50000)
+def syllabify_word(word: str, language: str = None) -> tuple:
+
+    silabas = get_pyphen_dictionary(language).inserted(word).split('-')
+    if len(silabas) <= 1:   # Palabra non divisible
+        return (word,)
+    return tuple(silabas)
+
+
+# Taboa de silabas dunha liña: unha lista de silabas por cada palabra de line_text
+def build_syllable_table(line_text: str, language: str = None) -> list:
+    return [list(syllabify_word(palabra, language)) for palabra in line_text.split()]
+
+
+# Calculase unha vez por canción e gardase en cada grupo xunto cos tempos das palabras,
+# asi o render non ten que chamar ao pyphen nunca
+def attach_syllable_tables(grupos: list, language: str = None) -> list:
+
+    for grupo in grupos:
+        grupo["syllables"] = build_syllable_table(grupo["line_text"], language)
+        grupo["language"] = language
+
+    info_cache = syllabify_word.cache_info()
+    print(f"Taboa de silabas ({_codigo_pyphen(language)}): {len(grupos)} liñas, cache hits={info_cache.hits} misses={info_cache.misses}")
+    return grupos
 
 
 def normalize_manual_lyrics(lyrics: str) -> str:
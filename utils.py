@@ -2,7 +2,8 @@ import os
 import re
 import unicodedata
 import math
-import glob
+import uuid
+import shutil
 
 
 #Convirte segundos a formato de timecode SRT
@@ -40,21 +41,6 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
-def remove_previous_srt():
-    """Elimina archivos SRT anteriores de /data para evitar conflictos, agora non deberia haber problema pero manteñoa"""
-
-    srt_files = glob.glob("/data/*")
-    if srt_files:
-        print(f" Borrando SRT anteriores => {srt_files}")
-        for path in srt_files:
-            try:
-                os.remove(path)
-            except Exception as e:
-                print(f"   error ao eliminar {path}: {e}")
-    else:
-        print("non habia srts anteriores en /data.")
-
-
 #Esta funcion esta feita para correxir o erro de que a última frase que se cantou se quede en pantalla cando empeza un solo de instrumental. #HAI QUE REVISAR OUTRA SOLUCION!!!
 def clean_abnormal_segments(word_segments, max_word_duration=3.0):
 
@@ -78,3 +64,43 @@ def clean_abnormal_segments(word_segments, max_word_duration=3.0):
             cleaned_segments.append(segment)
     
     return cleaned_segments
+
+
+# Os stems para o reprodutor son os mismos bytes que os do traballo, asi que se fai un hardlink en vez de copialos.
+# Se estan en sistemas de archivos distintos (volumes de docker) copiase como antes
+def link_or_copy(orixe: str, destino: str):
+    if os.path.exists(destino):
+        os.remove(destino)
+    try:
+        os.link(orixe, destino)
+    except OSError:
+        shutil.copy2(orixe, destino)
+
+
+# Leva un resultado do directorio do traballo a output dunha vez: o reprodutor e a biblioteca nunca ven un mp4
+# a medio escribir e dous traballos da mesma cancion non mesturan archivos. Se output está noutro volume copiase
+# a un temporal oculto ao lado do destino e renomease. Con copiar=True a orixe queda onde estaba
+def promote_file(orixe: str, destino: str, copiar: bool = False) -> str:
+    directorio = os.path.dirname(destino) or "."
+    os.makedirs(directorio, exist_ok=True)
+    if not copiar:
+        try:
+            os.replace(orixe, destino)
+            return destino
+        except OSError:
+            pass
+    temporal = os.path.join(directorio, f".{os.path.basename(destino)}.{uuid.uuid4().hex[:8]}.tmp")
+    link_or_copy(orixe, temporal)
+    os.replace(temporal, destino)
+    if not copiar:
+        os.remove(orixe)
+    return destino
+
+
+# nome base dun karaoke (o que levan os stems vocal_/instrumental_ e o timeline lyrics_)
+def karaoke_base_name(karaoke_filename: str) -> str:
+    if karaoke_filename.startswith("karaoke_manual_"):
+        return karaoke_filename.replace("karaoke_manual_", "").replace(".mp4", "")
+    if karaoke_filename.startswith("karaoke_"):
+        return karaoke_filename.replace("karaoke_", "").replace(".mp4", "")
+    return karaoke_filename.replace(".mp4", "")
@@ -1,9 +1,65 @@
 import os
 import subprocess
 import json
+import numpy as np
 from typing import Dict, Optional
 from moviepy.editor import VideoFileClip
-from config import ANCHO_VIDEO, ALTO_VIDEO, FPS_VIDEO
+from config import ANCHO_VIDEO, ALTO_VIDEO, FPS_VIDEO, FACTOR_ESCURECEMENTO, PERFILES_RENDER, PERFIL_RENDER_DEFECTO
+from artifact_cache import artifact_key, fetch_artifact_files, store_artifact_files
+
+# escalado a ANCHO_VIDEO x ALTO_VIDEO mantendo a relacion de aspecto, con bandas negras se fai falta.
+# Usase na normalizacion e tamen dentro do grafo dos backends de ffmpeg cando se fai todo nun paso.
+# setsar=1 para que os dous camiños saian cos pixels cadrados aínda que a entrada non os teña
+FILTRO_NORMALIZACION = f"scale={ANCHO_VIDEO}:{ALTO_VIDEO}:force_original_aspect_ratio=decrease,pad={ANCHO_VIDEO}:{ALTO_VIDEO}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+
+# Perfil de render por nome. Se non existe (ou ven baleiro do formulario) usase o de por defecto
+def get_render_profile(nome: str = None) -> dict:
+    return PERFILES_RENDER.get(nome or PERFIL_RENDER_DEFECTO, PERFILES_RENDER[PERFIL_RENDER_DEFECTO])
+
+
+# argumentos de calidade do x264 dun perfil, sen o preset (o escritor de moviepy recibe o preset aparte).
+# O maxrate/bufsize do perfil solo se aplica na normalizacion (normalizacion=True), o render final vai solo por crf
+def x264_quality_args(perfil: dict, normalizacion: bool = False) -> list:
+    args = ["-crf", str(perfil["crf"])]
+    if perfil.get("tune"):
+        args += ["-tune", perfil["tune"]]
+    if normalizacion and perfil.get("maxrate"):
+        args += ["-maxrate", perfil["maxrate"], "-bufsize", perfil.get("bufsize", perfil["maxrate"])]
+    return args
+
+
+def x264_args(perfil: dict, normalizacion: bool = False) -> list:
+    return ["-preset", perfil["preset"]] + x264_quality_args(perfil, normalizacion)
+
+
+# Escurecido do fondo con taboa en vez de (img*0.3).astype("uint8"), que pasaba cada frame a float64
+# (uns 22 MB temporales por frame a 1280x720). Mesmo resultado (trunca igual) e sempre en uint8
+def build_darkening_lut(factor: float = FACTOR_ESCURECEMENTO) -> np.ndarray:
+    return (np.arange(256) * factor).astype(np.uint8)
+
+
+# Taboa de 65536 entradas para aplicar a de 256 a dous bytes de cada vez (mirando o frame como uint16).
+# Son 128 KB, entra en cache e fai a metade de accesos. Construese sobre os bytes para non depender do endianness
+def _lut_pares(lut: np.ndarray) -> np.ndarray:
+    bytes_indices = np.arange(65536, dtype=np.uint16).view(np.uint8)
+    return lut[bytes_indices].view(np.uint16)
+
+
+LUT_ESCURECEMENTO = build_darkening_lut()
+LUT_ESCURECEMENTO_PARES = _lut_pares(LUT_ESCURECEMENTO)
+
+
+# Non se fai no mismo array: os frames do lector de moviepy son de solo lectura e os dun ImageClip
+# son sempre o mismo array, escurecelo ahi acumulariase frame tras frame
+def darken_frame(frame: np.ndarray) -> np.ndarray:
+    if frame.dtype == np.uint8 and frame.flags.c_contiguous and frame.size % 2 == 0:
+        pares = frame.reshape(-1).view(np.uint16)
+        return np.take(LUT_ESCURECEMENTO_PARES, pares).view(np.uint8).reshape(frame.shape)
+    return np.take(LUT_ESCURECEMENTO, frame)
+
+
+# o mismo escurecido como filtro de ffmpeg para os backends que renderizan todo no ffmpeg
+FILTRO_ESCURECEMENTO = f"colorchannelmixer=rr={FACTOR_ESCURECEMENTO}:gg={FACTOR_ESCURECEMENTO}:bb={FACTOR_ESCURECEMENTO}"
 
 #Conten arreglo Pillow e mais cousas. Chequear o commit mais a web onde se arreglaba
 
@@ -18,7 +74,22 @@ def patch_pillow_compatibility():
         pass
 
 
+# Resultado do ffprobe de cada archivo por (ruta, mtime, tamaño). O mismo archivo probabase varias veces
+# por traballo (codec, dimensions e recodificacion na normalizacion, duracions no render e nos metadatos)
+# e cada ffprobe son centos de ms de arrancar o proceso. Se o archivo cambia a clave xa non cadra.
+# Os fallos non se gardan. Os dicts devoltos compartense, non se modifican
+_PROBES_MEDIA = {}
+MAXIMO_PROBES_MEDIA = 512
+
+
 def get_video_info(video_path: str) -> Dict:
+    try:
+        estado = os.stat(video_path)
+    except OSError:
+        return {}
+    clave = (os.path.abspath(video_path), estado.st_mtime_ns, estado.st_size)
+    if clave in _PROBES_MEDIA:
+        return _PROBES_MEDIA[clave]
     try:
         cmd = [
             "ffprobe",
@@ -29,9 +100,13 @@ def get_video_info(video_path: str) -> Dict:
             video_path
         ]
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return json.loads(result.stdout)
+        info = json.loads(result.stdout)
     except Exception:
         return {}
+    if len(_PROBES_MEDIA) >= MAXIMO_PROBES_MEDIA:
+        _PROBES_MEDIA.pop(next(iter(_PROBES_MEDIA)), None)     #o mais antigo
+    _PROBES_MEDIA[clave] = info
+    return info
 
 
 def get_video_codec(video_path: str) -> Optional[str]:
@@ -56,6 +131,54 @@ def get_video_dimensions(video_path: str) -> tuple:
     return (0, 0)
 
 
+# duracion en segundos de calquer archivo que entenda o ffprobe (video ou audio). 0.0 se non se pode ler
+def get_media_duration(media_path: str) -> float:
+    info = get_video_info(media_path)
+    try:
+        return float(info.get("format", {}).get("duration", 0.0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# duracion do stream de audio (o que dura a cancion, pode non ser igual que a do video). Se non a trae, a do archivo
+def get_audio_duration(media_path: str) -> float:
+    info = get_video_info(media_path)
+    for stream in info.get("streams", []):
+        if stream.get("codec_type") == "audio" and stream.get("duration"):
+            try:
+                return float(stream["duration"])
+            except (TypeError, ValueError):
+                break
+    try:
+        return float(info.get("format", {}).get("duration", 0.0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# instantes (segundos) dos keyframes do primeiro stream de video. Lista baleira se o ffprobe falla
+def get_keyframe_times(video_path: str) -> list:
+    try:
+        cmd = [
+            "ffprobe",
+            "-v", "quiet",
+            "-select_streams", "v:0",
+            "-skip_frame", "nokey",
+            "-show_entries", "frame=pts_time",
+            "-of", "csv=p=0",
+            video_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        tempos = []
+        for liña in result.stdout.splitlines():
+            try:
+                tempos.append(float(liña.strip().strip(",")))
+            except ValueError:
+                continue
+        return sorted(tempos)
+    except Exception:
+        return []
+
+
 #solucion para mirar se o video ten que ser recodificado
 def needs_reencoding(video_path: str) -> bool:
     codec = get_video_codec(video_path)
@@ -70,10 +193,25 @@ patch_pillow_compatibility()
 
 #normalizar os videos ao mismo formato en ambas opcions para que os subtitulos salan sempre igual. Diferentes
 #formatos de video facia que os subtitulos se comportasen diferente cada vez
-def normalize_video(video_path: str) -> str:
+# directorio_saida: onde deixar o normalizado (o directorio do traballo), sen el vai ao lado do orixinal
+def normalize_video(video_path: str, render_profile: str = None, directorio_saida: str = None) -> str:
 
     normalized_path = video_path.replace(".mp4", "_normalized.mp4")
+    if directorio_saida:
+        normalized_path = os.path.join(directorio_saida, os.path.basename(normalized_path))
+    codificacion = x264_args(get_render_profile(render_profile), normalizacion=True)    #preset/crf/tune do perfil do traballo
+
+    # se este video xa se normalizou co mismo perfil (mismo contido, calquera nome) sacase da cache
+    try:
+        clave_cache = artifact_key(video_path, filtro=FILTRO_NORMALIZACION, fps=FPS_VIDEO, codificacion=codificacion)
+    except OSError as e:
+        print(f"Non se puido calcular a clave da cache: {e}")
+        clave_cache = None
+    if clave_cache and fetch_artifact_files("normalized", clave_cache, {"video.mp4": normalized_path}):
+        return normalized_path
     
+    # o de antes pode ser doutro video co mismo nome (ou estar a medias), e se é un hardlink da cache
+    # escribir enriba estragaria a entrada
     if os.path.exists(normalized_path):
         try:
             os.remove(normalized_path)
@@ -96,13 +234,11 @@ def normalize_video(video_path: str) -> str:
                     "ffmpeg",
                     "-i", video_path,
                     "-c:v", "libx264",
-                    "-vf", f"scale={ANCHO_VIDEO}:{ALTO_VIDEO}:force_original_aspect_ratio=decrease,pad={ANCHO_VIDEO}:{ALTO_VIDEO}:(ow-iw)/2:(oh-ih)/2",
+                    "-vf", FILTRO_NORMALIZACION,
                     "-r", f"{FPS_VIDEO}",
                     "-c:a", "aac",
                     "-pix_fmt", "yuv420p",
-                    "-crf", "23",
-                    "-maxrate", "2M",
-                    "-bufsize", "4M",
+                    *codificacion,
                     "-y",
                     normalized_path
                 ]
@@ -113,10 +249,11 @@ def normalize_video(video_path: str) -> str:
                     "ffmpeg",
                     "-i", video_path,
                     "-c:v", "libx264",  
-                    "-vf", f"scale={ANCHO_VIDEO}:{ALTO_VIDEO}:force_original_aspect_ratio=decrease,pad={ANCHO_VIDEO}:{ALTO_VIDEO}:(ow-iw)/2:(oh-ih)/2",
+                    "-vf", FILTRO_NORMALIZACION,
                     "-r", f"{FPS_VIDEO}",
                     "-c:a", "aac",
                     "-pix_fmt", "yuv420p",
+                    *codificacion,
                     "-y",
                     normalized_path
                 ]
@@ -131,6 +268,7 @@ def normalize_video(video_path: str) -> str:
                     "-r", f"{FPS_VIDEO}",
                     "-c:a", "aac",
                     "-pix_fmt", "yuv420p",
+                    *codificacion,
                     "-y",
                     normalized_path
                 ]
@@ -148,9 +286,10 @@ def normalize_video(video_path: str) -> str:
                 "cmd": [
                     "ffmpeg",
                     "-i", video_path,
-                    "-vf", f"scale={ANCHO_VIDEO}:{ALTO_VIDEO}:force_original_aspect_ratio=decrease,pad={ANCHO_VIDEO}:{ALTO_VIDEO}:(ow-iw)/2:(oh-ih)/2",
+                    "-vf", FILTRO_NORMALIZACION,
                     "-r", f"{FPS_VIDEO}",
                     "-c:a", "copy",  
+                    *codificacion,
                     "-y",
                     normalized_path
                 ]
@@ -161,9 +300,10 @@ def normalize_video(video_path: str) -> str:
                     "ffmpeg",
                     "-i", video_path,
                     "-c:v", "libx264",  
-                    "-vf", f"scale={ANCHO_VIDEO}:{ALTO_VIDEO}:force_original_aspect_ratio=decrease,pad={ANCHO_VIDEO}:{ALTO_VIDEO}:(ow-iw)/2:(oh-ih)/2",
+                    "-vf", FILTRO_NORMALIZACION,
                     "-r", f"{FPS_VIDEO}",
                     "-c:a", "aac",  
+                    *codificacion,
                     "-y",
                     normalized_path
                 ]
@@ -224,10 +364,12 @@ def normalize_video(video_path: str) -> str:
                         normalized_path,
                         fps=FPS_VIDEO,
                         codec='libx264',
+                        preset=get_render_profile(render_profile)["preset"],
+                        ffmpeg_params=x264_quality_args(get_render_profile(render_profile), normalizacion=True),
                         audio_codec='aac',
                         verbose=False,
                         logger=None,
-                        temp_audiofile='temp-audio.m4a',
+                        temp_audiofile=normalized_path.replace(".mp4", "_temp-audio.m4a"),
                         remove_temp=True
                     )
                     
@@ -240,6 +382,8 @@ def normalize_video(video_path: str) -> str:
                     
                     if os.path.exists(normalized_path) and os.path.getsize(normalized_path) > 0:
                         print(f"Video normalizado correctamente con MoviePy")
+                        if clave_cache:
+                            store_artifact_files("normalized", clave_cache, {"video.mp4": normalized_path})
                         return normalized_path
                     
                 except Exception as e:
@@ -266,6 +410,8 @@ def normalize_video(video_path: str) -> str:
                                
                 if os.path.exists(normalized_path) and os.path.getsize(normalized_path) > 0:
                     print(f"Video normalizado correctamente con estrategia: {strategy['name']}")
+                    if clave_cache:
+                        store_artifact_files("normalized", clave_cache, {"video.mp4": normalized_path})
                     return normalized_path
                 
         except subprocess.CalledProcessError as e:
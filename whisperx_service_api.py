@@ -26,6 +26,29 @@ def get_duration(audio_file):
     return librosa.get_duration(filename=audio_file)
 
 
+# Palabras aliñadas tal cal as usa o worker (word, start, end, speaker, color), para devolvelas no JSON da resposta.
+# Antes solo se escribia o SRT e o worker tiña que esperar polo archivo e parsealo, perdendo os tempos de cada palabra.
+# Se whisperx non puido aliñar unha palabra (numeros, simbolos) non trae tempos e quedase pegada á anterior
+def compact_word_segments(segmentos_palabras, speaker_colors=None):
+    palabras = []
+    ultimo_fin = 0.0
+    for seg in segmentos_palabras:
+        if "word" not in seg or not seg["word"].strip():
+            continue
+        inicio = seg.get("start", ultimo_fin)
+        fin = seg.get("end", inicio)
+        speaker = seg.get("speaker") if speaker_colors else None
+        palabras.append({
+            "word": seg["word"].strip(),
+            "start": round(float(inicio), 3),
+            "end": round(float(fin), 3),
+            "speaker": speaker,
+            "color": speaker_colors.get(speaker, "#FFFFFF") if speaker else None
+        })
+        ultimo_fin = fin
+    return palabras
+
+
 #Esperase un json, si existe a letra manual, faise forced aligment.
 # si language non está no payload autodetectase o idioma
 # podense probar varios modelos pero notase unha diferencia escasa polo menos nas cancions en galego que estou probando. Pode ser un error?
@@ -129,28 +152,23 @@ def align_endpoint():
             print(f"Error en speaker diarization: {e}")
             # Continuar sin diarization
 
-    #Crear srt final a nivel de palabra (con speaker info se hai)
+    palabras = compact_word_segments(segmentos_palabras, speaker_colors)
+
+    #srt final a nivel de palabra (con speaker info se hai). O worker xa non o le, quedase para workers vellos e para revisar
     ruta_srt = ruta_audio.replace(".wav", f"_whisperx_{whisper_model}.srt")
     with open(ruta_srt, "w", encoding="utf-8") as f:
-        indice = 1
-        for seg in segmentos_palabras:
-            if "word" not in seg:
-                continue
-            texto = seg["word"].strip()
-            inicio = seg["start"]
-            fin = seg["end"]
-            
-            if "speaker" in seg and speaker_colors:
-                speaker_id = seg["speaker"]
-                color = speaker_colors.get(speaker_id, "#FFFFFF")
-                texto = f"{speaker_id}|{color}|{texto}"
+        for indice, palabra in enumerate(palabras, start=1):
+            texto = palabra["word"]
+            if palabra["speaker"]:
+                texto = f"{palabra['speaker']}|{palabra['color']}|{texto}"
             
-            bloque = f"{indice}\n{sec2tc(inicio)} --> {sec2tc(fin)}\n{texto}\n\n"
+            bloque = f"{indice}\n{sec2tc(palabra['start'])} --> {sec2tc(palabra['end'])}\n{texto}\n\n"
             f.write(bloque)
-            indice += 1
 
     response_data = {
         "srt_path": ruta_srt, 
+        "word_segments": palabras,
+        "language": codigo_idioma,
         "message": "Alignment done"
     }
     